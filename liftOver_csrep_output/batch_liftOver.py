@@ -0,0 +1,90 @@
+#!/usr/bin/env python
+'''
+Given the CSREP output of many groups of samples (cell groups) and train modes in one assembly, this script maps the summary chromatin state assignment probabilities (map_state_assign_matrix.py) and the summary chromatin state maps (map_summary_chromatin_state_map.py) of all of them to another assembly in one process. The mapping index of the assembly pair (see mapping_index.py) is read only once, instead of once for each script and each group and train mode, and the state assignment matrices of all the groups are mapped by one pool of processes that share the index (one job per group and chromosome of the destination assembly). The summary chromatin state maps are then mapped one after the other through the same index.
+For each group <cg> and train mode <tm>, the inputs and outputs are the same as those of the rules map_state_assign_matrix and map_summary_chromatin_state_map of the Snakefile:
+- <org_all_ct_folder>/<cg>/<tm>/representative_data/average_predictions/<region>_avg_pred.txt.gz --> <dest_all_ct_folder>/<cg>/<tm>/representative_data/state_assign_matrix/chr<chrom>_liftOver_probState.txt.gz
+- <org_all_ct_folder>/<cg>/<tm>/representative_data/average_predictions/summary_state_track.bed.gz --> <dest_all_ct_folder>/<cg>/<tm>/representative_data/summary_state_track.bed.gz
+Output files that are up to date with their input files are not recalculated, unless --rewrite_existing_chrom is given (see manifest.py).
+Please use python batch_liftOver.py --help for full details on how to run this script.
+'''
+import os
+import argparse
+import helper
+import manifest
+import mapping_index
+import map_state_assign_matrix
+import map_summary_chromatin_state_map
+
+def get_group_folder(all_ct_folder, cell_group, train_mode):
+	return os.path.join(all_ct_folder, cell_group, train_mode, 'representative_data')
+
+def get_summary_params_fingerprint(skip_rows_sum):
+	return manifest.get_params_fingerprint({'step': 'map_summary_chromatin_state_map', 'skip_rows_sum': skip_rows_sum})
+
+def map_summary_all_groups(map_fn, map_index, group_list, org_all_ct_folder, dest_all_ct_folder, skip_rows_sum, rewrite_existing_chrom):
+	# the summary chromatin state maps of the groups in group_list (list of (cell_group, train_mode)), mapped through the same mapping index
+	job_list = list(map(lambda x: (x, os.path.join(get_group_folder(dest_all_ct_folder, *x), 'summary_state_track.bed.gz'), [os.path.join(get_group_folder(org_all_ct_folder, *x), 'average_predictions', 'summary_state_track.bed.gz'), map_fn]), group_list))
+	job_list = list(filter(lambda x: os.path.isfile(x[2][0]), job_list)) # groups without summary chromatin state maps are skipped
+	calculated_group_list = manifest.find_jobs_to_compute(job_list, get_summary_params_fingerprint(skip_rows_sum), int(rewrite_existing_chrom))
+	print('Number of summary chromatin state maps that will be mapped: {}'.format(len(calculated_group_list)))
+	job_dict = dict(map(lambda x: (x[0], x[1:]), job_list))
+	for group in calculated_group_list:
+		output_fn, input_fn_list = job_dict[group]
+		helper.create_folder_for_file(output_fn)
+		map_summary_chromatin_state_map.map_summary_chromatin_state_map(input_fn_list[0], map_index, output_fn, skip_rows_sum)
+		manifest.record_output(output_fn, get_summary_params_fingerprint(skip_rows_sum), input_fn_list)
+	return
+
+def map_assign_matrix_all_groups(map_fn, map_index, group_list, org_all_ct_folder, dest_all_ct_folder, chromhmm_state_num, rewrite_existing_chrom, num_cores):
+	# the state assignment matrices of the groups in group_list: the jobs (chromosomes of the destination assembly) of all the groups are run by the same pool of processes, that share the mapping index
+	dest_offsets_dict = map_state_assign_matrix.get_dest_offsets_dict(map_index)
+	job_list = []
+	job_weight_list = []
+	for cell_group, train_mode in group_list:
+		csrep_folder = os.path.join(get_group_folder(org_all_ct_folder, cell_group, train_mode), 'average_predictions')
+		output_folder = os.path.join(get_group_folder(dest_all_ct_folder, cell_group, train_mode), 'state_assign_matrix')
+		group_job_list, group_job_weight_list = map_state_assign_matrix.get_map_jobs_one_group(csrep_folder, map_fn, map_index, dest_offsets_dict, chromhmm_state_num, output_folder, rewrite_existing_chrom)
+		job_list += group_job_list
+		job_weight_list += group_job_weight_list
+	print('Number of chromosomes that will be mapped, over all the groups: {}'.format(len(job_list)))
+	map_state_assign_matrix.run_map_jobs(map_index, job_list, job_weight_list, num_cores)
+	return
+
+def batch_liftOver(map_fn, map_format, org_all_ct_folder, dest_all_ct_folder, cell_group_list, train_mode_list, chromhmm_state_num, skip_rows_sum, rewrite_existing_chrom, num_cores):
+	group_list = [(cg, tm) for cg in cell_group_list for tm in train_mode_list]
+	for cell_group, train_mode in group_list:
+		helper.check_dir_exist(os.path.join(get_group_folder(org_all_ct_folder, cell_group, train_mode), 'average_predictions'))
+	map_index = mapping_index.get_mapping_index(map_fn, map_format) # read once for all the groups
+	map_assign_matrix_all_groups(map_fn, map_index, group_list, org_all_ct_folder, dest_all_ct_folder, chromhmm_state_num, rewrite_existing_chrom, num_cores)
+	print('Done mapping the state assignment matrices of {} groups'.format(len(group_list)))
+	map_summary_all_groups(map_fn, map_index, group_list, org_all_ct_folder, dest_all_ct_folder, skip_rows_sum, rewrite_existing_chrom)
+	print('Done!')
+	return
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Map the summary chromatin state assignment probabilities and the summary chromatin state maps of many groups and train modes from one assembly to another, reading the mapping of genomic bins between the two assemblies only once')
+	parser.add_argument('--map_fn', type=str, required=True,
+		help = 'the 1-1 mapping of genomic bins between the two assemblies: the mapping index (.npz) written by chain_liftover.py, or a text file in the format map_format (see mapping_index.py)')
+	parser.add_argument('--map_format', type=str, required=False, default='orgDest', choices=mapping_index.MAP_FORMAT_LIST,
+		help = 'if map_fn is a text file, whether it is destOrg_fn or orgDest_fn. Not used if map_fn is a mapping index')
+	parser.add_argument('--org_all_ct_folder', type=str, required=True,
+		help = 'the folder of the CSREP output in the original assembly, with subfolders <cell_group>/<train_mode>')
+	parser.add_argument('--dest_all_ct_folder', type=str, required=True,
+		help = 'the folder where the CSREP output mapped to the destination assembly is written, with subfolders <cell_group>/<train_mode>')
+	parser.add_argument('--cell_group_list', type=str, nargs='+', required=True,
+		help = 'the cell groups to map, ex: Brain ESC')
+	parser.add_argument('--train_mode_list', type=str, nargs='+', required=True,
+		help = 'the train modes to map, ex: multi_logistic baseline')
+	parser.add_argument('--chromhmm_state_num', type=int, required=True,
+		help = 'chromhmm_state_num')
+	parser.add_argument('--skip_rows_sum', type=int, required=False, default=1,
+		help = 'the first N rows that we will skip when we read the summary chromatin state maps (see map_summary_chromatin_state_map.py)')
+	parser.add_argument('--rewrite_existing_chrom', action='store_true',
+		help = 'if this flag is present, we will rewrite all the output files. Otherwise, we only calculate the output files that are missing or out of date (see manifest.py)')
+	parser.add_argument('--num_cores', type=int, required=False, default=4,
+		help = 'number of processes that map the state assignment matrices at the same time')
+	parser.set_defaults(rewrite_existing_chrom=False)
+	args = parser.parse_args()
+	print(args)
+	helper.check_file_exist(args.map_fn)
+	batch_liftOver(args.map_fn, args.map_format, args.org_all_ct_folder, args.dest_all_ct_folder, args.cell_group_list, args.train_mode_list, args.chromhmm_state_num, args.skip_rows_sum, args.rewrite_existing_chrom, args.num_cores)
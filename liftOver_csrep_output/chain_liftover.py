@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+'''
+Given a UCSC chain file (ex: ./liftOver/hg19ToHg38.over.chain.gz) and the lengths of the chromosomes in the original assembly, this script finds the 1-1 mapping of the 200bp bins of the original assembly to the destination assembly, in one pass over the bins of each chromosome, as arrays of integers. It replaces the older steps of the pipeline, which wrote one line per bin, lifted them over with the liftOver binary, and then sorted, compared and filtered the lifted-over lines per chromosome through temporary files.
+Each bin is mapped the same way as liftOver (default options) maps a bed region:
+- the chains whose aligned blocks cover at least min_match (default 0.95, liftOver's -minMatch) of the bases of the bin are found. Bins with no such chain are not mapped (liftOver: 'Deleted in new' or 'Partially deleted in new'), and bins with more than one such chain are not mapped either (liftOver: 'Duplicated in new')
+- the bin is mapped to the interval of the destination assembly from the first to the last of its aligned bases (on the reverse strand if the chain is), so a bin can be mapped to an interval that is not exactly 200bp
+Then, bins that are mapped to intervals that overlap the interval of another bin in the destination assembly (many-to-one mappings) are removed, so the mapping is 1-1.
+Outputs:
+- bin_map_fn (.npz): the mapping index of the assembly pair, that the other scripts of this pipeline read (see mapping_index.py)
+- destOrg_fn and orgDest_fn (optional): the same mapping as the text files of the previous pipeline: dest_chrom, dest_start, dest_end, orgChrom_orgStart_orgEnd, and org_chrom, org_start, org_end, destChrom_destStart_destEnd
+Please use python chain_liftover.py --help for full details on how to run this script.
+'''
+import pandas as pd
+import numpy as np
+import argparse
+import helper
+import compressed_io
+import mapping_index
+
+BIN_MAP_KEY_LIST = mapping_index.INDEX_KEY_LIST
+
+def read_chain_file(chain_fn):
+	'''
+	--> chain_df: one row per chain: q_name, q_size, q_strand
+	--> block_dict: keys: chromosomes of the original assembly (t_name in the chain file), values: dictionary of arrays, one entry per aligned block of any chain on the chromosome: t_start, t_end, q_start (on the strand of the chain, as in the chain file) and chain (row in chain_df)
+	'''
+	chain_list = []
+	block_list_dict = {} # t_name --> list of [t_start, t_end, q_start, chain]
+	with compressed_io.open_input(chain_fn, 'rt') as inF:
+		for line in inF:
+			line_data = line.split()
+			if len(line_data) == 0:
+				continue
+			if line_data[0] == 'chain': # chain score tName tSize tStrand tStart tEnd qName qSize qStrand qStart qEnd id
+				t_name, t_pos, q_pos = line_data[2], int(line_data[5]), int(line_data[10])
+				chain_index = len(chain_list)
+				chain_list.append([line_data[7], int(line_data[8]), line_data[9]])
+				block_list = block_list_dict.setdefault(t_name, [])
+				continue
+			size = int(line_data[0]) # size [dt dq]: an aligned block of size bases, then gaps of dt and dq bases before the next block
+			block_list.append([t_pos, t_pos + size, q_pos, chain_index])
+			if len(line_data) == 3:
+				t_pos += size + int(line_data[1])
+				q_pos += size + int(line_data[2])
+	chain_df = pd.DataFrame(chain_list, columns = ['q_name', 'q_size', 'q_strand'])
+	block_dict = {}
+	for t_name, block_list in block_list_dict.items():
+		block_mat = np.array(block_list, dtype = np.int64)
+		block_dict[t_name] = dict(zip(['t_start', 't_end', 'q_start', 'chain'], block_mat.T))
+	return chain_df, block_dict
+
+def map_bins_one_chrom(chrom_blocks, num_bins, num_bp_per_bin, min_match):
+	'''
+	chrom_blocks: the aligned blocks on one chromosome of the original assembly (a value of block_dict, see read_chain_file)
+	--> org_bin, chain, q_min, q_max: the bins that are mapped by exactly one chain, the chain, and the interval of the bin in the destination assembly, on the strand of the chain
+	'''
+	empty_result = tuple(np.zeros(0, dtype = np.int64) for _ in range(4))
+	t_start, t_end = chrom_blocks['t_start'], chrom_blocks['t_end']
+	first_bin = t_start // num_bp_per_bin
+	last_bin = np.minimum((t_end - 1) // num_bp_per_bin, num_bins - 1) # inclusive
+	is_in_chrom = first_bin < num_bins
+	if not is_in_chrom.any():
+		return empty_result
+	block_index = np.flatnonzero(is_in_chrom)
+	# 1. cut the blocks into pieces, one per (block, bin) that the block overlaps
+	num_pieces = last_bin[block_index] - first_bin[block_index] + 1
+	piece_block = np.repeat(block_index, num_pieces)
+	piece_offset = np.arange(num_pieces.sum()) - np.repeat(num_pieces.cumsum() - num_pieces, num_pieces)
+	piece_bin = first_bin[piece_block] + piece_offset
+	piece_t_start = np.maximum(t_start[piece_block], piece_bin * num_bp_per_bin)
+	piece_t_end = np.minimum(t_end[piece_block], (piece_bin + 1) * num_bp_per_bin)
+	piece_q_start = chrom_blocks['q_start'][piece_block] + piece_t_start - t_start[piece_block]
+	piece_q_end = piece_q_start + piece_t_end - piece_t_start
+	piece_chain = chrom_blocks['chain'][piece_block]
+	# 2. for each (bin, chain): the number of aligned bases, and the first and last aligned bases in the destination assembly (the blocks of a chain are in increasing order on both assemblies)
+	order = np.lexsort((piece_chain, piece_bin))
+	piece_bin, piece_chain = piece_bin[order], piece_chain[order]
+	group_start = np.flatnonzero(np.concatenate([[True], (piece_bin[1:] != piece_bin[:-1]) | (piece_chain[1:] != piece_chain[:-1])]))
+	num_aligned_bp = np.add.reduceat((piece_t_end - piece_t_start)[order], group_start)
+	q_min = np.minimum.reduceat(piece_q_start[order], group_start)
+	q_max = np.maximum.reduceat(piece_q_end[order], group_start)
+	group_bin, group_chain = piece_bin[group_start], piece_chain[group_start]
+	# 3. bins that are mapped by exactly one chain with at least min_match of the bases of the bin
+	is_match = num_aligned_bp >= min_match * num_bp_per_bin
+	group_bin, group_chain, q_min, q_max = group_bin[is_match], group_chain[is_match], q_min[is_match], q_max[is_match]
+	unique_bins, bin_num_chains = np.unique(group_bin, return_counts = True)
+	is_unique = np.isin(group_bin, unique_bins[bin_num_chains == 1])
+	return group_bin[is_unique], group_chain[is_unique], q_min[is_unique], q_max[is_unique]
+
+def find_dest_collisions(dest_chrom, dest_start, dest_end):
+	# --> boolean array: whether the interval of each entry overlaps the interval of another entry in the destination assembly
+	order = np.lexsort((dest_start, dest_chrom))
+	sorted_chrom, sorted_start, sorted_end = dest_chrom[order], dest_start[order], dest_end[order]
+	is_same_chrom = sorted_chrom[1:] == sorted_chrom[:-1]
+	# the largest end of all the earlier intervals on the same chromosome: an interval overlaps an earlier one iff its start is smaller than that
+	chrom_start_index = np.flatnonzero(np.concatenate([[True], ~is_same_chrom]))
+	max_end_before = np.full(len(order), -1, dtype = np.int64)
+	for start_index, end_index in zip(chrom_start_index, np.concatenate([chrom_start_index[1:], [len(order)]])):
+		max_end_before[(start_index + 1):end_index] = np.maximum.accumulate(sorted_end[start_index:(end_index - 1)])
+	overlaps_earlier = sorted_start < max_end_before
+	# an interval that is overlapped by a later interval is also overlapped by the next interval, because the intervals are sorted by start
+	overlaps_later = np.concatenate([is_same_chrom & (sorted_end[:-1] > sorted_start[1:]), [False]])
+	result = np.zeros(len(order), dtype = bool)
+	result[order] = overlaps_earlier | overlaps_later
+	return result
+
+def build_bin_map(chain_fn, chrom_length_fn, num_bp_per_bin, min_match, dest_chrom_list):
+	'''
+	chrom_length_fn: chrom, start (0), end (chromosome length). The bins of each chromosome are 0 --> int(length / num_bp_per_bin) - 1, as in the older steps of the pipeline
+	dest_chrom_list: only keep the bins that are mapped to these chromosomes of the destination assembly (ex: to leave out alternative haplotypes), or None to keep all
+	--> bin_map: the mapping index (see mapping_index.py)
+	'''
+	chain_df, block_dict = read_chain_file(chain_fn)
+	chrom_len_df = pd.read_csv(chrom_length_fn, header = None, sep = '\t', index_col = None)
+	chrom_len_df.columns = ['chrom', 'start', 'end']
+	chrom_names = sorted(set(chrom_len_df['chrom']) | set(chain_df['q_name']))
+	chrom_code_dict = dict(zip(chrom_names, range(len(chrom_names))))
+	chain_dest_chrom = chain_df['q_name'].map(chrom_code_dict).values
+	result_list = []
+	for chrom, chrom_length in sorted(zip(chrom_len_df['chrom'], chrom_len_df['end'])):
+		if chrom not in block_dict:
+			continue
+		org_bin, chain, q_min, q_max = map_bins_one_chrom(block_dict[chrom], int(chrom_length / num_bp_per_bin), num_bp_per_bin, min_match)
+		q_size, is_reverse = chain_df['q_size'].values[chain], chain_df['q_strand'].values[chain] == '-'
+		dest_start = np.where(is_reverse, q_size - q_max, q_min) # coordinates on the reverse strand --> on the forward strand
+		dest_end = np.where(is_reverse, q_size - q_min, q_max)
+		result_list.append([np.full(len(org_bin), chrom_code_dict[chrom]), org_bin, chain_dest_chrom[chain], dest_start, dest_end])
+		print('Done mapping {}: {} bins mapped by one chain, out of {}'.format(chrom, len(org_bin), int(chrom_length / num_bp_per_bin)))
+	bin_map = dict(zip(BIN_MAP_KEY_LIST, map(lambda x: np.concatenate(x).astype(np.int64), zip(*result_list))))
+	if dest_chrom_list is not None:
+		is_in_dest_list = np.isin(bin_map['dest_chrom'], list(map(lambda x: chrom_code_dict.get(x, -1), dest_chrom_list)))
+		bin_map = dict(map(lambda x: (x, bin_map[x][is_in_dest_list]), BIN_MAP_KEY_LIST))
+	is_collision = find_dest_collisions(bin_map['dest_chrom'], bin_map['dest_start'], bin_map['dest_end'])
+	print('Number of bins removed because they are mapped onto the same bases as other bins: {}'.format(is_collision.sum()))
+	bin_map = dict(map(lambda x: (x, bin_map[x][~is_collision]), BIN_MAP_KEY_LIST))
+	bin_map['chrom_names'] = chrom_names
+	return mapping_index.sort_mapping_index(bin_map)
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Given a UCSC chain file and the lengths of the chromosomes in the original assembly, find the 1-1 mapping of the genomic bins of the original assembly to the destination assembly (bins that are mapped to the same bases as other bins are removed), without the liftOver binary.')
+	parser.add_argument('--chain_fn', type = str, required = True,
+		help = 'chain file, ex: ./liftOver/hg19ToHg38.over.chain.gz')
+	parser.add_argument('--chrom_length_fn', type = str, required = True,
+		help = '3 columns: chrom, start(0), end (chrom_lengths), of the original assembly')
+	parser.add_argument('--bin_map_fn', type = str, required = True,
+		help = 'the binary index of the mapping (.npz), see the top of this file')
+	parser.add_argument('--destOrg_fn', type = str, required = False, default = None,
+		help = 'if given, the mapping is also written as a text file with columns: chrom, start, end (in the destination assembly), orgChrom_orgStart_orgEnd')
+	parser.add_argument('--orgDest_fn', type = str, required = False, default = None,
+		help = 'if given, the mapping is also written as a text file with columns: chrom, start, end (in the original assembly), destChrom_destStart_destEnd')
+	parser.add_argument('--dest_chrom_list', type = str, nargs = '+', required = False, default = None,
+		help = 'only keep the bins that are mapped to these chromosomes of the destination assembly (ex: chr1 chr2 ... chrX). Default: all chromosomes')
+	parser.add_argument('--min_match', type = float, required = False, default = 0.95,
+		help = 'minimum fraction of the bases of a bin that must be aligned by a chain for the bin to be mapped, same as -minMatch of liftOver')
+	parser.add_argument('--NUM_BP_PER_BIN', type = int, required = False, default = helper.NUM_BP_PER_BIN,
+		help = 'size of the bin that we are trying to divide the genome into')
+	args = parser.parse_args()
+	print(args)
+	helper.check_file_exist(args.chain_fn)
+	helper.check_file_exist(args.chrom_length_fn)
+	helper.create_folder_for_file(args.bin_map_fn)
+	bin_map = build_bin_map(args.chain_fn, args.chrom_length_fn, args.NUM_BP_PER_BIN, args.min_match, args.dest_chrom_list)
+	mapping_index.save_mapping_index(bin_map, args.bin_map_fn)
+	if args.destOrg_fn is not None:
+		mapping_index.write_text_map(bin_map, args.destOrg_fn, 'destOrg', args.NUM_BP_PER_BIN)
+	if args.orgDest_fn is not None:
+		mapping_index.write_text_map(bin_map, args.orgDest_fn, 'orgDest', args.NUM_BP_PER_BIN)
+	print('Done!')
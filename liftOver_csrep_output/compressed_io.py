@@ -0,0 +1,158 @@
+#!/usr/bin/env python
+
+'''
+This file contains the writer (and reader) of the compressed output files of the pipeline, so that the codec of each step can be chosen, and files are compressed by several threads.
+Before, each step wrote its files with pandas' to_csv(..., compression = 'gzip') or gzip.open, single-threaded at gzip's highest level (9), and compression took most of the time of writing the outputs.
+Codecs are given as '<codec>[:<level>]':
+- 'gzip[:level]': level 1 (fastest) --> 9 (smallest). The data is cut into blocks of BLOCK_SIZE bytes, each compressed into its own gzip member by one of the threads, and the members are written one after the other. Files with several members are standard gzip files (gzip -d, zcat, pandas, python's gzip module read them as one file)
+- 'zstd[:level]' (python package zstandard) and 'lz4[:level]' (python package lz4): much faster than gzip. The blocks are compressed into frames, written one after the other. These files keep the file names of the pipeline (ex: <window>_avg_pred.txt.gz), and can only be read by the scripts of CSREP (open_input recognizes the codec from the first bytes of the file), or after decompressing them with zstd -d / lz4 -d
+The codec and the number of threads of a step are given by the environment variables CODEC_ENV_VAR and NUM_THREADS_ENV_VAR (set by the Snakefile from output_codec and compress_threads in config/config.yaml), or DEFAULT_CODEC and 1 thread if they are not set, so that the scripts do not need a new argument for them, and processes started by the scripts use the same codec.
+
+List of functions:
+- parse_codec(codec_spec) --> codec, level. ex: 'gzip:6' --> 'gzip', 6
+- open_output(output_fn, mode, codec_spec, num_threads) --> file object to write into ('wb' or 'wt'), that compresses the data with codec_spec
+- open_input(fn, mode) --> file object to read from ('rb' or 'rt'), for files compressed with any of the codecs (or not compressed)
+- read_compressed(fn) --> the decompressed content of fn (bytes)
+'''
+import io
+import os
+import gzip
+import zlib
+import collections
+from concurrent.futures import ThreadPoolExecutor
+try:
+	import zstandard
+except ImportError:
+	zstandard = None
+try:
+	import lz4.frame
+except ImportError:
+	lz4 = None
+
+CODEC_LIST = ['gzip', 'zstd', 'lz4']
+DEFAULT_CODEC = 'gzip:6' # 1.5 to 7 times faster than level 9 on the test data and the outputs of CSREP, and less than 1% bigger (see benchmark_compression.py)
+DEFAULT_LEVEL_DICT = {'gzip': 6, 'zstd': 3, 'lz4': 0}
+CODEC_ENV_VAR = 'CSREP_OUTPUT_CODEC'
+NUM_THREADS_ENV_VAR = 'CSREP_COMPRESS_THREADS'
+BLOCK_SIZE = 1 << 20 # 1MB of uncompressed data per block. Bigger blocks compress slightly better, smaller blocks spread better over the threads
+MAGIC_DICT = {'gzip': b'\x1f\x8b', 'zstd': b'\x28\xb5\x2f\xfd', 'lz4': b'\x04\x22\x4d\x18'}
+
+def parse_codec(codec_spec):
+	# 'gzip:6' --> 'gzip', 6; 'zstd' --> 'zstd', 3 (DEFAULT_LEVEL_DICT)
+	codec = codec_spec.split(':')[0]
+	assert codec in CODEC_LIST, 'codec {} should be one of {}'.format(codec_spec, CODEC_LIST)
+	level = int(codec_spec.split(':')[1]) if ':' in codec_spec else DEFAULT_LEVEL_DICT[codec]
+	if codec == 'gzip':
+		assert level >= 1 and level <= 9, 'The level of gzip should be 1 --> 9, got {}'.format(codec_spec)
+	assert codec != 'zstd' or zstandard is not None, 'codec {}: the python package zstandard is not installed'.format(codec_spec)
+	assert codec != 'lz4' or lz4 is not None, 'codec {}: the python package lz4 is not installed'.format(codec_spec)
+	return codec, level
+
+def get_default_codec():
+	return os.environ.get(CODEC_ENV_VAR, DEFAULT_CODEC)
+
+def get_default_num_threads():
+	return int(os.environ.get(NUM_THREADS_ENV_VAR, 1))
+
+def compress_block(block, codec, level):
+	# the three libraries release the GIL while they compress, so blocks are compressed in parallel by threads
+	if codec == 'gzip':
+		compressor = zlib.compressobj(level, zlib.DEFLATED, 31) # wbits = 31: a complete gzip member, with header and crc. zlib.compress only takes wbits from python 3.11
+		return compressor.compress(block) + compressor.flush()
+	if codec == 'zstd':
+		return zstandard.ZstdCompressor(level = level, write_content_size = True).compress(block)
+	return lz4.frame.compress(block, compression_level = level)
+
+class BlockCompressedWriter(io.RawIOBase):
+	'''
+	Binary file object: the data written into it is cut into blocks of BLOCK_SIZE bytes, that are compressed by num_threads threads, and written into output_fn in order
+	At most 2 * num_threads blocks are waiting to be written at any time, so the memory used does not depend on the size of the file
+	'''
+	def __init__(self, output_fn, codec_spec, num_threads):
+		self.codec, self.level = parse_codec(codec_spec)
+		self.outF = open(output_fn, 'wb')
+		self.executor = ThreadPoolExecutor(max_workers = num_threads) if num_threads > 1 else None
+		self.max_pending = 2 * num_threads
+		self.pending = collections.deque() # compressed blocks (futures) not yet written, in the order of the data
+		self.buffer = bytearray()
+		self.num_blocks = 0
+
+	def writable(self):
+		return True
+
+	def write(self, data):
+		self.buffer += data
+		while len(self.buffer) >= BLOCK_SIZE:
+			self.submit_block(bytes(self.buffer[:BLOCK_SIZE]))
+			del self.buffer[:BLOCK_SIZE]
+		return len(data)
+
+	def submit_block(self, block):
+		self.num_blocks += 1
+		if self.executor is None:
+			self.outF.write(compress_block(block, self.codec, self.level))
+			return
+		self.pending.append(self.executor.submit(compress_block, block, self.codec, self.level))
+		while len(self.pending) >= self.max_pending:
+			self.outF.write(self.pending.popleft().result())
+		return
+
+	def close(self):
+		if self.closed:
+			return
+		try:
+			if len(self.buffer) > 0 or self.num_blocks == 0: # an empty file still gets one (empty) block, so that it is a valid compressed file
+				self.submit_block(bytes(self.buffer))
+				self.buffer = bytearray()
+			while len(self.pending) > 0:
+				self.outF.write(self.pending.popleft().result())
+		finally:
+			if self.executor is not None:
+				self.executor.shutdown()
+			self.outF.close()
+			io.RawIOBase.close(self)
+
+def open_output(output_fn, mode = 'wb', codec_spec = None, num_threads = None):
+	'''
+	output_fn: the file to write (to write the file atomically, give the temporary file of manifest.atomic_output)
+	mode: 'wb' (bytes, ex: np.save) or 'wt' (text, ex: df.to_csv)
+	codec_spec, num_threads: default: from the environment variables CODEC_ENV_VAR and NUM_THREADS_ENV_VAR (see the top of this file)
+	usage: with open_output(output_fn, 'wt') as outF: df.to_csv(outF, sep = '\t')
+	'''
+	assert mode in ['wb', 'wt'], 'mode should be wb or wt'
+	codec_spec = get_default_codec() if codec_spec is None else codec_spec
+	num_threads = get_default_num_threads() if num_threads is None else num_threads
+	outF = io.BufferedWriter(BlockCompressedWriter(output_fn, codec_spec, num_threads), buffer_size = BLOCK_SIZE)
+	if mode == 'wt':
+		return io.TextIOWrapper(outF, encoding = 'utf-8', newline = '')
+	return outF
+
+def get_codec_of_file(fn):
+	# the codec that fn is compressed with, from its first bytes, or None if it is not compressed
+	with open(fn, 'rb') as inF:
+		magic = inF.read(4)
+	for codec, codec_magic in MAGIC_DICT.items():
+		if magic.startswith(codec_magic):
+			return codec
+	return None
+
+def open_input(fn, mode = 'rb'):
+	assert mode in ['rb', 'rt'], 'mode should be rb or rt'
+	codec = get_codec_of_file(fn)
+	if codec == 'gzip':
+		inF = gzip.open(fn, 'rb')
+	elif codec == 'zstd':
+		assert zstandard is not None, 'File {} is compressed with zstd, but the python package zstandard is not installed'.format(fn)
+		inF = zstandard.ZstdDecompressor().stream_reader(open(fn, 'rb'), read_across_frames = True, closefd = True)
+	elif codec == 'lz4':
+		assert lz4 is not None, 'File {} is compressed with lz4, but the python package lz4 is not installed'.format(fn)
+		inF = lz4.frame.open(fn, 'rb')
+	else:
+		inF = open(fn, 'rb')
+	if mode == 'rt':
+		return io.TextIOWrapper(io.BufferedReader(inF) if codec == 'zstd' else inF, encoding = 'utf-8')
+	return inF
+
+def read_compressed(fn):
+	with open_input(fn, 'rb') as inF:
+		return inF.read()
@@ -0,0 +1,116 @@
+#!/usr/bin/env python
+
+'''
+This file contains functions to write, and read, the genome matrix layout of an output folder of chromatin state assignment probabilities (average_predictions of a group, or a differential folder): the probabilities of all the windows of a chromosome in one .npy array (rows: bins, columns: states, values: GENOME_MATRIX_DTYPE), that can be memory-mapped, plus an index of where each window is in the arrays. The steps that go over the whole genome (calculate_diff_rep_state_map.py, get_summary_map_from_avg_matrix.py, liftOver_csrep_output/map_state_assign_matrix.py) then read each window as a slice of the memory-mapped array of its chromosome (no copy), instead of opening, decompressing and parsing its file.
+The layout is written alongside the window files (<window>_avg_pred.txt.gz), which are still the outputs that the pipeline keeps track of. The layout is recorded in the manifest (see manifest.py) of its folder, with the window files it was built from, and the steps above only use it if it is up to date with the window files. Otherwise, they read the window files as before.
+Structure (inside the output folder):
+|__ GENOME_MATRIX_FOLDER
+|   |__ <chrom>.npy: rows: the bins of the windows of the chromosome (in the order of the windows), columns: state_1 --> state_<num_chromHMM_state>
+|   |__ OFFSETS_FN: num_chromHMM_state, dtype, and for each chromosome: window_index (ex: 3 for chr1_3), start_row (the row of the first bin of the window in <chrom>.npy) and num_bins of its windows
+Run as a script to build the layout of a folder: python genome_matrix.py <folder> <num_chromHMM_state> [file_suffix]
+
+List of functions:
+- build_genome_matrix(folder, num_chromHMM_state, file_suffix) --> write the layout of folder, from the files <window><file_suffix> (in any format of prob_matrix.py)
+- get_genome_matrix(folder, num_chromHMM_state, file_suffix) --> the offsets of the layout of folder (a dictionary), or None if the layout is missing or out of date
+- get_window_mat(genome_matrix, window) --> rows: the bins of window (ex: chr1_3), columns: states. A view of the memory-mapped array of the chromosome
+'''
+import os
+import sys
+import glob
+import json
+import numpy as np
+import helper
+import manifest
+import prob_matrix
+
+GENOME_MATRIX_FOLDER = 'genome_matrix'
+OFFSETS_FN = 'offsets.json'
+GENOME_MATRIX_DTYPE = 'float32' # the average probabilities are calculated in float32 (see average_pred_results.py)
+AVG_FILE_SUFFIX = '_avg_pred.txt.gz'
+
+def get_window_list(folder, file_suffix):
+	# windows sorted by chromosome and then by the window index: chr1_0, chr1_1, ..., chr1_24, chr10_0, ...
+	window_fn_list = glob.glob(os.path.join(folder, 'chr*' + file_suffix))
+	window_list = list(map(lambda x: os.path.basename(x).split(file_suffix)[0], window_fn_list)) # from /path/to/chr9_14_avg_pred.txt.gz --> chr9_14
+	return sorted(window_list, key = lambda x: (x.split('_')[0], int(x.split('_')[1])))
+
+def get_chrom_mat_fn(folder, chrom):
+	return os.path.join(folder, GENOME_MATRIX_FOLDER, chrom + '.npy')
+
+def get_offsets_fn(folder):
+	return os.path.join(folder, GENOME_MATRIX_FOLDER, OFFSETS_FN)
+
+def get_genome_matrix_params_fingerprint(num_chromHMM_state):
+	return manifest.get_params_fingerprint({'step': 'genome_matrix', 'num_chromHMM_state': num_chromHMM_state, 'dtype': GENOME_MATRIX_DTYPE})
+
+def get_genome_matrix_input_fn_list(folder, window_list, file_suffix):
+	# the window files, and the arrays of their chromosomes (so that the layout is not used if an array was removed or rewritten)
+	chrom_list = sorted(set(map(lambda x: x.split('_')[0], window_list)))
+	return list(map(lambda x: os.path.join(folder, x + file_suffix), window_list)) + list(map(lambda x: get_chrom_mat_fn(folder, x), chrom_list))
+
+def build_genome_matrix(folder, num_chromHMM_state, file_suffix = AVG_FILE_SUFFIX):
+	# one chromosome at a time: its windows are read as runs (see prob_matrix.read_rle_prob_mat), which take little memory, and expanded into the array of the chromosome, written directly into the .npy file
+	helper.make_dir(os.path.join(folder, GENOME_MATRIX_FOLDER))
+	window_list = get_window_list(folder, file_suffix)
+	offsets = {'num_chromHMM_state': num_chromHMM_state, 'dtype': GENOME_MATRIX_DTYPE, 'chrom': {}}
+	for chrom in sorted(set(map(lambda x: x.split('_')[0], window_list))):
+		chrom_window_list = list(filter(lambda x: x.split('_')[0] == chrom, window_list))
+		rle_mat_list = list(map(lambda x: prob_matrix.read_rle_prob_mat(os.path.join(folder, x + file_suffix), num_chromHMM_state), chrom_window_list))
+		num_bins_list = list(map(lambda x: int(x[0][-1]) if len(x[0]) > 0 else 0, rle_mat_list))
+		start_row_list = list(np.cumsum([0] + num_bins_list[:-1]).astype(int))
+		chrom_mat_fn = get_chrom_mat_fn(folder, chrom)
+		with manifest.atomic_output(chrom_mat_fn) as temp_fn:
+			chrom_mat = np.lib.format.open_memmap(temp_fn, mode = 'w+', dtype = GENOME_MATRIX_DTYPE, shape = (sum(num_bins_list), num_chromHMM_state))
+			for (run_end_bins, run_prob_mat), start_row, num_bins in zip(rle_mat_list, start_row_list, num_bins_list):
+				chrom_mat[start_row:(start_row + num_bins)] = prob_matrix.expand_rle_prob_mat(run_end_bins, run_prob_mat)
+			chrom_mat.flush()
+			del chrom_mat
+		offsets['chrom'][chrom] = {'window_index': list(map(lambda x: int(x.split('_')[1]), chrom_window_list)), 'start_row': list(map(int, start_row_list)), 'num_bins': num_bins_list}
+	offsets_fn = get_offsets_fn(folder)
+	with manifest.atomic_output(offsets_fn) as temp_fn:
+		with open(temp_fn, 'w') as outF:
+			json.dump(offsets, outF)
+	manifest.record_output(offsets_fn, get_genome_matrix_params_fingerprint(num_chromHMM_state), get_genome_matrix_input_fn_list(folder, window_list, file_suffix))
+	print('Done building the genome matrix of {} windows in {}'.format(len(window_list), folder))
+	return
+
+def read_genome_matrix(folder):
+	with open(get_offsets_fn(folder), 'r') as inF:
+		genome_matrix = json.load(inF)
+	genome_matrix['folder'] = folder
+	genome_matrix['chrom_mat'] = {} # keys: chromosomes, values: their memory-mapped arrays, opened the first time a window of the chromosome is read
+	for chrom_offsets in genome_matrix['chrom'].values():
+		chrom_offsets['window_dict'] = dict(zip(chrom_offsets['window_index'], zip(chrom_offsets['start_row'], chrom_offsets['num_bins']))) # window_index --> (start_row, num_bins)
+	return genome_matrix
+
+def get_genome_matrix(folder, num_chromHMM_state, file_suffix = AVG_FILE_SUFFIX):
+	# the layout is up to date if it was built from the same window files as those that are in folder now (see manifest.py). The check only looks at the sizes and modification times of the files
+	if not os.path.isfile(get_offsets_fn(folder)):
+		return None
+	window_list = get_window_list(folder, file_suffix)
+	job_list = [(folder, get_offsets_fn(folder), get_genome_matrix_input_fn_list(folder, window_list, file_suffix))]
+	if len(manifest.find_jobs_to_compute(job_list, get_genome_matrix_params_fingerprint(num_chromHMM_state), 0)) > 0:
+		return None
+	return read_genome_matrix(folder)
+
+def get_chrom_mat(genome_matrix, chrom):
+	if chrom not in genome_matrix['chrom_mat']:
+		genome_matrix['chrom_mat'][chrom] = np.load(get_chrom_mat_fn(genome_matrix['folder'], chrom), mmap_mode = 'r')
+	return genome_matrix['chrom_mat'][chrom]
+
+def get_window_mat(genome_matrix, window):
+	# window: ex: chr1_3 --> rows: bins of the window, columns: states. Only the rows that are used are read from the disk
+	chrom, window_index = window.split('_')[0], int(window.split('_')[1])
+	start_row, num_bins = genome_matrix['chrom'][chrom]['window_dict'][window_index]
+	return get_chrom_mat(genome_matrix, chrom)[start_row:(start_row + num_bins)]
+
+if __name__ == '__main__':
+	if len(sys.argv) not in [3, 4]:
+		print('python genome_matrix.py <folder> <num_chromHMM_state> [file_suffix, default {}]'.format(AVG_FILE_SUFFIX))
+		print('Write the genome matrix layout of folder (one memory-mappable array per chromosome, see the top of this file), alongside its window files')
+		exit(1)
+	folder = sys.argv[1]
+	helper.check_dir_exist(folder)
+	num_chromHMM_state = helper.get_command_line_integer(sys.argv[2])
+	file_suffix = sys.argv[3] if len(sys.argv) == 4 else AVG_FILE_SUFFIX
+	build_genome_matrix(folder, num_chromHMM_state, file_suffix)
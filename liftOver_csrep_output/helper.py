@@ -14,14 +14,19 @@ List of functions:
 - create_folder_for_file(fn) --> usually used when fn is an output file path. This function will create the folder that contains the file fn
 - check_dir_exist(dir_path) --> if not, exit the program
 - get_command_line_integer(argument) --> try to convert to integer, if not succesfully then exit the program. This function is not entirely useful anymore given that we use argparse for all our scripts now. 
-- get_list_from_line_seperated_file(fn) --> read in a file such that each line is an item in a list, using pandas series
-- partition_file_list (file_list, num_cores) --> partition the file_list into a list of num_cores lists, as evely distributed as possible. Useful when we want to partition the list of outptu files into lists that can then be divided for different cores  to produce in parallel. 
+- get_list_from_line_seperated_file(fn) --> read in a file such that each line is an item in a list
+- run_weighted_jobs(job_function, job_args_list, job_weight_list, num_cores) --> run the jobs on a pool of num_cores processes, heaviest jobs first, each worker taking the next job as soon as it is free. Useful when we want to produce many output files (genomic regions, chromosomes) of different sizes in parallel.
+- run_jobs_as_produced(job_function, job_args_iterator, num_cores) --> similar to run_weighted_jobs, for jobs that are produced one at a time by a generator, with at most num_cores jobs in flight.
+- iterate_jobs_in_order(job_function, job_args_list, num_cores) --> run the jobs on a pool of num_cores processes, and yield their return values in the order of job_args_list as soon as they are available. Useful when the results have to be written into one output file in a given order (ex: genomic order).
+- get_file_size_list(fn_list) --> file sizes, to be used as job weights in run_weighted_jobs
 '''
 
 import string
 import os
 import sys
-import pandas as pd 
+import threading
+import multiprocessing as mp
+import numpy as np
 
 CHROMOSOME_LIST = ['1', '2', '3', '4', '5', '6', '7', '8', '9', '10', '11', '12', '13', '14', '15', '16', '17', '18', '19', '20', '21', '22', 'X'] # we exclude chromosome Y because it's not available in all cell types
 
@@ -65,16 +70,65 @@ def get_command_line_integer(arg):
 
 def get_list_from_line_seperated_file(fn):
 	# from a text file where each line contains an item, we will get a list of the items
-	result =  list(pd.read_csv(fn, sep = '\n', header = None)[0]) # -->  a list with each entry being an element in a list. Note the [0] is necessary for us to get the first column
+	with open(fn, 'r') as inF:
+		result = [line.strip() for line in inF]
+	result = list(filter(lambda x: x != '', result)) # skip empty lines
 	return result
 
-def partition_file_list(file_list, num_cores):
-	results = [] # list of lists of file names
-	num_files_per_core = int(len(file_list) / num_cores)
-	for core_i in range(num_cores):
-		if core_i < (num_cores - 1):
-			this_core_files = file_list[core_i * num_files_per_core : (core_i + 1) * num_files_per_core]
-		elif core_i == (num_cores - 1):
-			this_core_files = file_list[core_i * num_files_per_core :]
-		results.append(this_core_files)
+def _run_one_indexed_job(indexed_job):
+	# used by run_weighted_jobs: run one job inside a worker process, and report the job's index so that results can be put back in the original order
+	job_index, job_function, job_args = indexed_job
+	return job_index, job_function(*job_args)
+
+def run_weighted_jobs(job_function, job_args_list, job_weight_list, num_cores):
+	'''
+	Run job_function(*job_args) for each job_args in job_args_list, using a pool of num_cores processes. Jobs are handed out from the heaviest to the lightest (job_weight_list: number of genomic bins, file size, etc. of each job), and each worker takes the next job as soon as it is done with its current one. Therefore, workers finish at about the same time even when jobs have very different sizes (ex: chr1 vs. chr21), unlike when we split the jobs into num_cores fixed slices.
+	Return the list of the jobs' return values, in the same order as job_args_list.
+	'''
+	assert len(job_args_list) == len(job_weight_list), 'Each job should have exactly one weight'
+	job_order = np.argsort(-np.array(job_weight_list, dtype = float), kind = 'stable') # heaviest first
+	indexed_job_list = list(map(lambda x: (x, job_function, job_args_list[x]), job_order))
+	results = [None] * len(job_args_list)
+	if num_cores <= 1 or len(job_args_list) <= 1: # no need to start other processes
+		for indexed_job in indexed_job_list:
+			job_index, result = _run_one_indexed_job(indexed_job)
+			results[job_index] = result
+		return results
+	with mp.Pool(min(num_cores, len(job_args_list))) as pool:
+		for job_index, result in pool.imap_unordered(_run_one_indexed_job, indexed_job_list, chunksize = 1):
+			results[job_index] = result
+	return results
+
+def run_jobs_as_produced(job_function, job_args_iterator, num_cores):
+	'''
+	Similar to run_weighted_jobs, but the jobs are produced one at a time by job_args_iterator (ex: a generator that streams input files). At most num_cores jobs are waiting or running at any time, so the producer does not run ahead of the workers and the memory used by jobs' arguments stays bounded. 
+	Return the list of the jobs' return values, in the order that the jobs were produced.
+	'''
+	if num_cores <= 1:
+		return list(map(lambda x: job_function(*x), job_args_iterator))
+	free_slots = threading.Semaphore(num_cores)
+	async_result_list = []
+	with mp.Pool(num_cores) as pool:
+		for job_args in job_args_iterator:
+			free_slots.acquire() # wait until one of the workers is free
+			async_result_list.append(pool.apply_async(job_function, job_args, callback = lambda x: free_slots.release(), error_callback = lambda x: free_slots.release()))
+		results = list(map(lambda x: x.get(), async_result_list)) # .get() raises the error if a job failed
 	return results
+
+def iterate_jobs_in_order(job_function, job_args_list, num_cores):
+	'''
+	Generator: run job_function(*job_args) for each job_args in job_args_list, using a pool of num_cores processes, and yield the jobs' return values in the same order as job_args_list. Workers keep taking the next jobs while the caller is processing the results of the earlier jobs, so the caller can write results to one file in order without waiting for all the jobs to finish.
+	'''
+	indexed_job_list = list(map(lambda x: (x, job_function, job_args_list[x]), range(len(job_args_list))))
+	if num_cores <= 1 or len(job_args_list) <= 1:
+		for indexed_job in indexed_job_list:
+			yield _run_one_indexed_job(indexed_job)[1]
+		return
+	with mp.Pool(min(num_cores, len(job_args_list))) as pool:
+		for job_index, result in pool.imap(_run_one_indexed_job, indexed_job_list, chunksize = 1):
+			yield result
+	return
+
+def get_file_size_list(fn_list):
+	# size (bytes) of each file, used as job weights in run_weighted_jobs. Files that do not exist have size 0
+	return list(map(lambda x: os.path.getsize(x) if os.path.isfile(x) else 0, fn_list))
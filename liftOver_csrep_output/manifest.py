@@ -0,0 +1,106 @@
+#!/usr/bin/env python
+
+'''
+This file contains functions to keep track of which output files of a step of the pipeline are complete and up to date, so that when a step is rerun, it only recomputes the output files that are missing, were cut short by a killed job, or were calculated from different inputs or parameters. Before, any existing output file was treated as done, and the only other option was to recompute the whole genome with replace_existing_files = 1.
+Each output folder has a manifest file (MANIFEST_FN). Each line of the manifest is a JSON record, appended once an output file is completely written:
+{"output": <name of the output file>, "params": <fingerprint of the step's parameters>, "inputs": {<input file>: [size, modification time (ns)]}, "size": <size of the output file>}
+|__ Each record is appended with a single write call, so processes that write into the same folder at the same time do not mix up their records. A record cut short by a killed job is ignored, and each record starts on a new line so that the next record is still read.
+|__ If an output file is recorded more than once, the last record is used.
+An output file is up to date if its last record has the same parameters, the same input files with the same sizes and modification times, and the output file still has the recorded size.
+Output files are first written under a temporary name in the same folder, and renamed when they are complete (atomic_output), so a killed job never leaves a partial file under the final name.
+
+List of functions:
+- get_params_fingerprint(params) --> a short string that changes whenever the dictionary params changes
+- get_file_fingerprint(fn) --> [size, modification time] of fn
+- atomic_output(output_fn) --> context manager that yields the temporary file name to write into, and renames it to output_fn at the end
+- record_output(output_fn, params_fingerprint, input_fn_list) --> append the record of output_fn to the manifest of its folder
+- read_manifest(output_folder) --> dictionary, keys: output file names, values: their last records
+- is_output_up_to_date(output_fn, record, params_fingerprint, input_fn_list) --> True/False
+- find_jobs_to_compute(job_list, params_fingerprint, replace_existing_files) --> the jobs whose output files are not up to date
+'''
+import os
+import json
+import hashlib
+import contextlib
+
+MANIFEST_FN = 'manifest.jsonl'
+TEMP_PREFIX = '.tmp' # temporary files start with '.', so that they are not picked up by the glob patterns of other steps (ex: chr*_avg_pred.txt.gz)
+
+def get_params_fingerprint(params):
+	# params: a dictionary that can be written as json. The keys are sorted, so that the fingerprint does not depend on the order in which they are given
+	return hashlib.sha1(json.dumps(params, sort_keys = True).encode()).hexdigest()
+
+def get_file_fingerprint(fn):
+	# comparing sizes and modification times is much cheaper than hashing the files, and it changes whenever a file is rewritten
+	stat = os.stat(fn)
+	return [stat.st_size, stat.st_mtime_ns]
+
+def get_manifest_fn(output_folder):
+	return os.path.join(output_folder, MANIFEST_FN)
+
+@contextlib.contextmanager
+def atomic_output(output_fn):
+	# usage: with atomic_output(output_fn) as temp_fn: df.to_csv(temp_fn, ...). The temporary file keeps the suffix of output_fn, so that functions that infer the compression from the suffix still work
+	temp_fn = os.path.join(os.path.dirname(output_fn), '{}{}_{}'.format(TEMP_PREFIX, os.getpid(), os.path.basename(output_fn)))
+	try:
+		yield temp_fn
+		os.replace(temp_fn, output_fn)
+	finally:
+		if os.path.isfile(temp_fn):
+			os.remove(temp_fn)
+
+def record_output(output_fn, params_fingerprint, input_fn_list):
+	record = {'output': os.path.basename(output_fn), 'params': params_fingerprint, 'inputs': dict(map(lambda x: (os.path.abspath(x), get_file_fingerprint(x)), input_fn_list)), 'size': os.path.getsize(output_fn)}
+	line = ('\n' + json.dumps(record)).encode() # the record starts with a new line, so that it is not glued to the end of a record that was cut short by a killed job
+	fd = os.open(get_manifest_fn(os.path.dirname(os.path.abspath(output_fn))), os.O_WRONLY | os.O_APPEND | os.O_CREAT, 0o644)
+	try:
+		os.write(fd, line)
+	finally:
+		os.close(fd)
+	return
+
+def read_manifest(output_folder):
+	manifest_fn = get_manifest_fn(output_folder)
+	record_dict = {}
+	if not os.path.isfile(manifest_fn):
+		return record_dict
+	with open(manifest_fn, 'r') as inF:
+		for line in inF:
+			if line.strip() == '':
+				continue
+			try:
+				record = json.loads(line)
+			except ValueError: # a record cut short by a killed job
+				continue
+			record_dict[record['output']] = record
+	return record_dict
+
+def is_output_up_to_date(output_fn, record, params_fingerprint, input_fn_list):
+	if record is None or record['params'] != params_fingerprint:
+		return False
+	if not os.path.isfile(output_fn) or os.path.getsize(output_fn) != record['size']:
+		return False
+	if set(record['inputs'].keys()) != set(map(os.path.abspath, input_fn_list)):
+		return False
+	for input_fn in input_fn_list:
+		if not os.path.isfile(input_fn) or get_file_fingerprint(input_fn) != record['inputs'][os.path.abspath(input_fn)]:
+			return False
+	return True
+
+def find_jobs_to_compute(job_list, params_fingerprint, replace_existing_files):
+	'''
+	job_list: list of (job, output_fn, input_fn_list). job can be anything that identifies the job (ex: a window chr1_0)
+	Return the list of jobs whose output files are not up to date (all the jobs if replace_existing_files == 1), in the order of job_list
+	'''
+	if replace_existing_files == 1:
+		return list(map(lambda x: x[0], job_list))
+	manifest_dict = {} # keys: output folders, values: their manifests, so that each manifest is read once
+	result = []
+	for job, output_fn, input_fn_list in job_list:
+		output_folder = os.path.dirname(os.path.abspath(output_fn))
+		if output_folder not in manifest_dict:
+			manifest_dict[output_folder] = read_manifest(output_folder)
+		record = manifest_dict[output_folder].get(os.path.basename(output_fn))
+		if not is_output_up_to_date(output_fn, record, params_fingerprint, input_fn_list):
+			result.append(job)
+	return result
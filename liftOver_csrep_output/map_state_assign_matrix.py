@@ -5,146 +5,163 @@ Given the summary chromatin state assignment probabilities outputted by CSREP/ b
 import pandas as pd 
 import numpy as np 
 import os
-import glob
 import helper
+import manifest
+import prob_matrix
+import genome_matrix
+import compressed_io
+import mapping_index
 import argparse
-import multiprocessing as mp
 
-parser = argparse.ArgumentParser(description = 'Given a summary chromatin state map and a 1-1 mapping of genomic bins from one assembly to another (with all overlapping mapped regions removed), we will create a mapped summary chromatin state map in the destimation assembly')
-parser.add_argument('--csrep_folder', type=str, required=True,
-	help = 'where there are files, each representing a region in the genome. The data should be the summary chromatin state assigment matrix')
-parser.add_argument('--orgDest_fn', type=str, required=True,
-	help = 'the 1-1 mapping of genomic bins from the orgiginal assembly to destimation assembly. This should be the output of convert_map_liftOver_to_orgAssembly.py. Format columns: org_chrom, org_start, org_end, destBin. destBin would be the form destChrom_destStart_destEnd')
-parser.add_argument('--output_folder', type=str, required=True,
-	help = 'where there are files, each representing a region in the genome. The data should be the summary chromatin state assigment matrix IN THE DESTINATION ASSEMBLY')
-parser.add_argument('--chromhmm_state_num', type=int, required=True,
-	help = 'chromhmm_state_num')
-parser.add_argument('--rewrite_existing_chrom', action='store_true',
-	help = 'if this flag is present, we will rewrite results for all chromosomes, even if the output files associated with some of them are already produced')
-parser.set_defaults(rewrite_existing_chrom=False)
-args = parser.parse_args()
-print(args)
-helper.check_dir_exist(args.csrep_folder)
-helper.check_file_exist(args.orgDest_fn)
-helper.make_dir(args.output_folder)
+NUM_REGION_KEY = 1000000 # regions of the original assembly are keyed by org_chrom * NUM_REGION_KEY + region_index (see get_org_region_keys)
 
-def read_rep_df(fn, chromhmm_state_num):
-	right_colnames = list(map(lambda x: 'state_' + str(x+1), range(chromhmm_state_num)))
+def read_rep_rle_mat(fn, chromhmm_state_num):
+	# the file can be in any of the formats of prob_matrix.py. --> run_end_bins, run_prob_mat: the matrix as runs of consecutive bins with identical probabilities (see prob_matrix.read_rle_prob_mat)
 	print(fn)
-	try:
-		df = pd.read_csv(fn, header = 0, index_col = 0, sep = '\t')
-		assert list(df.columns) == right_colnames, 'index_col = 0 is wrong'
-	except:
-		df = pd.read_csv(fn, header = 0, index_col = None, sep = '\t')
-		assert list(df.columns) == right_colnames, 'index_col = 0 is wrong'
-	return df
-
+	return prob_matrix.read_rle_prob_mat(fn, chromhmm_state_num)
 
-def map_assign_matrix_one_orgFn(org_fn, chrom_map_df, region_index, chromhmm_state_num):
+def map_assign_matrix_one_orgFn(org_fn, bin_index, chromhmm_state_num, org_genome_matrix):
 	'''
-	chrom_map_df: org_chrom, org_start, org_end, destBin. destBin would be the form destChrom_destStart_destEnd. The data here should be restricted to one genomic region on the original assembly
+	bin_index: the bins of the region of org_fn (0 --> NUM_BIN_PER_WINDOW - 1) that are mapped to the destination chromosome
+	org_genome_matrix: the genome matrix layout of the folder of org_fn (see genome_matrix.py), or None to read org_fn
+	--> is_in_org_fn: whether each bin of bin_index is in org_fn, and rows: the probabilities of these bins (None if org_fn does not exist)
 	'''
-	org_df = read_rep_df(org_fn, chromhmm_state_num)
-	region_start_bp = helper.NUM_BP_PER_WINDOW * region_index
-	region_end_bp = region_start_bp + helper.NUM_BP_PER_WINDOW
-	region_map_df = chrom_map_df[(chrom_map_df['start'] >= region_start_bp) & (chrom_map_df['end'] < region_end_bp)]
-	region_map_df['index_within_region'] = ((region_map_df['start'] - region_start_bp) / helper.NUM_BP_PER_BIN).astype(int)
-	region_map_df = region_map_df.merge(org_df, left_on = 'index_within_region', right_index = True, how = 'inner')
-	region_map_df.drop(['chrom', 'start', 'end'], axis = 1, inplace=True)
-	region_map_df['chrom'] = region_map_df['destBin'].apply(lambda x: x.split('_')[0])
-	region_map_df['start'] = region_map_df['destBin'].apply(lambda x: int(x.split('_')[1]))
-	region_map_df['end'] = region_map_df['destBin'].apply(lambda x: int(x.split('_')[2]))
-	state_columns = region_map_df.columns[pd.Series(region_map_df.columns).str.startswith('state')]
-	region_map_df = region_map_df[['chrom', 'start', 'end'] + list(state_columns)] # the chrom, start, end show the coordinates of summary state assignment in the destination assembly
-	return region_map_df
+	if not os.path.isfile(org_fn): # only bins that are in org_fn are mapped
+		return np.zeros(len(bin_index), dtype = bool), None
+	if org_genome_matrix is not None: # the region is a slice of the memory-mapped array of the chromosome, and only the rows of the mapped bins are read from it
+		window_mat = genome_matrix.get_window_mat(org_genome_matrix, os.path.basename(org_fn).split('_avg_pred.txt.gz')[0])
+		num_org_bins = window_mat.shape[0]
+		get_rows = lambda bin_index: window_mat[bin_index]
+	else:
+		run_end_bins, run_prob_mat = read_rep_rle_mat(org_fn, chromhmm_state_num)
+		num_org_bins = run_end_bins[-1] if len(run_end_bins) > 0 else 0
+		get_rows = lambda bin_index: prob_matrix.gather_rle_rows(run_end_bins, run_prob_mat, bin_index)
+	is_in_org_fn = bin_index < num_org_bins
+	# the probabilities of each mapped bin are gathered from the run that the bin is in, without expanding the runs into one row per bin
+	return is_in_org_fn, get_rows(bin_index[is_in_org_fn])
 
-def write_result_destChrom_diff_orgChrom(other_chrom_df, orgChrom, output_folder):
-	# this is the case where regions from orgChrom in the original assembly got mapped to a different chromosome in the destination assembly. In this case, we will first filter out all regions that are not in the orgChom in this lifted-over summary chromatin state map. Then, we will write them in separate files so that later we can merge back to one file per chromosome
-	group_other_chrom_df = other_chrom_df.groupby('chrom')
-	for chrom, oChrom_df in group_other_chrom_df:
-		save_fn = os.path.join(output_folder, '{o}_to_{d}_prob_state_map.txt.gz'.format(o=orgChrom, d=chrom))
-		oChrom_df.to_csv(save_fn, header = True, index = False, sep = '\t', compression = 'gzip')
-	return 
+def get_org_region_keys(orgDest_index, entry_index):
+	# entry_index: entries of the mapping index --> the region (window) of the original assembly of each entry, as one integer org_chrom * NUM_REGION_KEY + region_index
+	return orgDest_index['org_chrom'][entry_index].astype(np.int64) * NUM_REGION_KEY + orgDest_index['org_bin'][entry_index] // helper.NUM_BIN_PER_WINDOW
 
-def map_assign_matrix_one_chrom(csrep_folder, chrom, orgDest_df, chromhmm_state_num, output_folder):
-	chrom = 'chr{}'.format(chrom)
-	orgDest_df = orgDest_df[orgDest_df['chrom'] == chrom] # i named this orgDest_df instead of something else because I wanted to save computation space, orgDest_df for the whole genome is itself a very large dataframe
-	num_org_fn = len(glob.glob(csrep_folder + '/{}_*_avg_pred.txt.gz'.format(chrom)))
-	output_colnames = ['chrom', 'start', 'end'] + list(map(lambda x: 'state_{}'.format(x+1), range(chromhmm_state_num)))
-	result_df = pd.DataFrame(columns = output_colnames)
-	for region_index in range(num_org_fn):
-		org_fn = os.path.join(csrep_folder, '{c}_{i}_avg_pred.txt.gz'.format(c=chrom, i=region_index))
-		this_region_df = map_assign_matrix_one_orgFn(org_fn, orgDest_df, region_index, chromhmm_state_num)
-		result_df = result_df.append(this_region_df) # columns: chrom, start, end, state_1 --> state_18
-	# now that we got all the liftedOver data for regions in the chrom in the original assembly
-	# we will first filter out only region that are in this chrom first
-	other_chrom_df = result_df[result_df['chrom'] != chrom] 
-	if other_chrom_df.shape[0] >0: # if there are regions originally from this chrom but then get mapped to other chromosomes, we will write that data into separate files
-		write_result_destChrom_diff_orgChrom(other_chrom_df, chrom, output_folder)
-	# after we are done writing to files the regions that got mapped to other chromosomes, now just save the mapping of regions that got mapped to the same chromosome. 
-	result_df = result_df[result_df['chrom'] == chrom]
-	result_df = result_df.sort_values('start') # sort by ascending start bp
-	save_fn = os.path.join(output_folder, '{}_liftOver_probState.txt.gz'.format(chrom))
-	result_df.to_csv(save_fn, header=True, index=False, sep='\t', compression='gzip')
-	return 
+def get_org_fn_from_region_key(csrep_folder, chrom_names, region_key):
+	return os.path.join(csrep_folder, '{c}_{i}_avg_pred.txt.gz'.format(c = chrom_names[region_key // NUM_REGION_KEY], i = region_key % NUM_REGION_KEY))
 
-def map_assign_matrix_multiple_chrom(csrep_folder, chrom_list, orgDest_df, chromhmm_state_num, output_folder):
-	# for each chrom C, map all regions in C from the original chrom to the destination assembly 
-	# this function should be called for each of the processes running in parallel during multiprocessing
-	for chrom in chrom_list:
-		map_assign_matrix_one_chrom(csrep_folder, chrom, orgDest_df, chromhmm_state_num, output_folder)
+def map_assign_matrix_one_destChrom(shared_index_desc, csrep_folder, chrom, dest_offsets, chromhmm_state_num, output_folder, input_fn_list):
+	'''
+	shared_index_desc: the mapping index in shared memory (see mapping_index.share_mapping_index)
+	chrom: '1', '2', etc. The chromosome of the destination assembly whose output file is written by this job
+	dest_offsets: (start, end): the entries of the bins mapped to chrom are dest_order[start:end] in the mapping index (see mapping_index.get_dest_chrom_offsets)
+	The bins mapped to chrom can come from any chromosome of the original assembly. The regions of the original assembly are read one at a time, and the probabilities of their bins are put directly at the rows of the output of chrom, which are sorted by the start of the bins in the destination assembly, so the output file is written once, without intermediate files per pair of chromosomes
+	'''
+	shm_list, orgDest_index = mapping_index.attach_mapping_index(shared_index_desc)
+	entry_index = orgDest_index['dest_order'][dest_offsets[0]:dest_offsets[1]] # a view of the shared memory, no copy
+	org_bin = orgDest_index['org_bin'][entry_index]
+	region_key_list, region_number = np.unique(get_org_region_keys(orgDest_index, entry_index), return_inverse = True)
+	row_order = np.argsort(region_number, kind = 'stable') # rows of the output, grouped by the region of the original assembly that they are mapped from
+	region_row_start = np.concatenate([[0], np.cumsum(np.bincount(region_number, minlength = len(region_key_list)))])
+	org_genome_matrix = genome_matrix.get_genome_matrix(csrep_folder, chromhmm_state_num) # None if csrep_folder does not have an up-to-date genome matrix layout
+	is_mapped = np.zeros(len(entry_index), dtype = bool)
+	prob_mat = None
+	for region_number, region_key in enumerate(region_key_list):
+		row_index = row_order[region_row_start[region_number]:region_row_start[region_number + 1]]
+		org_fn = get_org_fn_from_region_key(csrep_folder, orgDest_index['chrom_names'], region_key)
+		is_in_org_fn, rows = map_assign_matrix_one_orgFn(org_fn, org_bin[row_index] - (region_key % NUM_REGION_KEY) * helper.NUM_BIN_PER_WINDOW, chromhmm_state_num, org_genome_matrix)
+		if rows is None:
+			continue
+		if prob_mat is None:
+			prob_mat = np.zeros((len(entry_index), chromhmm_state_num), dtype = rows.dtype)
+		prob_mat[row_index[is_in_org_fn]] = rows
+		is_mapped[row_index[is_in_org_fn]] = True
+	output_colnames = prob_matrix.get_state_colnames(chromhmm_state_num)
+	result_df = pd.DataFrame({'chrom': 'chr{}'.format(chrom), 'start': orgDest_index['dest_start'][entry_index[is_mapped]], 'end': orgDest_index['dest_end'][entry_index[is_mapped]]})
+	state_df = pd.DataFrame(prob_mat[is_mapped] if prob_mat is not None else np.zeros((0, chromhmm_state_num)), columns = output_colnames)
+	result_df = pd.concat([result_df, state_df], axis = 1) # columns: chrom, start, end, state_1 --> state_18, sorted by ascending start bp
+	del orgDest_index, entry_index, org_bin # the views of the shared memory, before it is closed
+	for shm in shm_list:
+		shm.close()
+	save_fn = get_chrom_output_fn(output_folder, chrom)
+	with manifest.atomic_output(save_fn) as temp_fn:
+		with compressed_io.open_output(temp_fn, 'wt') as outF: # with the codec of compressed_io.py (gzip by default)
+			result_df.to_csv(outF, header=True, index=False, sep='\t')
+	manifest.record_output(save_fn, get_map_params_fingerprint(chromhmm_state_num), input_fn_list)
 	return
 
-def combine_mapped_data_from_multiChrom_to_oneChrom_in_dest_assembly(output_folder, chrom):
+def get_chrom_output_fn(output_folder, chrom):
 	# chrom is just '1', '2', etc. not 'chr1', etc.
-	chrom = 'chr{}'.format(chrom)
-	fn_list = glob.glob(output_folder + '*_to_{}_prob_state_map.txt.gz'.format(chrom))
-	if len(fn_list) ==  0:
-		return # do nothing, because there are not regions from other chromosome in org_assembly that got mapped to this chromosome in the dest_assembly
-	fn_list += ['{}_liftOver_probState.txt.gz'.format(chrom)]
-	df_list = list(map(lambda x: pd.read_csv(x, header=0, index_col = None, sep = '\t'), fn_list))
-	result_df = pd.concat(df_list)
-	result_df = result_df.sort_values('start')
-	save_fn = os.path.join(output_folder, '{}_liftOver_probState.txt.gz'.format(chrom))
-	result_df.to_csv(save_fn, header = True, index = False, sep = '\t', compression = 'gzip')
-	return 
+	return os.path.join(output_folder, 'chr{}_liftOver_probState.txt.gz'.format(chrom))
+
+def get_chrom_input_fn_list(csrep_folder, orgDest_fn, orgDest_index, dest_offsets):
+	# the output file of a chromosome of the destination assembly is calculated from the summary state maps of the regions of the original assembly that are mapped to it and from the mapping of bins between the two assemblies
+	region_key_list = np.unique(get_org_region_keys(orgDest_index, orgDest_index['dest_order'][dest_offsets[0]:dest_offsets[1]]))
+	org_fn_list = list(map(lambda x: get_org_fn_from_region_key(csrep_folder, orgDest_index['chrom_names'], x), region_key_list))
+	return sorted(filter(os.path.isfile, org_fn_list)) + [orgDest_fn]
 
-def combine_mapped_data_one_process(output_folder, chrom_list):
-	for chrom in chrom_list:
-		combine_mapped_data_from_multiChrom_to_oneChrom_in_dest_assembly(output_folder, chrom)
-	return 
+def get_map_params_fingerprint(chromhmm_state_num):
+	return manifest.get_params_fingerprint({'step': 'map_state_assign_matrix', 'chromhmm_state_num': chromhmm_state_num})
 
-def get_chrom_list(output_folder, rewrite_existing_chrom):
-	if rewrite_existing_chrom:
-		return helper.CHROMOSOME_LIST
-	chrom_segment_fn_list = glob.glob(output_folder + '/chr*_liftOver_probState.txt.gz')
-	chrom_list = [(x.split('/')[-1]).split('_gen_pos_segment_fn_list')[0].split('chr')[1] for x in chrom_segment_fn_list] # get the list of all genomic positions available: [chr9_11, chr9_12, etc.]
-	chrom_list = np.setdiff1d(helper.CHROMOSOME_LIST, chrom_list)
-	print("Number of positions that will be calculated in average_pred_results: " + str(len(chrom_list)))
+def get_chrom_list(output_folder, chrom_input_fn_dict, chromhmm_state_num, rewrite_existing_chrom):
+	# the chromosomes whose output files are missing, cut short by a killed job, or calculated from different input files (see manifest.py). All chromosomes if rewrite_existing_chrom
+	job_list = list(map(lambda x: (x, get_chrom_output_fn(output_folder, x), chrom_input_fn_dict[x]), helper.CHROMOSOME_LIST))
+	chrom_list = manifest.find_jobs_to_compute(job_list, get_map_params_fingerprint(chromhmm_state_num), int(rewrite_existing_chrom))
+	print("Number of chromosomes that will be calculated in map_state_assign_matrix: " + str(len(chrom_list)))
 	print(chrom_list)
 	return chrom_list
 
-def map_assign_matrix_allChrom_multiProcess(csrep_folder, orgDest_fn, chromhmm_state_num, output_folder, rewrite_existing_chrom):
-	orgDest_df = pd.read_csv(orgDest_fn, header = None, index_col=None, sep='\t')
-	orgDest_df.columns = ['chrom', 'start', 'end', 'destBin']
-	num_cores = 4
-	chrom_list = get_chrom_list(output_folder, rewrite_existing_chrom)
-	partition_chrom_list = helper.partition_file_list(chrom_list, num_cores)
-	processes = [mp.Process(target = map_assign_matrix_multiple_chrom, args =(csrep_folder, partition_chrom_list[i], orgDest_df, chromhmm_state_num, output_folder)) for i in range(num_cores)]
-	for p in processes:
-		p.start()
-	for i, p in enumerate(processes):
-		p.join()
-		print("Process " + str(i) + " to map individual chromosomes is finished!")
-	print('Done first round of mapping regions between assemblies')
-	# now  that we wrote down all the data for individual chromosomes. For each chromosome, if this chrom was mapped from multiple chromosomes in the original assembly, we will need to combine that data into one file for the destination chromosome
-	processes = [mp.Process(target = combine_mapped_data_one_process, args = (output_folder, partition_chrom_list[i])) for i in range(num_cores)]
-	for p in processes:
-		p.start()
-	for i, p in enumerate(processes):
-		p.join()
-		print("Process " + str(i) + " to combine regions that were mapped to the same chromosome in dest_assembly is finished!")
+def get_map_jobs_one_group(csrep_folder, orgDest_fn, orgDest_index, dest_offsets_dict, chromhmm_state_num, output_folder, rewrite_existing_chrom):
+	'''
+	dest_offsets_dict: keys: '1', '2', etc., values: the offsets of the chromosome in the destination assembly (see mapping_index.get_dest_chrom_offsets)
+	--> job_list: the arguments of map_assign_matrix_one_destChrom (without the mapping index) for the chromosomes of the destination assembly whose output files in output_folder need to be calculated, and job_weight_list: their numbers of mapped bins
+	'''
+	helper.make_dir(output_folder)
+	chrom_input_fn_dict = dict(map(lambda x: (x, get_chrom_input_fn_list(csrep_folder, orgDest_fn, orgDest_index, dest_offsets_dict[x])), helper.CHROMOSOME_LIST))
+	chrom_list = get_chrom_list(output_folder, chrom_input_fn_dict, chromhmm_state_num, rewrite_existing_chrom)
+	job_list = list(map(lambda x: (csrep_folder, x, dest_offsets_dict[x], chromhmm_state_num, output_folder, chrom_input_fn_dict[x]), chrom_list))
+	job_weight_list = list(map(lambda x: dest_offsets_dict[x][1] - dest_offsets_dict[x][0], chrom_list))
+	return job_list, job_weight_list
+
+def get_dest_offsets_dict(orgDest_index):
+	# keys: '1', '2', etc. (helper.CHROMOSOME_LIST), values: (start, end) of the chromosome in dest_order, (0, 0) for chromosomes that no bin is mapped to
+	dest_offsets_dict = mapping_index.get_dest_chrom_offsets(orgDest_index)
+	return dict(map(lambda x: (x, dest_offsets_dict.get('chr{}'.format(x), (0, 0))), helper.CHROMOSOME_LIST))
+
+def run_map_jobs(orgDest_index, job_list, job_weight_list, num_cores):
+	# job_list: from get_map_jobs_one_group, of one or several groups (see batch_liftOver.py). The mapping index is put into shared memory once for all the jobs, and each job slices the entries of its chromosome from it without copying. Jobs are handed out to the processes from the largest to the smallest (by their number of mapped bins), each process taking a new job as soon as it is done with the previous one
+	shm_list, shared_index_desc = mapping_index.share_mapping_index(orgDest_index)
+	try:
+		helper.run_weighted_jobs(map_assign_matrix_one_destChrom, list(map(lambda x: (shared_index_desc,) + x, job_list)), job_weight_list, num_cores)
+	finally:
+		for shm in shm_list:
+			shm.close()
+			shm.unlink()
+	return
+
+def map_assign_matrix_allChrom_multiProcess(csrep_folder, orgDest_fn, chromhmm_state_num, output_folder, rewrite_existing_chrom, num_cores):
+	# each chromosome of the destination assembly is one job
+	orgDest_index = mapping_index.get_mapping_index(orgDest_fn, 'orgDest') # the integer arrays of the mapping, see mapping_index.py
+	job_list, job_weight_list = get_map_jobs_one_group(csrep_folder, orgDest_fn, orgDest_index, get_dest_offsets_dict(orgDest_index), chromhmm_state_num, output_folder, rewrite_existing_chrom)
+	run_map_jobs(orgDest_index, job_list, job_weight_list, num_cores)
 	print ('Done!')
 	return
 
-map_assign_matrix_allChrom_multiProcess(args.csrep_folder, args.orgDest_fn, args.chromhmm_state_num, args.output_folder, args.rewrite_existing_chrom)
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Given a summary chromatin state map and a 1-1 mapping of genomic bins from one assembly to another (with all overlapping mapped regions removed), we will create a mapped summary chromatin state map in the destimation assembly')
+	parser.add_argument('--csrep_folder', type=str, required=True,
+		help = 'where there are files, each representing a region in the genome. The data should be the summary chromatin state assigment matrix')
+	parser.add_argument('--orgDest_fn', type=str, required=True,
+		help = 'the 1-1 mapping of genomic bins from the orgiginal assembly to destimation assembly: the mapping index (.npz) written by chain_liftover.py, or a text file (the output of convert_map_liftOver_to_orgAssembly.py), with columns: org_chrom, org_start, org_end, destBin. destBin would be the form destChrom_destStart_destEnd (see mapping_index.py)')
+	parser.add_argument('--output_folder', type=str, required=True,
+		help = 'where there are files, each representing a region in the genome. The data should be the summary chromatin state assigment matrix IN THE DESTINATION ASSEMBLY')
+	parser.add_argument('--chromhmm_state_num', type=int, required=True,
+		help = 'chromhmm_state_num')
+	parser.add_argument('--rewrite_existing_chrom', action='store_true',
+		help = 'if this flag is present, we will rewrite results for all chromosomes, even if the output files associated with some of them are already produced. Otherwise, we only calculate the chromosomes whose output files are missing or out of date (see manifest.py)')
+	parser.add_argument('--num_cores', type=int, required=False, default=4,
+		help = 'number of processes that map the chromosomes of the destination assembly at the same time')
+	parser.set_defaults(rewrite_existing_chrom=False)
+	args = parser.parse_args()
+	print(args)
+	helper.check_dir_exist(args.csrep_folder)
+	helper.check_file_exist(args.orgDest_fn)
+	helper.make_dir(args.output_folder)
+	map_assign_matrix_allChrom_multiProcess(args.csrep_folder, args.orgDest_fn, args.chromhmm_state_num, args.output_folder, args.rewrite_existing_chrom, args.num_cores)
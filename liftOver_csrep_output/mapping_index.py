@@ -0,0 +1,195 @@
+#!/usr/bin/env python
+
+'''
+This file contains functions to write, and read, the mapping index of an assembly pair: the 1-1 mapping of the 200bp bins of the original assembly to the destination assembly, as integer arrays in one .npz file. Before, the scripts of this pipeline read the mapping as text files with one line per bin (~15M lines), where the coordinates of the bins in the other assembly were strings chrom_start_end, which they split back into chrom, start and end one row at a time. With the index, the scripts find the bins of a chromosome or a window by binary search, and get the coordinates of their mapped bins by indexing the arrays (vectorized gathers).
+Arrays of the index (one entry per mapped bin, sorted by org_chrom and then org_bin):
+- chrom_names: the names of the chromosomes of both assemblies, sorted. org_chrom and dest_chrom are indices in chrom_names, so entries are sorted by the name of their chromosome (chr1, chr10, chr11, ..., chr2, ...), as in the text files
+- org_chrom, org_bin: the bin in the original assembly (org_start = org_bin * NUM_BP_PER_BIN)
+- dest_chrom, dest_start, dest_end: the interval that the bin is mapped to in the destination assembly (bp). Usually 200bp long, but not always (see chain_liftover.py)
+- dest_order: the order of the entries sorted by dest_chrom and then dest_start, for the scripts that go over the destination assembly
+The index is written by chain_liftover.py, once per assembly pair. Mapping text files of the older pipeline (destOrg_fn: dest_chrom, dest_start, dest_end, orgChrom_orgStart_orgEnd, or orgDest_fn: org_chrom, org_start, org_end, destChrom_destStart_destEnd) can still be given to the scripts: they are converted into an index the first time they are used, and the index is saved next to them (<map_fn>INDEX_SUFFIX, recorded in the manifest of their folder) for the next times.
+
+List of functions:
+- save_mapping_index(mapping_index, index_fn), read_mapping_index(index_fn)
+- get_mapping_index(map_fn, map_format) --> the index of map_fn, either an index (.npz) or a text file in the format map_format ('destOrg' or 'orgDest')
+- get_org_chrom_slice(mapping_index, chrom) --> slice of the entries of the bins on chrom (ex: chr1) in the original assembly
+- get_org_chrom_index(mapping_index, chrom) --> the index of the bins on chrom in the original assembly only
+- get_org_window_slice(mapping_index, chrom, window_index) --> slice of the entries of the bins of the window chrom_<window_index> (ex: chr1_3) in the original assembly
+- get_dest_chrom_offsets(mapping_index) --> dictionary, keys: chromosomes, values: (start, end), the entries of the chromosome in the destination assembly are dest_order[start:end]
+- share_mapping_index(mapping_index) --> the arrays of the index copied into shared memory, and their description, that worker processes use to attach to them (attach_mapping_index) without copying
+- write_text_map(mapping_index, map_fn, map_format, num_bp_per_bin) --> write the mapping as a text file of the older pipeline
+'''
+import numpy as np
+from multiprocessing import shared_memory
+import pandas as pd
+import helper
+import manifest
+import compressed_io
+
+INDEX_KEY_LIST = ['org_chrom', 'org_bin', 'dest_chrom', 'dest_start', 'dest_end']
+INDEX_DTYPE = np.int32 # chromosome indices, bins and bp positions of the human genome all fit in int32
+INDEX_SUFFIX = '.index.npz'
+MAP_FORMAT_LIST = ['destOrg', 'orgDest']
+TEXT_CHUNK_SIZE = 1000000 # number of lines of the text files read or written at a time, so that the whole genome (~15M lines) does not take all the memory
+
+def sort_mapping_index(mapping_index):
+	# mapping_index: the arrays of INDEX_KEY_LIST and chrom_names, in any order --> the index sorted by org_chrom and org_bin, with dest_order
+	order = np.lexsort((mapping_index['org_bin'], mapping_index['org_chrom']))
+	result = dict(map(lambda x: (x, mapping_index[x][order].astype(INDEX_DTYPE)), INDEX_KEY_LIST))
+	result['dest_order'] = np.lexsort((result['dest_start'], result['dest_chrom'])).astype(INDEX_DTYPE)
+	result['chrom_names'] = np.array(mapping_index['chrom_names'])
+	return result
+
+def save_mapping_index(mapping_index, index_fn):
+	with manifest.atomic_output(index_fn) as temp_fn:
+		with open(temp_fn, 'wb') as outF: # np.savez adds .npz to file names that do not end with it
+			np.savez(outF, **mapping_index)
+	return
+
+def read_mapping_index(index_fn):
+	with np.load(index_fn) as data:
+		return dict(map(lambda x: (x, data[x]), data.files))
+
+def parse_bin_names(bin_names):
+	# bin_names: pd.Series of strings chrom_start_end --> chrom (strings), start, end (integers). The chromosome names can contain '_' (ex: chr1_gl000191_random), so the names are split from the right
+	split_df = bin_names.str.rsplit('_', n = 2, expand = True)
+	return split_df[0].values, split_df[1].astype(np.int64).values, split_df[2].astype(np.int64).values
+
+def read_text_map(map_fn, map_format, num_bp_per_bin = helper.NUM_BP_PER_BIN):
+	# map_fn: a text mapping file in the format map_format (see the top of this file) --> mapping_index
+	assert map_format in MAP_FORMAT_LIST, 'map_format should be one of {}'.format(MAP_FORMAT_LIST)
+	chrom_name_list = [] # chromosome names, in the order they are first seen. Converted into indices of the sorted names at the end
+	chrom_code_dict = {}
+	array_list_dict = dict(map(lambda x: (x, []), INDEX_KEY_LIST))
+	with compressed_io.open_input(map_fn, 'rt') as inF:
+		for chunk_df in pd.read_csv(inF, header = None, index_col = None, sep = '\t', usecols = range(4), chunksize = TEXT_CHUNK_SIZE):
+			other_chrom, other_start, other_end = parse_bin_names(chunk_df[3].astype(str))
+			chrom_dict = {'first': chunk_df[0].astype(str).values, 'other': other_chrom}
+			for key, chrom in chrom_dict.items():
+				codes, uniques = pd.factorize(chrom)
+				for chrom_name in uniques:
+					if chrom_name not in chrom_code_dict:
+						chrom_code_dict[chrom_name] = len(chrom_name_list)
+						chrom_name_list.append(chrom_name)
+				chrom_dict[key] = np.array(list(map(lambda x: chrom_code_dict[x], uniques)), dtype = np.int64)[codes]
+			if map_format == 'destOrg': # dest_chrom, dest_start, dest_end, orgChrom_orgStart_orgEnd
+				chunk_arrays = [chrom_dict['other'], other_start // num_bp_per_bin, chrom_dict['first'], chunk_df[1].values, chunk_df[2].values]
+			else: # org_chrom, org_start, org_end, destChrom_destStart_destEnd
+				chunk_arrays = [chrom_dict['first'], chunk_df[1].values // num_bp_per_bin, chrom_dict['other'], other_start, other_end]
+			for key, array in zip(INDEX_KEY_LIST, chunk_arrays):
+				array_list_dict[key].append(array)
+	mapping_index = dict(map(lambda x: (x, np.concatenate(array_list_dict[x]) if len(array_list_dict[x]) > 0 else np.zeros(0, dtype = np.int64)), INDEX_KEY_LIST))
+	# chromosome codes in the order of the sorted names
+	chrom_names = sorted(chrom_name_list)
+	code_to_sorted = np.array(list(map(lambda x: chrom_names.index(x), chrom_name_list)), dtype = np.int64)
+	if len(chrom_name_list) > 0:
+		mapping_index['org_chrom'] = code_to_sorted[mapping_index['org_chrom']]
+		mapping_index['dest_chrom'] = code_to_sorted[mapping_index['dest_chrom']]
+	mapping_index['chrom_names'] = chrom_names
+	return sort_mapping_index(mapping_index)
+
+def get_index_fn(map_fn):
+	# the index of a text mapping file, saved next to it
+	return map_fn + INDEX_SUFFIX
+
+def get_mapping_index(map_fn, map_format):
+	'''
+	map_fn: an index (.npz, from chain_liftover.py), or a text mapping file in the format map_format ('destOrg' or 'orgDest')
+	The index of a text file is built from it the first time, and read from get_index_fn(map_fn) the next times, as long as map_fn has not changed (see manifest.py)
+	'''
+	if map_fn.endswith('.npz'):
+		return read_mapping_index(map_fn)
+	index_fn = get_index_fn(map_fn)
+	params_fingerprint = manifest.get_params_fingerprint({'step': 'mapping_index', 'map_format': map_format})
+	if len(manifest.find_jobs_to_compute([(map_fn, index_fn, [map_fn])], params_fingerprint, 0)) > 0:
+		print('Building the mapping index of {}'.format(map_fn))
+		save_mapping_index(read_text_map(map_fn, map_format), index_fn)
+		manifest.record_output(index_fn, params_fingerprint, [map_fn])
+	return read_mapping_index(index_fn)
+
+def get_chrom_code(mapping_index, chrom):
+	# chrom: ex: chr1 --> its index in chrom_names, or -1 if it is not in the index
+	code = np.searchsorted(mapping_index['chrom_names'], chrom)
+	if code < len(mapping_index['chrom_names']) and mapping_index['chrom_names'][code] == chrom:
+		return int(code)
+	return -1
+
+def get_org_chrom_slice(mapping_index, chrom):
+	code = get_chrom_code(mapping_index, chrom)
+	return slice(np.searchsorted(mapping_index['org_chrom'], code, side = 'left'), np.searchsorted(mapping_index['org_chrom'], code, side = 'right'))
+
+def get_org_chrom_index(mapping_index, chrom):
+	# --> the mapping index of the bins of chrom (ex: chr1) in the original assembly only (a smaller index to hand to the process of a chromosome)
+	chrom_slice = get_org_chrom_slice(mapping_index, chrom)
+	result = dict(map(lambda x: (x, mapping_index[x][chrom_slice]), INDEX_KEY_LIST))
+	result['dest_order'] = np.lexsort((result['dest_start'], result['dest_chrom'])).astype(INDEX_DTYPE)
+	result['chrom_names'] = mapping_index['chrom_names']
+	return result
+
+def get_org_window_slice(mapping_index, chrom, window_index, num_bin_per_window = helper.NUM_BIN_PER_WINDOW):
+	# the entries of the bins window_index * num_bin_per_window --> (window_index + 1) * num_bin_per_window - 1 of chrom
+	chrom_slice = get_org_chrom_slice(mapping_index, chrom)
+	chrom_org_bin = mapping_index['org_bin'][chrom_slice]
+	window_start = chrom_slice.start + np.searchsorted(chrom_org_bin, window_index * num_bin_per_window, side = 'left')
+	window_end = chrom_slice.start + np.searchsorted(chrom_org_bin, (window_index + 1) * num_bin_per_window, side = 'left')
+	return slice(window_start, window_end)
+
+def get_dest_chrom_offsets(mapping_index):
+	# dest_order is sorted by dest_chrom, so the entries of each chromosome of the destination assembly are one slice of it
+	sorted_dest_chrom = mapping_index['dest_chrom'][mapping_index['dest_order']]
+	chrom_codes = np.arange(len(mapping_index['chrom_names']))
+	start_list = np.searchsorted(sorted_dest_chrom, chrom_codes, side = 'left')
+	end_list = np.searchsorted(sorted_dest_chrom, chrom_codes, side = 'right')
+	return dict(zip(mapping_index['chrom_names'], zip(map(int, start_list), map(int, end_list))))
+
+def create_shared_array(array):
+	# copy array into a new block of shared memory. Return the block (the caller closes and unlinks it) and the description that workers use to attach to it (see attach_shared_array)
+	shm = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+	shared_array = np.ndarray(array.shape, dtype = array.dtype, buffer = shm.buf)
+	shared_array[:] = array
+	return shm, (shm.name, array.shape, array.dtype.str)
+
+def attach_shared_array(shared_array_desc):
+	# shared_array_desc: (name, shape, dtype) from create_shared_array. Return the block (the worker closes it) and a numpy view of it, without copying
+	name, shape, dtype = shared_array_desc
+	shm = shared_memory.SharedMemory(name = name)
+	return shm, np.ndarray(shape, dtype = np.dtype(dtype), buffer = shm.buf)
+
+def share_mapping_index(mapping_index):
+	# --> shm_list: the blocks of shared memory (the caller closes and unlinks them), shared_index_desc: the description of the index that worker processes attach to (attach_mapping_index). The ~15M entries of the genome are copied once, instead of being pickled for each worker
+	array_key_list = INDEX_KEY_LIST + ['dest_order']
+	shm_list, array_desc_list = zip(*map(lambda x: create_shared_array(mapping_index[x]), array_key_list))
+	shared_index_desc = {'array_desc': dict(zip(array_key_list, array_desc_list)), 'chrom_names': list(mapping_index['chrom_names'])}
+	return list(shm_list), shared_index_desc
+
+def attach_mapping_index(shared_index_desc):
+	# --> shm_list: the blocks of shared memory (the worker closes them once it no longer uses the arrays), and the mapping index, whose arrays are views of the shared memory
+	shm_list = []
+	result = {'chrom_names': np.array(shared_index_desc['chrom_names'])}
+	for key, array_desc in shared_index_desc['array_desc'].items():
+		shm, result[key] = attach_shared_array(array_desc)
+		shm_list.append(shm)
+	return shm_list, result
+
+def get_bin_names(chrom_names, chrom, start, end):
+	# --> array of strings chrom_start_end, the bin names of the text files of the mapping
+	return pd.Series(chrom_names[chrom]).str.cat([pd.Series(start).astype(str), pd.Series(end).astype(str)], sep = '_').values
+
+def write_text_map(mapping_index, map_fn, map_format, num_bp_per_bin = helper.NUM_BP_PER_BIN):
+	# map_format: 'destOrg' (sorted by the destination assembly) or 'orgDest' (sorted by the original assembly), see the top of this file. Written TEXT_CHUNK_SIZE lines at a time
+	assert map_format in MAP_FORMAT_LIST, 'map_format should be one of {}'.format(MAP_FORMAT_LIST)
+	chrom_names = mapping_index['chrom_names']
+	org_start = mapping_index['org_bin'].astype(np.int64) * num_bp_per_bin
+	org_end = org_start + num_bp_per_bin
+	if map_format == 'destOrg':
+		order = mapping_index['dest_order']
+		column_list = [mapping_index['dest_chrom'][order], mapping_index['dest_start'][order], mapping_index['dest_end'][order], mapping_index['org_chrom'][order], org_start[order], org_end[order]]
+	else:
+		column_list = [mapping_index['org_chrom'], org_start, org_end, mapping_index['dest_chrom'], mapping_index['dest_start'], mapping_index['dest_end']]
+	with manifest.atomic_output(map_fn) as temp_fn:
+		with compressed_io.open_output(temp_fn, 'wt') as outF:
+			for chunk_start in range(0, len(column_list[0]), TEXT_CHUNK_SIZE):
+				chrom, start, end, bin_chrom, bin_start, bin_end = map(lambda x: x[chunk_start:(chunk_start + TEXT_CHUNK_SIZE)], column_list)
+				chunk_df = pd.DataFrame({'chrom': chrom_names[chrom], 'start': start, 'end': end, 'bin': get_bin_names(chrom_names, bin_chrom, bin_start, bin_end)})
+				chunk_df.to_csv(outF, header = False, index = False, sep = '\t')
+	return
@@ -10,48 +10,68 @@ outDir: Where all the output data of averaging will be stored
 all_ct_list_fn: each line of this file is the name of a cell type that is associated with the cell group that we are running the pipeline on. An example is /u/home/h/havu73/project-ernst/diff_pete/roadmap/blood.list
 all_ct_segment_folder: folder with genomic positions for all ct
 all_ct_pred_folder: folder containing outdir and pred_E### folders
-replace_existing_file: 0 or 1. 0--> we only calculate the average of regions where we have not calculated, 1 --> we replace all the files for all the genomic positions, no matter whether we have calculated them or not
+replace_existing_file: 0 or 1. 0--> we only calculate the average of regions whose average files are missing or out of date (see manifest.py), 1 --> we replace all the files for all the genomic positions, no matter whether we have calculated them or not
 num_chromHMM_state
+num_cores: (optional, default 4) number of processes that average different genomic regions at the same time. The memory used by each process does not depend on the number of samples in the group (see average_multiple_result_files)
+prob_file_format: (optional, default txt) format of the average files: txt, float16, uint8 or rle (see prob_matrix.py). Requires num_cores to be given. The prediction files of the samples can be in any of the formats
 '''
 
 import os, os.path
 import sys
 import helper
-import pandas as pd
+import segment_store
+import manifest
+import prob_matrix
 import glob
 import numpy as np
-import multiprocessing as mp
-def get_genomic_positions_list(all_ct_segment_folder, outDir, replace_existing_file):
+from concurrent.futures import ThreadPoolExecutor
+def get_genomic_positions_list(all_ct_segment_folder, outDir, replace_existing_file, params_fingerprint, get_window_input_fn_list):
 	"""
 	Function to get a list of genomic regions (ex: chr1_0 as the first 10MB in chrom 1) for which we will calculate the CSREP summary chromatin state maps for.
 
 	Args:
-	    all_ct_segment_folder: folder with chrom state  data of all input samples, each file in this folder represents input data for one genomic region (<= 10Mb)/
+	    all_ct_segment_folder: folder with chrom state  data of all input samples (the segmentation store, see segment_store.py), each file in this folder represents input data for one genomic region (<= 10Mb)/
 	    outDir: output_folder of the summary chromatin state maap. Each file in the folder corresponds to 1 genomic region (<=10Mb). 
-	    replace_existing_file: 0/1. If there are existing output files in outDir, whether or not (0 / 1) we want to replace them by recalculating the summary chromatin state map for the corresponding genomic regions
+	    replace_existing_file: 0/1. If there are up-to-date output files in outDir, whether or not (0 / 1) we want to replace them by recalculating the summary chromatin state map for the corresponding genomic regions
+	    params_fingerprint: fingerprint of the parameters of the average files (see get_avg_params_fingerprint)
+	    get_window_input_fn_list: function, genomic region --> list of the files that the average file of the region is calculated from (ex: get_avg_input_fn_list)
 
 	Returns:
-		A list of strings: genomic regions (example: chro1_0) for which we will calculate the summary chromatin state map for
+		A list of strings: genomic regions (example: chro1_0) for which we will calculate the summary chromatin state map for. These are the regions whose average files are missing, cut short by a killed job, or calculated from different input files or parameters (see manifest.py)
 
 	Raises:
 	    KeyError: Raises an exception: No exceptions. 
 	"""	
-	gen_pos_segment_fn_list = glob.glob(all_ct_segment_folder + '/chr*')
-	gen_pos_list = [(x.split('/')[-1]).split('_combined_segment.bed.gz')[0] for x in gen_pos_segment_fn_list] # get the list of all genomic positions available: [chr9_11, chr9_12, etc.]
-	if replace_existing_file == 1:
-		return gen_pos_list
-	else: # repace_existing_file is 0
-		existing_fn_list = glob.glob(outDir + '/*_avg_pred.txt.gz')
-		existing_gen_pos_list = list(map(lambda x: (x.split('/')[-1]).split('_avg_pred.txt.gz')[0], existing_fn_list))
-		gen_pos_list = np.setdiff1d(gen_pos_list, existing_gen_pos_list)
-		print("Number of positions that will be calculated in average_pred_results: " + str(len(gen_pos_list)))
-		print(gen_pos_list)
-		return gen_pos_list
+	gen_pos_list = sorted(segment_store.list_windows(all_ct_segment_folder)) # get the list of all genomic positions available: [chr9_11, chr9_12, etc.]
+	job_list = list(map(lambda x: (x, os.path.join(outDir, x + "_avg_pred.txt.gz"), get_window_input_fn_list(x)), gen_pos_list))
+	gen_pos_list = manifest.find_jobs_to_compute(job_list, params_fingerprint, replace_existing_file)
+	print("Number of positions that will be calculated in average_pred_results: " + str(len(gen_pos_list)))
+	print(gen_pos_list)
+	return gen_pos_list
+
+def get_avg_params_fingerprint(ct_list, num_chromHMM_state, prob_file_format):
+	# the parameters that the average files depend on, other than the input files
+	return manifest.get_params_fingerprint({'step': 'average', 'ct_list': sorted(ct_list), 'num_chromHMM_state': num_chromHMM_state, 'prob_file_format': prob_file_format})
+
+def get_avg_input_fn_list(gene_window, pred_dir_list):
+	# the files of the predictions of all samples at gene_window, which are averaged into the average file of gene_window
+	return [os.path.join(x, gene_window + "_pred_out.txt.gz") for x in pred_dir_list]
+
+def get_pred_dir_list(all_ct_pred_folder, ct_list):
+	# return the list of folders pred_<ct> inside all_ct_pred_folder, and check that there is one for each cell type in ct_list
+	pred_dir_list = sorted(glob.glob(all_ct_pred_folder + "/pred_*"))
+	pred_ct_list = get_pred_ct_list(pred_dir_list)
+	# comparing sets (union, interescetion...)
+	assert set(pred_ct_list) == set(ct_list), 'pred_ct_list is not the same as ct_list'
+	return pred_dir_list
+
+def get_pred_ct_list(pred_dir_list):
+	return [(x.rstrip('/').split('/')[-1]).split('_')[-1] for x in pred_dir_list] # path/to/pred_E034 --> E034
 
 
 def read_rep_df(fn, num_chromHMM_state):
 	"""
-	Read a file that shows predictions of chromatin state assignment probabilities into a dataframe. 
+	Read a file that shows predictions of chromatin state assignment probabilities into a dataframe. The file can be in any of the formats of prob_matrix.py
 	Args:
 	    fn: filename to open and read. 
 	    num_chromHMM_state: number of chromatin states in the model
@@ -62,26 +82,27 @@ def read_rep_df(fn, num_chromHMM_state):
 	Raises:
 	    KeyError: Raises an exception: No exceptions. 
 	"""	
-	right_colnames = list(map(lambda x: 'state_' + str(x+1), range(num_chromHMM_state)))
 	helper.check_file_exist(fn)
-	try:
-		df = pd.read_csv(fn, header = 0, index_col = 0, sep = '\t')
-		assert list(df.columns) == right_colnames, 'index_col = 0 is wrong'
-	except:
-		df = pd.read_csv(fn, header = 0, index_col = None, sep = '\t')
-		assert list(df.columns) == right_colnames, 'index_col = 0 is wrong'
-	return df
-
-def average_multiple_result_files(result_fn_list, output_fn, num_chromHMM_state):
+	return prob_matrix.read_prob_df(fn, num_chromHMM_state)
+
+def read_rep_rle_mat(fn, num_chromHMM_state):
+	# same as read_rep_df, but the matrix is returned as runs of consecutive bins with identical probabilities: run_end_bins, run_prob_mat (see prob_matrix.read_rle_prob_mat)
+	helper.check_file_exist(fn)
+	return prob_matrix.read_rle_prob_mat(fn, num_chromHMM_state)
+
+def average_multiple_result_files(result_fn_list, output_fn, num_chromHMM_state, prob_file_format):
 	"""
 	Given multiple files showing the predictions of chromatin state assignment probabilties in multiple samples, this function will calculate the average of all predictions
+	The files are added up one at a time into a float32 matrix, while the next file is read in a background thread, so at most two files' data and the sum are in memory at any time, no matter how many samples there are.
+	The files are read, and added up, as runs of consecutive bins with identical probabilities (see prob_matrix.read_rle_prob_mat), so that long stretches of bins with the same predictions are added up once instead of once per bin. The sum is cut at the ends of the runs of all the files read so far.
 	Args:
-	    result_fn_list: list of filename showing predictions of chrom state assignment probabilities in multiple samples. 
+	    result_fn_list: list of filename showing predictions of chrom state assignment probabilities in multiple samples, in any of the formats of prob_matrix.py
 	    output_fn: fn showing the average chrom-state assignment probabilities
 	    num_chromHMM_state: number of chromatin states in the model
+	    prob_file_format: format of output_fn (see prob_matrix.py)
 
 	Returns:
-		None, the function just do average operations and save the results into output_fn
+		True if the average was calculated and saved into output_fn, False if some of the input files are missing
 
 	Raises:
 	    KeyError: Raises an exception: No exceptions. 
@@ -89,78 +110,115 @@ def average_multiple_result_files(result_fn_list, output_fn, num_chromHMM_state)
 	for fn in result_fn_list:
 		if not os.path.isfile(fn):
 			print('File: ' + fn + ' DOES NOT EXIST. The average of this region was not calculated')
-			return
-	result_df_list = list(map(lambda x: read_rep_df(x, num_chromHMM_state), result_fn_list)) # read all the files data and put them into  a data frame
-	avg_df = pd.concat(result_df_list).groupby(level = 0).mean() # get the average across all the df. So what we get is a df : rows: genomic positions, columns: states, each entry is the average of the respective cells in all the input dfa
-	# avg_df.to_csv(output_fn, compression = 'gzip', header = True, index = True, sep = '\t') # save and compression to file
-	# now we normalize the resulting average probabilities, such that the row sum is always 0 (i,e, the probabilities of state assignments sum up to 1 over all states in a position)
-	row_sum = avg_df.sum(axis = 1) # row sum, so that we can divide each entry in a row by the row sum corresponding to that row
-	row_norm_avg_df = avg_df.div(row_sum, axis = 0)
-	row_norm_avg_df.to_csv(output_fn, compression = 'gzip', header = True, index = False, sep = '\t') # save and compression to file
+			return False
+	sum_run_end_bins = None # the end of each run of bins in sum_mat
+	sum_mat = None # rows: runs of genomic positions, columns: states, each entry is the sum of the respective cells in the input files read so far
+	with ThreadPoolExecutor(max_workers = 1) as reader:
+		next_rle_mat = reader.submit(read_rep_rle_mat, result_fn_list[0], num_chromHMM_state)
+		for fn_index in range(len(result_fn_list)):
+			this_run_end_bins, this_mat = next_rle_mat.result()
+			if fn_index + 1 < len(result_fn_list): # read the next file while we add up this one
+				next_rle_mat = reader.submit(read_rep_rle_mat, result_fn_list[fn_index + 1], num_chromHMM_state)
+			if sum_mat is None:
+				sum_run_end_bins, sum_mat = this_run_end_bins, this_mat.astype(np.float32)
+			else:
+				assert get_num_bins(sum_run_end_bins) == get_num_bins(this_run_end_bins), 'File {} has {} rows, while the previous files of the same region have {} rows'.format(result_fn_list[fn_index], get_num_bins(this_run_end_bins), get_num_bins(sum_run_end_bins))
+				sum_run_end_bins, (sum_mat, this_mat) = prob_matrix.align_rle_prob_mats([(sum_run_end_bins, sum_mat), (this_run_end_bins, this_mat)])
+				sum_mat += this_mat
+	# get the average across all the files. So what we get is: rows: runs of genomic positions, columns: states, each entry is the average of the respective cells in all the input files
+	save_row_normalized_avg_rle_mat(sum_run_end_bins, sum_mat / np.float32(len(result_fn_list)), output_fn, prob_file_format)
+	return True
+
+def get_num_bins(run_end_bins):
+	return run_end_bins[-1] if len(run_end_bins) > 0 else 0
+
+def save_row_normalized_avg_df(avg_df, output_fn, prob_file_format):
+	"""
+	Normalize the average probabilities, such that the row sum is always 1 (i,e, the probabilities of state assignments sum up to 1 over all states in a position), and save them into output_fn. Used by train_multiLog_group.py, which calculates avg_df as the models predict each window, without writing the predictions of each sample.
+	Args:
+	    avg_df: rows: genomic positions, columns: state_1 --> state_<num_chromHMM_state>, each entry is the average of the predicted probabilities across samples
+	    output_fn: fn showing the average chrom-state assignment probabilities
+	    prob_file_format: one of prob_matrix.PROB_FILE_FORMAT_LIST
+
+	Returns:
+		None
+	"""
+	save_row_normalized_avg_rle_mat(*prob_matrix.get_rle_prob_mat(avg_df.values), output_fn, prob_file_format)
+	return
+
+def save_row_normalized_avg_rle_mat(run_end_bins, avg_mat, output_fn, prob_file_format):
+	"""
+	Same as save_row_normalized_avg_df, for an average matrix given as runs of bins (see prob_matrix.get_rle_prob_mat)
+	Args:
+	    run_end_bins: the end (exclusive) of each run of bins
+	    avg_mat: rows: runs of genomic positions, columns: states, each entry is the average of the predicted probabilities across samples
+	    output_fn: fn showing the average chrom-state assignment probabilities
+	    prob_file_format: one of prob_matrix.PROB_FILE_FORMAT_LIST
+
+	Returns:
+		None
+	"""
+	row_norm_avg_mat = avg_mat / avg_mat.sum(axis = 1, keepdims = True) # divide each entry in a row by the row sum corresponding to that row
+	with manifest.atomic_output(output_fn) as temp_fn: # the file only appears under output_fn once it is completely written
+		prob_matrix.save_rle_prob_mat(run_end_bins, row_norm_avg_mat, temp_fn, prob_file_format) # save and compression to file
 	return
 
 
-def averaging_prediction_one_process(gen_pos_list, outDir, pred_dir_list, num_chromHMM_state):
+def averaging_prediction_one_window(gene_window, outDir, pred_dir_list, num_chromHMM_state, prob_file_format):
 	"""
-	This function will call on function average_multiple_result_files multiple times to average the predictions of chrom-state-assignment probs across samples for multiple regions of the genome
+	This function will call on function average_multiple_result_files to average the predictions of chrom-state-assignment probs across samples for one region of the genome, and record the average file in the manifest of outDir. It is one job of the pool of processes in averaging_predictions_all_processes
 	Args:
-	    gen_pos_list: list of genomic positions (ex: chr1_0 as the first 10Mb region of chrom1) to do generate average results for. 
+	    gene_window: genomic position (ex: chr1_0 as the first 10Mb region of chrom1) to do generate average results for. 
 	    outDir: outptu folder containing output files for multiple genomic regions
 	    pred_dir_list: list of folder paths that contain the predictions results for multiple samples
 	    num_chromHMM_state: number of chromatin state in the model
+	    prob_file_format: format of the average files (see prob_matrix.py)
 
 	Returns:
-		None, the function only calls on average_multiple_result_files to print out prediction output into files 
+		gene_window, the function only calls on average_multiple_result_files to print out prediction output into files 
 
 	Raises:
 	    KeyError: Raises an exception: No exceptions. 
 	"""		
-	for gene_window in gen_pos_list: # loop through each genomic window and then get the avrage result across different predictions for all positions in this window
-		this_window_output_fn = os.path.join(outDir, gene_window + "_avg_pred.txt.gz")
-		this_window_pred_fn_list = [os.path.join(x, gene_window + "_pred_out.txt.gz") for x in pred_dir_list]
-		# calculate the average prediction results across different prediction cell types for this window, and save the results
-		average_multiple_result_files(this_window_pred_fn_list, this_window_output_fn, num_chromHMM_state)
-		print("Done averaging region: " + str(gene_window))
-	return 
+	this_window_output_fn = os.path.join(outDir, gene_window + "_avg_pred.txt.gz")
+	this_window_pred_fn_list = get_avg_input_fn_list(gene_window, pred_dir_list)
+	# calculate the average prediction results across different prediction cell types for this window, and save the results
+	if average_multiple_result_files(this_window_pred_fn_list, this_window_output_fn, num_chromHMM_state, prob_file_format):
+		manifest.record_output(this_window_output_fn, get_avg_params_fingerprint(get_pred_ct_list(pred_dir_list), num_chromHMM_state, prob_file_format), this_window_pred_fn_list)
+	print("Done averaging region: " + str(gene_window))
+	return gene_window
 
-def averaging_predictions_all_processes(outDir, all_ct_pred_folder, ct_list, gen_pos_list, num_chromHMM_state):
+def averaging_predictions_all_processes(outDir, all_ct_pred_folder, ct_list, gen_pos_list, num_chromHMM_state, num_cores, prob_file_format):
 	"""
-	This function will call on function averaging_prediction_one_process to do averaging of predicted chrom-state-assignment probabilities across samples for multiple processes in parallel --> speed up the averaging task by doing it in parallel for multiple genomic regions at a time
+	This function will call on function averaging_prediction_one_window to do averaging of predicted chrom-state-assignment probabilities across samples for multiple processes in parallel --> speed up the averaging task by doing it in parallel for multiple genomic regions at a time. Regions are handed out to the processes from the largest to the smallest (by the size of their prediction files), each process taking a new region as soon as it is done with the previous one
 	Args:
 	    outDir: outptu folder containing output files for multiple genomic regions
 	    all_ct_pred_folder: folder where there are subfolders pred_<ct_index> --> each subfolder contains the prediction results for one sample
 	    ct_list: list of ct_index (or sample ID, for example for Roadmap data: E003). 
 	    gen_pos_list: list of genomic positions (ex: chr1_0 as the first 10Mb region of chrom1) to do generate average results for. 
 	    num_chromHMM_state: number of chromatin state in the model
+	    num_cores: number of processes
+	    prob_file_format: format of the average files (see prob_matrix.py)
 
 	Returns:
-		None, the function only calls on averaging_prediction_one_process to print out prediction output into files 
+		None, the function only calls on averaging_prediction_one_window to print out prediction output into files 
 			
 	Raises:
 	    KeyError: Raises an exception: No exceptions. 
 	"""			
 	# validate_ct_dir = the directory where the data that are associated with the ct used for validation  cell type
-	pred_dir_list = glob.glob(all_ct_pred_folder + "/pred_*")
-	pred_ct_list = [(x.split('/')[-1]).split('_')[-1] for x in pred_dir_list] # path/to/pred_E034 --> E034
-
-	# comparing sets (union, interescetion...)
-	assert set(pred_ct_list) == set(ct_list), 'pred_ct_list is not the same as ct_list'
+	pred_dir_list = get_pred_dir_list(all_ct_pred_folder, ct_list)
 	# get the folder where the results of averaging across different prediction cell types will be stored
-	num_cores = 4
-	partition_genome_pos_list = helper.partition_file_list(gen_pos_list, num_cores)
 	print(("Outputting average predictions here: " + outDir))
-	processes = [mp.Process(target = averaging_prediction_one_process, args = (partition_genome_pos_list[i], outDir, pred_dir_list, num_chromHMM_state)) for i in range(num_cores)]
-	for p in processes:
-		p.start()
-	for i, p in enumerate(processes):
-		p.join()
-		print("Process " + str(i) + " is finished!")
+	job_args_list = list(map(lambda x: (x, outDir, pred_dir_list, num_chromHMM_state, prob_file_format), gen_pos_list))
+	job_weight_list = list(map(lambda x: sum(helper.get_file_size_list([os.path.join(pred_dir, x + "_pred_out.txt.gz") for pred_dir in pred_dir_list])), gen_pos_list)) # the total size of the files to read for each region
+	helper.run_weighted_jobs(averaging_prediction_one_window, job_args_list, job_weight_list, num_cores)
 	return 
 
 
 
 def main():
-	if len(sys.argv) != 7:
+	if len(sys.argv) not in [7, 8, 9]:
 		usage()
 	outDir = sys.argv[1]
 	helper.make_dir(outDir)
@@ -170,14 +228,21 @@ def main():
 	replace_existing_file = helper.get_command_line_integer(sys.argv[5])
 	num_chromHMM_state = helper.get_command_line_integer(sys.argv[6])
 	assert replace_existing_file in range(2), 'get_command_line_integer can only be 0 or 1'
+	num_cores = 4
+	if len(sys.argv) >= 8:
+		num_cores = helper.get_command_line_integer(sys.argv[7])
+	prob_file_format = prob_matrix.DEFAULT_PROB_FILE_FORMAT
+	if len(sys.argv) == 9:
+		prob_file_format = prob_matrix.check_prob_file_format(sys.argv[8])
 	print ("Done getting command line arguments in  average_pred_results.py")
-	# get the list of all genomic positions used to segment the genome for our model training (we exclude chromosome Y in all analysis). This will only look at chrom X, deciding whether we want to rewrite some of the existing file
-	gen_pos_list = get_genomic_positions_list(all_ct_segment_folder, outDir, replace_existing_file)
 	# get all cell types
-	ct_list =  list(pd.read_csv(all_ct_list_fn, sep = '\n', header = None)[0]) # -->  a list with each entry being the cell type in this cell group
+	ct_list = helper.get_list_from_line_seperated_file(all_ct_list_fn) # -->  a list with each entry being the cell type in this cell group
+	# get the list of all genomic positions used to segment the genome for our model training (we exclude chromosome Y in all analysis), whose average files are not up to date
+	pred_dir_list = get_pred_dir_list(all_ct_pred_folder, ct_list)
+	gen_pos_list = get_genomic_positions_list(all_ct_segment_folder, outDir, replace_existing_file, get_avg_params_fingerprint(ct_list, num_chromHMM_state, prob_file_format), lambda x: get_avg_input_fn_list(x, pred_dir_list))
 	# call all cell types
 	print ("Averaging pred results")
-	averaging_predictions_all_processes(outDir, all_ct_pred_folder, ct_list, gen_pos_list, num_chromHMM_state)
+	averaging_predictions_all_processes(outDir, all_ct_pred_folder, ct_list, gen_pos_list, num_chromHMM_state, num_cores, prob_file_format)
 
 
 def usage():
@@ -186,8 +251,10 @@ def usage():
 	print( "all_ct_list_fn: each line of this file is the name of a cell type that is associated with the cell group that we are running the pipeline on. An example is /u/home/h/havu73/project-ernst/diff_pete/roadmap/blood.list")
 	print( "all_ct_segment_folder: folder with genomic positions for all ct")
 	print( "all_ct_pred_folder: folder containing outdir and pred_E### folders")
-	print("replace_existing_file: 0 or 1. 0--> we only calculate the average of regions where we have not calculated, 1 --> we replace all the files for all the genomic positions, no matter whether we have calculated them or not")
+	print("replace_existing_file: 0 or 1. 0--> we only calculate the average of regions whose average files are missing or out of date, 1 --> we replace all the files for all the genomic positions, no matter whether we have calculated them or not")
 	print('num_chromHMM_state')
+	print('num_cores: (optional, default 4) number of processes that average different genomic regions at the same time')
+	print('prob_file_format: (optional, default txt) format of the average files: txt, float16, uint8 or rle (see prob_matrix.py)')
 	exit(1)
 
 if __name__ == '__main__':
@@ -0,0 +1,76 @@
+#!/usr/bin/env python
+
+'''
+This script measures, for each codec of compressed_io.py, how fast the output files of the pipeline are compressed (and decompressed), and how big they get, so that the codecs of the steps (output_codec in config/config.yaml) can be chosen for your machine and data.
+The files are decompressed into memory first, and then written with each codec and number of threads into a temporary folder, so the times do not include formatting the data (ex: to_csv).
+Output: one line per codec and number of threads: codec, num_threads, compression throughput (MB of uncompressed data per second), decompression throughput, compressed size, and compression ratio (uncompressed size / compressed size)
+Ex: python benchmark_compression.py --input_fn <all_cg_out_dir>/ESC/CSREP/representative_data/average_predictions/chr22_*_avg_pred.txt.gz
+By default, the files of the test data (testdata/raw_data) are used.
+'''
+import os
+import glob
+import time
+import shutil
+import argparse
+import tempfile
+import pandas as pd
+import helper
+import compressed_io
+
+TESTDATA_INPUT_PATTERN = os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'testdata', 'raw_data', '*', '*.gz')
+
+def benchmark_one_codec(data_list, codec_spec, num_threads, temp_folder):
+	# data_list: the decompressed content of the input files --> compression time, decompression time, total compressed size
+	fn_list = list(map(lambda x: os.path.join(temp_folder, 'file_{}.gz'.format(x)), range(len(data_list))))
+	start_time = time.perf_counter()
+	for data, fn in zip(data_list, fn_list):
+		with compressed_io.open_output(fn, 'wb', codec_spec, num_threads) as outF:
+			outF.write(data)
+	compress_time = time.perf_counter() - start_time
+	start_time = time.perf_counter()
+	for data, fn in zip(data_list, fn_list):
+		assert compressed_io.read_compressed(fn) == data, 'codec {}: file {} is not the same after decompression'.format(codec_spec, fn)
+	decompress_time = time.perf_counter() - start_time
+	compressed_size = sum(helper.get_file_size_list(fn_list))
+	for fn in fn_list:
+		os.remove(fn)
+	return compress_time, decompress_time, compressed_size
+
+def benchmark_codecs(input_fn_list, codec_list, num_threads_list, output_fn):
+	data_list = list(map(compressed_io.read_compressed, input_fn_list))
+	total_size = sum(map(len, data_list))
+	print('Number of files: {}, total uncompressed size: {:.1f} MB'.format(len(data_list), total_size / 1e6))
+	temp_folder = tempfile.mkdtemp(prefix = 'csrep_benchmark_')
+	result_list = []
+	try:
+		for codec_spec in codec_list:
+			try:
+				compressed_io.parse_codec(codec_spec)
+			except AssertionError as e: # ex: the python package of the codec is not installed
+				print('Skipping {}: {}'.format(codec_spec, e))
+				continue
+			for num_threads in num_threads_list:
+				compress_time, decompress_time, compressed_size = benchmark_one_codec(data_list, codec_spec, num_threads, temp_folder)
+				result_list.append([codec_spec, num_threads, total_size / 1e6 / compress_time, total_size / 1e6 / decompress_time, compressed_size, total_size / compressed_size])
+	finally:
+		shutil.rmtree(temp_folder)
+	result_df = pd.DataFrame(result_list, columns = ['codec', 'num_threads', 'compress_MB_per_s', 'decompress_MB_per_s', 'compressed_bytes', 'ratio'])
+	print(result_df.to_string(index = False, float_format = '%.2f'))
+	if output_fn is not None:
+		result_df.to_csv(output_fn, header = True, index = False, sep = '\t')
+	return result_df
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Measure the compression throughput and size of the codecs of compressed_io.py on output files of the pipeline.')
+	parser.add_argument('--input_fn', type = str, nargs = '+', required = False, default = None,
+		help = 'files to compress (compressed with any codec of compressed_io.py, or not compressed). Default: the files of testdata/raw_data')
+	parser.add_argument('--codec', type = str, nargs = '+', required = False, default = ['gzip:1', 'gzip:6', 'gzip:9', 'zstd:3', 'lz4'],
+		help = 'codecs to compare, as in output_codec in config/config.yaml. Codecs whose python packages are not installed are skipped')
+	parser.add_argument('--num_threads', type = int, nargs = '+', required = False, default = [1, 4],
+		help = 'numbers of compression threads to compare')
+	parser.add_argument('--output_fn', type = str, required = False, default = None,
+		help = 'if given, the table of results is also written into this file')
+	args = parser.parse_args()
+	input_fn_list = args.input_fn if args.input_fn is not None else sorted(glob.glob(TESTDATA_INPUT_PATTERN))
+	assert len(input_fn_list) > 0, 'No input files'
+	benchmark_codecs(input_fn_list, args.codec, args.num_threads, args.output_fn)
@@ -10,88 +10,99 @@ group1_folder: where the representative state maps for group1 are stored. The fi
 group2_folder: where the representative state maps for group2 are stored. The files in this fodler correspond to different regions in the genome
 output_folder: where the difference between the representative state maps of two groups are stored. The files in this folder correspon to different regions in the genome
 num_chromHMM_state
-redo_existing_file: 0 or 1: 1 (yes, rewrite all the existing files in the output_folder, or 0 (no, only write files that have not been produced)
+redo_existing_file: 0 or 1: 1 (yes, rewrite all the existing files in the output_folder, or 0 (no, only write files that are missing or out of date, see manifest.py)
+prob_file_format: (optional, default txt) format of the differential files: txt, float16, uint8 or rle (see prob_matrix.py). The representative state maps of the two groups can be in any of the formats
+If both groups' folders have an up-to-date genome matrix layout (see genome_matrix.py), the representative state maps are read from it instead of from the files of each region
 Output is a matrix, rows: genomic bins, columns: states
 '''
 
 import pandas as pd 
-import numpy as np 
 import sys
 import os
 import glob
 import helper
-import multiprocessing as mp
+import manifest
+import prob_matrix
+import genome_matrix
 NUM_CORES = 4
 
 
 def read_rep_df(fn, num_chromHMM_state):
-	right_colnames = list(map(lambda x: 'state_' + str(x+1), range(num_chromHMM_state)))
+	# the file can be in any of the formats of prob_matrix.py
 	helper.check_file_exist(fn)
-	try:
-		df = pd.read_csv(fn, header = 0, index_col = 0, sep = '\t')
-		assert list(df.columns) == right_colnames, 'index_col = 0 is wrong'
-	except:
-		df = pd.read_csv(fn, header = 0, index_col = None, sep = '\t')
-		assert list(df.columns) == right_colnames, 'index_col = 0 is wrong'
-	return df
+	return prob_matrix.read_prob_df(fn, num_chromHMM_state)
 
-def get_diff_rep_state_one_genomic_region(region_fn, group1_folder, group2_folder, output_folder, num_chromHMM_state):
+def read_rep_rle_mat(fn, num_chromHMM_state):
+	# --> run_end_bins, run_prob_mat (see prob_matrix.read_rle_prob_mat)
+	helper.check_file_exist(fn)
+	return prob_matrix.read_rle_prob_mat(fn, num_chromHMM_state)
+
+def get_diff_rep_state_one_genomic_region(region_fn, group1_folder, group2_folder, output_folder, num_chromHMM_state, prob_file_format, genome_matrix_pair):
 	# this function will take data of representative chromatin maps in one regions in the genome (usually 10M bp), for both group1 and group2
 	# this function should return a dataframes of rows: genomic region, columns: states, values: differential chromatin state assigment probabilities between the two regions
 	g1_fn = os.path.join(group1_folder, region_fn)
 	g2_fn = os.path.join(group2_folder, region_fn)
 	helper.check_file_exist(g1_fn)
 	helper.check_file_exist(g2_fn)
-	g1_df = read_rep_df(g1_fn, num_chromHMM_state)
-	g2_df = read_rep_df(g2_fn, num_chromHMM_state)
-	diff_df = g1_df - g2_df # the difference in chromatin state assignment probabilities between the two groups
 	output_fn = os.path.join(output_folder, region_fn)
-	diff_df.to_csv(output_fn, header = True, index = True, sep = '\t', compression = 'gzip')
+	if genome_matrix_pair is not None: # the two maps are slices of the memory-mapped arrays of the chromosome (see genome_matrix.py), subtracted without reading the files of the region. genome_matrix_pair: the layouts of group1_folder and group2_folder, read once by get_diff_rep_state_whole_genome
+		region = region_fn.split('_avg_pred.txt.gz')[0]
+		g1_mat = genome_matrix.get_window_mat(genome_matrix_pair[0], region)
+		g2_mat = genome_matrix.get_window_mat(genome_matrix_pair[1], region)
+		assert g1_mat.shape == g2_mat.shape, 'The representative state maps of {} of the two groups have different numbers of bins'.format(region)
+		diff_df = pd.DataFrame(g1_mat - g2_mat, columns = prob_matrix.get_state_colnames(num_chromHMM_state))
+		with manifest.atomic_output(output_fn) as temp_fn:
+			prob_matrix.save_prob_df(diff_df, temp_fn, prob_file_format, index = True)
+		manifest.record_output(output_fn, get_diff_params_fingerprint(num_chromHMM_state, prob_file_format), [g1_fn, g2_fn])
+		return
+	# the two maps are read as runs of consecutive bins with identical probabilities, and subtracted run by run (see prob_matrix.align_rle_prob_mats)
+	g1_rle_mat = read_rep_rle_mat(g1_fn, num_chromHMM_state)
+	g2_rle_mat = read_rep_rle_mat(g2_fn, num_chromHMM_state)
+	run_end_bins, (g1_mat, g2_mat) = prob_matrix.align_rle_prob_mats([g1_rle_mat, g2_rle_mat])
+	diff_mat = g1_mat - g2_mat # the difference in chromatin state assignment probabilities between the two groups
+	with manifest.atomic_output(output_fn) as temp_fn: # the file only appears under output_fn once it is completely written
+		prob_matrix.save_rle_prob_mat(run_end_bins, diff_mat, temp_fn, prob_file_format, index = True)
+	manifest.record_output(output_fn, get_diff_params_fingerprint(num_chromHMM_state, prob_file_format), [g1_fn, g2_fn])
 	return 
 
-def get_diff_rep_state_one_process(region_fn_list, group1_folder, group2_folder, output_folder, num_chromHMM_state):
-	# this function will pass through each of the file in region_fn_list and calculate the diff chromatin state map for each region, then write into output_folder
-	for region_fn in region_fn_list:
-		get_diff_rep_state_one_genomic_region(region_fn, group1_folder, group2_folder, output_folder, num_chromHMM_state)
-	return 
+def get_diff_params_fingerprint(num_chromHMM_state, prob_file_format):
+	# the parameters that the differential files depend on, other than the two groups' average files
+	return manifest.get_params_fingerprint({'step': 'diff', 'num_chromHMM_state': num_chromHMM_state, 'prob_file_format': prob_file_format})
 
-def get_genomic_positions_list(group1_folder, output_folder, redo_existing_file):
-	gen_pos_segment_fn_list = glob.glob(group1_folder + '/chr*')
-	gen_pos_list = [(x.split('/')[-1]).split('_avg_pred.txt.gz')[0] for x in gen_pos_segment_fn_list] # get the list of all genomic positions available: [chr9_11, chr9_12, etc.]
-	if redo_existing_file == 1:
-		return gen_pos_list
-	else: # repace_existing_file is 0
-		existing_fn_list = glob.glob(output_folder + '/*_avg_pred.txt.gz')
-		existing_gen_pos_list = list(map(lambda x: (x.split('/')[-1]).split('_avg_pred.txt.gz')[0], existing_fn_list))
-		gen_pos_list = np.setdiff1d(gen_pos_list, existing_gen_pos_list)
-		print("Number of positions that will be calculated in average_pred_results: " + str(len(gen_pos_list)))
-		print(gen_pos_list)
-		return gen_pos_list
+def get_genomic_positions_list(group1_folder, group2_folder, output_folder, num_chromHMM_state, redo_existing_file, prob_file_format):
+	# return the regions whose differential files are missing or out of date (see manifest.py): the file was cut short by a killed job, or the average files of either group were calculated again since the differential file was written
+	gen_pos_segment_fn_list = glob.glob(group1_folder + '/chr*_avg_pred.txt.gz')
+	gen_pos_list = sorted([(x.split('/')[-1]).split('_avg_pred.txt.gz')[0] for x in gen_pos_segment_fn_list]) # get the list of all genomic positions available: [chr9_11, chr9_12, etc.]
+	job_list = list(map(lambda x: (x, os.path.join(output_folder, x + '_avg_pred.txt.gz'), [os.path.join(group1_folder, x + '_avg_pred.txt.gz'), os.path.join(group2_folder, x + '_avg_pred.txt.gz')]), gen_pos_list))
+	gen_pos_list = manifest.find_jobs_to_compute(job_list, get_diff_params_fingerprint(num_chromHMM_state, prob_file_format), redo_existing_file)
+	print("Number of positions that will be calculated in calculate_diff_rep_state_map: " + str(len(gen_pos_list)))
+	print(gen_pos_list)
+	return gen_pos_list
 
-def get_diff_rep_state_whole_genome(group1_folder, group2_folder, output_folder, num_chromHMM_state, redo_existing_file):
+def get_diff_rep_state_whole_genome(group1_folder, group2_folder, output_folder, num_chromHMM_state, redo_existing_file, prob_file_format):
 	# this function will:
-	# 1. get list of regions(files) inside folder diff_folder, partition into NUM_CORES processes
+	# 1. get list of regions(files) inside folder diff_folder, to be handed out to NUM_CORES processes, largest files first
 	g1_fn_list = glob.glob(group1_folder + "/chr*_avg_pred.txt.gz") 
-	g2_fn_list = glob.glob(group1_folder + "/chr*_avg_pred.txt.gz") 
+	g2_fn_list = glob.glob(group2_folder + "/chr*_avg_pred.txt.gz") 
 	print(len(g1_fn_list))
 	print(len(g2_fn_list))
 	assert len(g1_fn_list) == len(g2_fn_list), 'Number of files from group 1 and group 2 are not equal'
-	gen_pos_list = get_genomic_positions_list(group1_folder, output_folder, redo_existing_file) # the list of regions that we still need to calculate the differential scores for
+	gen_pos_list = get_genomic_positions_list(group1_folder, group2_folder, output_folder, num_chromHMM_state, redo_existing_file, prob_file_format) # the list of regions that we still need to calculate the differential scores for
 	input_fn_list = list(map(lambda x: x + '_avg_pred.txt.gz', gen_pos_list))
 	print('Number of files to calculate differential scores for: {}'.format(len(input_fn_list)))
 	print(gen_pos_list)
-	partition_fn_list = helper.partition_file_list(input_fn_list, NUM_CORES) # partition the list of fn in group1 (list of genomeic regions) into subgroups, so that we can add them into processes later
-	# 2. For each group of region_fn we will call a process to calculate the difference between two groups' chromatin state assignment
-	processes = [mp.Process(target = get_diff_rep_state_one_process, args = (partition_fn_list[i], group1_folder, group2_folder, output_folder, num_chromHMM_state)) for i in range(NUM_CORES)]
-	for p in processes:
-		p.start()
-	for i, p in enumerate(processes):
-		p.join()
-		print ("Process " + str(i) + " is finished!")
+	genome_matrix_pair = (genome_matrix.get_genome_matrix(group1_folder, num_chromHMM_state), genome_matrix.get_genome_matrix(group2_folder, num_chromHMM_state)) # the layouts are read once here, and handed to all the jobs
+	if None in genome_matrix_pair: # the layout of either group is missing or out of date
+		genome_matrix_pair = None
+	print('Reading the representative state maps from the genome matrix layout: {}'.format(genome_matrix_pair is not None))
+	# 2. For each region_fn we will have a process calculate the difference between two groups' chromatin state assignment. Each process takes a new region as soon as it is done with the previous one
+	job_args_list = list(map(lambda x: (x, group1_folder, group2_folder, output_folder, num_chromHMM_state, prob_file_format, genome_matrix_pair), input_fn_list))
+	job_weight_list = helper.get_file_size_list(list(map(lambda x: os.path.join(group1_folder, x), input_fn_list)))
+	helper.run_weighted_jobs(get_diff_rep_state_one_genomic_region, job_args_list, job_weight_list, NUM_CORES)
 	return
 
 def main():
-	if len(sys.argv) != 6:
+	if len(sys.argv) not in [6, 7]:
 		usage()
 	group1_folder = sys.argv[1] # where the representative state maps for group1 are stored. The files in this fodler correspond to different regions in the genome
 	helper.check_dir_exist(group1_folder)
@@ -102,9 +113,12 @@ def main():
 	num_chromHMM_state = helper.get_command_line_integer(sys.argv[4])
 	redo_existing_file = helper.get_command_line_integer(sys.argv[5])
 	assert redo_existing_file in [0,1], 'redo_existing_file should be 1 (yes, rewrite all the existing files in the output_folder, or 0 (no, only write files that have not been produced)'
+	prob_file_format = prob_matrix.DEFAULT_PROB_FILE_FORMAT
+	if len(sys.argv) == 7:
+		prob_file_format = prob_matrix.check_prob_file_format(sys.argv[6])
 	print ("Done getting command line argument")
 	# call the function that will do the necessary work for this code
-	get_diff_rep_state_whole_genome(group1_folder, group2_folder, output_folder, num_chromHMM_state, redo_existing_file)
+	get_diff_rep_state_whole_genome(group1_folder, group2_folder, output_folder, num_chromHMM_state, redo_existing_file, prob_file_format)
 	print ('Done!')
 
 def usage():
@@ -113,7 +127,8 @@ def usage():
 	print ("group2_folder: where the representative state maps for group2 are stored. The files in this fodler correspond to different regions in the genome")
 	print ("output_folder: where the difference between the representative state maps of two groups are stored. The files in this folder correspon to different regions in the genome")
 	print ('num_chromHMM_state')
-	print ('redo_existing_file: 0 or 1: 1 (yes, rewrite all the existing files in the output_folder, or 0 (no, only write files that have not been produced)')
+	print ('redo_existing_file: 0 or 1: 1 (yes, rewrite all the existing files in the output_folder, or 0 (no, only write files that are missing or out of date)')
+	print ('prob_file_format: (optional, default txt) format of the differential files: txt, float16, uint8 or rle (see prob_matrix.py)')
 	print ("This code will calculate the difference of chromatin state assignment probabilities between two groups. The two groups should already had their representative chromatin state maps being calcualted. Output is a matrix, rows: genomic bins, columns: states")
 	exit(1)
 	
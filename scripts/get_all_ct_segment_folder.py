@@ -8,9 +8,11 @@ Given that users already arranged their input files in the following structure:
 |__|__|__ <ct><input_suffix> --> example: E003_chr22_core_K27ac_segments.bed.gz --> this file contains the chromatin state map for the sample E003
 
 Then, this script will combine the data from multiple samples and represent their chromatin state maps in different files, representing multiple <10Mbp windows (if the chromatin states are defined at 200-bp resolution, otherwise each region consists of 50,000 chromatin state bins). This pre-processsing step is useful in speeding up the CSREP pipeline.  
-The output_folder is arranged as follows: 
+Each input file is read exactly once, in chunks, with all samples' files streamed in lockstep chromosome by chromosome: as soon as all samples' data for a chromosome is read, the windows of that chromosome are written and the memory is freed. Therefore, the input files should list all the segments of a chromosome in consecutive lines (as ChromHMM does). Expanding and saving the windows of each chromosome is done by a pool of NUM_CORES processes, while the main process keeps streaming. The memory used is bounded to about NUM_CORES chromosomes' worth of state codes for all samples.
+The output_folder is arranged as follows (see segment_store.py for details): 
 |__ output_folder
-|__|__ <region_index>_combined_segment.bed.gz: a file of at most 50,001 rows (1 header row). Each row correspond to a 200-bp window (or a genomic bin for which the chromatin state is defined). Each column corresponds to one input sample. The value of each cell is the chromatin state at the corresponding genomic position in the corresponding sample. <region_index> follows the format: <chrom>_<region_index> --> example: chr1_0 corresponds to the first 50,000 genomic bins in chromosome 1. If the chromatin state bins are defined at 200-bp resolution, as default setting of chromHMM or SegWay, then each genomic region will cover 10Mb of the genome. 
+|__|__ <region_index>_combined_segment.npy: a uint8 matrix of shape (num_samples, <= 50,000). Each row corresponds to one input sample, in the order listed in store_meta.json. Each column correspond to a 200-bp window (or a genomic bin for which the chromatin state is defined). The value of each cell is the one-based index of the chromatin state at the corresponding genomic position in the corresponding sample (0 if the sample has no state there). <region_index> follows the format: <chrom>_<region_index> --> example: chr1_0 corresponds to the first 50,000 genomic bins in chromosome 1. If the chromatin state bins are defined at 200-bp resolution, as default setting of chromHMM or SegWay, then each genomic region will cover 10Mb of the genome. 
+|__|__ store_meta.json: the names of the samples (rows of the matrices above) and the coordinates of each genomic region.
  
 command-line argument: 
 python get_all_ct_segment_folder.py
@@ -24,10 +26,13 @@ redo_existing_files: 0 or 1: 1 (yes, rewrite all the existing files in the outpu
 import os
 import sys
 import helper
+import segment_store
 import pandas as pd
 import glob
 import numpy as np
-import multiprocessing as mp
+
+STREAM_CHUNK_NUM_ROWS = 500000 # number of lines of an input segmentation file that we read into memory at a time
+NUM_CORES = 4 # number of processes that expand and save the chromosomes' windows, while the main process keeps streaming the input files
 
 def read_state_annot(state_annot_fn):
 	state_annot_df = pd.read_csv(state_annot_fn, header = 0, index_col = False, sep = '\t')
@@ -45,75 +50,142 @@ def transform_state_into_desired_form(state, state_annot_dict):
 		except:
 			print("state annotation is not in the right format: {}".format(state))
 			exit(1)
-	return 'E' + str(int_state)
+	return int_state
+
+def transform_state_column_into_codes(state_series, state_annot_dict, state_code_dict):
+	# vectorized version of transform_state_into_desired_form: each distinct state name is only transformed once, and remembered in state_code_dict (keys: state names as in the input file, values: one-based state index) for later chunks of the same file
+	for state in state_series.unique():
+		if state not in state_code_dict:
+			state_code_dict[state] = transform_state_into_desired_form(state, state_annot_dict)
+	return state_series.map(state_code_dict).values.astype(segment_store.STATE_CODE_DTYPE)
 
-def process_one_ct_one_chrom_segment_fn(fn, ct, chrom, state_annot_dict):
-	df = pd.read_csv(fn, header = None, index_col = None, sep = '\t')
+def stream_one_ct_segment_fn(fn, state_annot_dict):
+	'''
+	Generator that reads the segmentation file of one sample exactly once, in chunks of STREAM_CHUNK_NUM_ROWS lines. For each chromosome, in the order that the chromosomes appear in the file, it yields (chrom, (state_codes, num_bins)): the run-length form of this sample's chromatin state map on the chromosome. state_codes[i] is the one-based state index of the i-th segment, num_bins[i] is the number of bins that the segment spans.
+	'''
 	NUM_MUST_HAVE_COLUMNS = 4
-	assert df.shape[1] >= NUM_MUST_HAVE_COLUMNS, 'Number of columns for each segmentation file should be at least 4, with the first 4 columns correspond to chrom, start, end, state: {}'.format(fn)
-	df = df.iloc[:,:NUM_MUST_HAVE_COLUMNS]
-	df.columns = ['chrom', 'start_bp', 'end_bp', 'state']
-	df['state'] = df['state'].apply(lambda x: transform_state_into_desired_form(x, state_annot_dict)) # transform the state into the form E1, E2, .., E18
-	df = df[df['chrom'] == chrom] # filter only rows with the chromosome that we are interested in
-	df['num_bin'] =  ((df['end_bp'] - df['start_bp']) / helper.NUM_BP_PER_BIN).astype('int')
-	segment_series = []
-	for index, row in df.iterrows():
-		segment_series.extend([row['state']] * row['num_bin'])
-	return segment_series
-
-def print_one_chrom_data_to_text(chrom_df, chrom, output_folder, redo_existing_files):
-	# save the data from chromsome into multiple files, each corresponding to a region on the chromosome
-	num_files_to_print = int(np.ceil(chrom_df.shape[0] / helper.NUM_BIN_PER_WINDOW))
-	for file_index in range(num_files_to_print - 1):
-		save_fn = os.path.join(output_folder, chrom + '_' + str(file_index) + '_combined_segment.bed.gz')
-		if (os.path.isfile(save_fn)) and redo_existing_files == 0:  # file already exists and users specifies that they do not need to rewrite this file
-			continue 
-		start_row_index = file_index * helper.NUM_BIN_PER_WINDOW
-		end_row_index = start_row_index + helper.NUM_BIN_PER_WINDOW - 1 # have to add the -1 because in pandas indexing, both ends of the indices are included, unlike regular python convention
-		save_df = chrom_df.loc[start_row_index:end_row_index]
-		save_df.to_csv(save_fn, header = True, index = False, sep = '\t', compression = 'gzip')
-	last_index = num_files_to_print - 1
-	last_save_df = chrom_df.loc[last_index * helper.NUM_BIN_PER_WINDOW:]
-	last_save_fn = os.path.join(output_folder, chrom + '_' + str(last_index) + '_combined_segment.bed.gz')
-	last_save_df.to_csv(last_save_fn, header = True, index = False, sep = '\t', compression = 'gzip')
-	print("Done saving file: {}".format(last_save_fn))
-	return 
+	state_code_dict = {}
+	seen_chrom_set = set()
+	current_chrom = None
+	code_run_list = [] # pieces of the run-length data of current_chrom, from the chunks read so far
+	num_bin_run_list = []
+	for chunk_df in pd.read_csv(fn, header = None, index_col = None, sep = '\t', chunksize = STREAM_CHUNK_NUM_ROWS):
+		assert chunk_df.shape[1] >= NUM_MUST_HAVE_COLUMNS, 'Number of columns for each segmentation file should be at least 4, with the first 4 columns correspond to chrom, start, end, state: {}'.format(fn)
+		chunk_df = chunk_df.iloc[:,:NUM_MUST_HAVE_COLUMNS]
+		chunk_df.columns = ['chrom', 'start_bp', 'end_bp', 'state']
+		chunk_codes = transform_state_column_into_codes(chunk_df['state'], state_annot_dict, state_code_dict) # transform the state into the one-based state index: 1, 2, ..., 18
+		chunk_num_bins = ((chunk_df['end_bp'] - chunk_df['start_bp']) // helper.NUM_BP_PER_BIN).values
+		chunk_chroms = chunk_df['chrom'].values
+		# split the chunk into pieces of consecutive lines from the same chromosome
+		piece_boundaries = np.flatnonzero(chunk_chroms[1:] != chunk_chroms[:-1]) + 1
+		piece_starts = np.concatenate([[0], piece_boundaries])
+		piece_ends = np.concatenate([piece_boundaries, [len(chunk_chroms)]])
+		for start_index, end_index in zip(piece_starts, piece_ends):
+			chrom = chunk_chroms[start_index]
+			if chrom != current_chrom:
+				if current_chrom is not None:
+					yield current_chrom, (np.concatenate(code_run_list), np.concatenate(num_bin_run_list))
+				assert chrom not in seen_chrom_set, 'In file {}, the segments of chromosome {} are not listed in consecutive lines. Please sort the input segmentation file by chromosome (for example: sort -k1,1 -k2,2n) and rerun.'.format(fn, chrom)
+				seen_chrom_set.add(chrom)
+				current_chrom = chrom
+				code_run_list = []
+				num_bin_run_list = []
+			code_run_list.append(chunk_codes[start_index:end_index])
+			num_bin_run_list.append(chunk_num_bins[start_index:end_index])
+	if current_chrom is not None:
+		yield current_chrom, (np.concatenate(code_run_list), np.concatenate(num_bin_run_list))
+
+def get_one_chrom_runs_from_stream(ct_stream, pending_run_dict, chrom, chrom_to_save_set):
+	'''
+	Advance one sample's stream (stream_one_ct_segment_fn) until we get the run-length data of chrom. Chromosomes that this sample's file lists before chrom are kept in pending_run_dict (keys: chrom, values: run-length data), in case the sample files list the chromosomes in different orders. Return None if the sample has no data for chrom.
+	'''
+	if chrom in pending_run_dict:
+		return pending_run_dict.pop(chrom)
+	for this_chrom, runs in ct_stream:
+		if this_chrom == chrom:
+			return runs
+		if this_chrom in chrom_to_save_set:
+			pending_run_dict[this_chrom] = runs
+	return None
 
-def process_one_chrom_all_ct(input_fn_list, ct_list, chrom, output_folder, state_annot_dict, redo_existing_files):
-	result_df = pd.DataFrame()
+def expand_one_chrom_runs(runs_list, ct_list, chrom):
+	# runs_list: for each sample in ct_list, the run-length data (state_codes, num_bins) of chrom --> a uint8 matrix, rows: samples, columns: genomic bins on the chromosome
+	num_bins_per_ct = list(map(lambda x: int(x[1].sum()), runs_list))
 	for ct_index, ct in enumerate(ct_list):
-		segment_series = process_one_ct_one_chrom_segment_fn(input_fn_list[ct_index], ct, chrom, state_annot_dict)
-		if len(segment_series) == 0: 
-			print ('chromsome data: ' + chrom + ' and cell type: ' + ct + ' show no segmentation data. You may want to check your input!')
-			return
-		if (ct_index != 0):
-			assert len(segment_series) == result_df.shape[0], 'The number of bins in cell type: ' + ct + ' does not match with other cell types in chromosome ' + chrom + ' (' + str(len(segment_series)) + '). Check your input segmentation data, all cell types should have the same chromosome length in the segmentation data.'
-		result_df[ct] = segment_series
-	result_df['chrom'] = chrom
-	result_df['start_bp_this_window'] = helper.NUM_BP_PER_BIN * result_df.index
-	result_df['end_bp_this_window'] = result_df['start_bp_this_window'] + helper.NUM_BP_PER_BIN
-	result_df = result_df[['chrom', 'start_bp_this_window', 'end_bp_this_window'] + ct_list]
-	print_one_chrom_data_to_text(result_df, chrom, output_folder, redo_existing_files)
-	return 
+		assert num_bins_per_ct[ct_index] == num_bins_per_ct[0], 'The number of bins in cell type: ' + ct + ' does not match with other cell types in chromosome ' + chrom + ' (' + str(num_bins_per_ct[ct_index]) + '). Check your input segmentation data, all cell types should have the same chromosome length in the segmentation data.'
+	chrom_code_mat = np.empty((len(ct_list), num_bins_per_ct[0]), dtype = segment_store.STATE_CODE_DTYPE)
+	for ct_index, (state_codes, num_bins) in enumerate(runs_list):
+		chrom_code_mat[ct_index] = np.repeat(state_codes, num_bins)
+	return chrom_code_mat
 
-def combine_all_ct_segment_folder_one_process(input_fn_list, ct_list, chrom_list, output_folder, state_annot_dict, redo_existing_files):
-	for chrom in chrom_list:
-		chrom = 'chr' + chrom # currenntly chrom is just 1 --> 22, X. Again, we exclude Y because not every samples have Ys data
-		process_one_chrom_all_ct(input_fn_list, ct_list, chrom, output_folder, state_annot_dict, redo_existing_files)
+def save_one_chrom_data_to_store(chrom_code_mat, chrom, output_folder, redo_existing_files):
+	# save the data from chromsome into multiple windows in the store, each corresponding to a region on the chromosome. chrom_code_mat: rows: samples, columns: genomic bins on the chromosome
+	num_files_to_print = int(np.ceil(chrom_code_mat.shape[1] / helper.NUM_BIN_PER_WINDOW))
+	for file_index in range(num_files_to_print):
+		window = chrom + '_' + str(file_index)
+		save_fn = segment_store.get_window_fn(output_folder, window)
+		if (os.path.isfile(save_fn)) and redo_existing_files == 0 and file_index < (num_files_to_print - 1):  # file already exists and users specifies that they do not need to rewrite this file. The last window of each chromosome is always rewritten, as before
+			continue 
+		start_bin_index = file_index * helper.NUM_BIN_PER_WINDOW
+		end_bin_index = start_bin_index + helper.NUM_BIN_PER_WINDOW
+		segment_store.save_window(output_folder, window, chrom_code_mat[:, start_bin_index:end_bin_index])
+	print("Done saving file: {}".format(save_fn))
 	return 
 
+def save_one_chrom_runs_to_store(runs_list, ct_list, chrom, output_folder, redo_existing_files):
+	# this function is run by the worker processes: expand the run-length data of all samples on chrom, and save the windows of chrom into the store
+	chrom_code_mat = expand_one_chrom_runs(runs_list, ct_list, chrom)
+	save_one_chrom_data_to_store(chrom_code_mat, chrom, output_folder, redo_existing_files)
+	return chrom
+
+def stream_all_ct_chrom_runs(input_fn_list, ct_list, output_folder, state_annot_dict, redo_existing_files):
+	'''
+	Generator that streams all samples' segmentation files in lockstep, chromosome by chromosome. As soon as all samples' data for a chromosome are read, it yields the arguments of save_one_chrom_runs_to_store for that chromosome.
+	'''
+	chrom_to_save_set = set(map(lambda x: 'chr' + x, helper.CHROMOSOME_LIST)) # currenntly chrom is just 1 --> 22, X. Again, we exclude Y because not every samples have Ys data
+	ct_stream_list = list(map(lambda x: stream_one_ct_segment_fn(x, state_annot_dict), input_fn_list))
+	pending_run_dict_list = [{} for ct in ct_list]
+	# the first sample's file decides the order in which chromosomes are processed. Other samples' files are streamed alongside it
+	for chrom, first_ct_runs in ct_stream_list[0]:
+		if chrom not in chrom_to_save_set:
+			continue
+		runs_list = [first_ct_runs]
+		for ct_index in range(1, len(ct_list)):
+			runs = get_one_chrom_runs_from_stream(ct_stream_list[ct_index], pending_run_dict_list[ct_index], chrom, chrom_to_save_set)
+			if runs is None:
+				print ('chromsome data: ' + chrom + ' and cell type: ' + ct_list[ct_index] + ' show no segmentation data. You may want to check your input!')
+				break
+			runs_list.append(runs)
+		if len(runs_list) < len(ct_list): # some samples do not have data for this chromosome
+			continue
+		yield (runs_list, ct_list, chrom, output_folder, redo_existing_files)
+
+def get_redo_existing_files(output_folder, ct_list, redo_existing_files):
+	'''
+	The rows of the window matrices are the samples in the order of store_meta.json, so windows that already exist can only be kept if they were written with the same list of samples, in the same order, as ct_list. Otherwise (samples added, removed or reordered, or existing windows without a sidecar file), all the windows are rewritten.
+	'''
+	if redo_existing_files == 1:
+		return 1
+	if os.path.isfile(os.path.join(output_folder, segment_store.STORE_META_FN)):
+		store_sample_list = segment_store.read_store_meta(output_folder)['samples']
+		if store_sample_list == ct_list:
+			return 0
+		print ('The samples in ' + output_folder + ' (' + str(store_sample_list) + ') are not the same as the input samples. All the windows will be rewritten.')
+		return 1
+	if len(segment_store.list_windows(output_folder)) > 0:
+		print ('The windows in ' + output_folder + ' have no sidecar file listing their samples. All the windows will be rewritten.')
+		return 1
+	return 0
+
 def combine_all_ct_segment_folder(input_folder, output_folder, input_suffix, state_annot_dict, redo_existing_files):
-	input_fn_list = glob.glob(input_folder + '/*/*' + input_suffix) # ex: input_folder/E003_chr22_core_K27ac_segments.bed.gz
+	input_fn_list = sorted(glob.glob(input_folder + '/*/*' + input_suffix), key = lambda x: x.split('/')[-1].split(input_suffix)[0]) # ex: input_folder/E003_chr22_core_K27ac_segments.bed.gz. Sorted by sample, so that the rows of the windows are in the same order in every run
 	ct_list = list(map(lambda x: x.split('/')[-1].split(input_suffix)[0], input_fn_list)) # E003
 	print (ct_list)
-	num_cores = 4
-	partition_chrom_list = helper.partition_file_list(helper.CHROMOSOME_LIST, num_cores)
-	processes = [mp.Process(target = combine_all_ct_segment_folder_one_process, args = (input_fn_list, ct_list, partition_chrom_list[i], output_folder, state_annot_dict, redo_existing_files)) for i in range(num_cores)]
-	for p in processes:
-		p.start()
-	for i, p in enumerate(processes):
-		p.join()
-		print('Done with process ' + str(i + 1))
+	redo_existing_files = get_redo_existing_files(output_folder, ct_list, redo_existing_files)
+	chrom_runs_stream = stream_all_ct_chrom_runs(input_fn_list, ct_list, output_folder, state_annot_dict, redo_existing_files)
+	done_chrom_list = helper.run_jobs_as_produced(save_one_chrom_runs_to_store, chrom_runs_stream, NUM_CORES)
+	print('Done with chromosomes: {}'.format(done_chrom_list))
+	segment_store.write_store_meta(output_folder, ct_list) # the sidecar file lists the samples in the order of rows in all window matrices
 	return 
 
 def main():
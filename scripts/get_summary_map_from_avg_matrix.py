@@ -4,6 +4,9 @@ import numpy as np
 import os
 import glob
 import helper
+import compressed_io
+import prob_matrix
+import genome_matrix
 import argparse
 
 
@@ -24,7 +27,7 @@ def get_rgb_format_right(rgb):
 	numbers = list(map(lambda x: str(int(x)), numbers))
 	return ",".join(numbers)
 
-def get_standard_ucsc_format_bed_file(segment_df, state_annot_df, output_fn, igv_track_name):
+def get_standard_ucsc_format_bed_df(segment_df, state_annot_df):
 	segment_df = pd.merge(segment_df, state_annot_df
 		, how = 'left', left_on = 'state', right_on = 'state', left_index = False, right_index = False)
 	segment_df = segment_df [['chrom', 'start_bp', 'end_bp', 'state_name', 'itemRgb']] # get mnenomic so that we get the actual state name
@@ -36,70 +39,128 @@ def get_standard_ucsc_format_bed_file(segment_df, state_annot_df, output_fn, igv
 	segment_df['thickEnd'] = segment_df['end_bp']
 	segment_df = segment_df.rename(columns = {'start_bp' : 'chromStart', 'end_bp' : 'chromEnd', 'state_name' : 'name'})
 	segment_df = segment_df[['chrom', 'chromStart', 'chromEnd', 'name', 'score', 'strand', 'thickStart', 'thickEnd', 'itemRgb']]
-	helper.remove_file(output_fn) # so that we can write a new file
-	# outF = open(output_fn, 'a')
-	# header_comment = "track name=\"" + igv_track_name + "_" + "\" description=\"\" visibility=1 itemRgb=\"On\"\n"
-	# outF.write(header_comment) # write the comment first so that genome browser can read the file
-	segment_df.to_csv(output_fn, sep = '\t', header = False, index = False, compression = 'gzip')
-	# outF.close()
+	return segment_df
+
+def get_max_prob_state_runs(prob_mat, state_list):
+	'''
+	prob_mat: rows: consecutive genomic bins, columns: states (state_list: the state index of each column)
+	--> start_bin_index, end_bin_index (exclusive) and state of each run of consecutive bins that have the same max-probability state
+	ex: the max-probability states are [1, 1, 3, 3, 3, 2] --> [0, 2, 5], [2, 5, 6], [1, 3, 2]
+	'''
+	max_state = np.asarray(state_list)[np.argmax(prob_mat, axis = 1)] # if there are ties, the first state is picked, same as pandas idxmax
+	change_index = np.flatnonzero(max_state[1:] != max_state[:-1]) + 1 # bins where the max state is different from that of the previous bin
+	start_bin_index = np.concatenate([[0], change_index])
+	end_bin_index = np.concatenate([change_index, [len(max_state)]])
+	return start_bin_index, end_bin_index, max_state[start_bin_index]
 
+def get_max_prob_state_runs_from_rle(run_end_bins, run_prob_mat, state_list):
+	'''
+	Same as get_max_prob_state_runs, for a matrix given as runs of consecutive bins with identical probabilities (see prob_matrix.get_rle_prob_mat): the max-probability state is found once per run, and consecutive runs with the same max-probability state are merged
+	ex: run_end_bins = [2, 3, 5], the max-probability states of the runs are [1, 3, 3] --> [0, 2], [2, 5], [1, 3]
+	'''
+	start_run_index, end_run_index, run_state = get_max_prob_state_runs(run_prob_mat, state_list)
+	run_start_bins = np.concatenate([[0], run_end_bins[:-1]])
+	return run_start_bins[start_run_index], run_end_bins[end_run_index - 1], run_state
 
 def get_max_prob_state_segmentation_one_region(state_rep_prob_fn, genome_pos, num_chromHMM_state):
 	print (state_rep_prob_fn)
-	segment_df = open_chrom_state_df(state_rep_prob_fn, num_chromHMM_state)
-	max_state = segment_df.idxmax(axis = 1) # get the column max, but return the column names
-	max_state = list(map(lambda x: 'E' + str(x.split('_')[1]), max_state)) # chagne from state_18 to E18 for all elements in the max_state series
+	run_end_bins, run_prob_mat = open_chrom_state_rle_mat(state_rep_prob_fn, num_chromHMM_state) # the max-probability state is found once for each run of bins with identical probabilities
+	state_list = list(range(1, num_chromHMM_state + 1)) # columns: state_1 --> state_<num_chromHMM_state>
+	if len(run_end_bins) == 0:
+		return pd.DataFrame(columns = ['chrom', 'start_bp', 'end_bp', 'state'])
+	return get_segment_df(genome_pos, *get_max_prob_state_runs_from_rle(run_end_bins, run_prob_mat, state_list))
+
+def get_max_prob_state_segmentation_one_region_from_genome_matrix(avg_genome_matrix, genome_pos, num_chromHMM_state):
+	# same as get_max_prob_state_segmentation_one_region, the probabilities of the region are a slice of the memory-mapped array of its chromosome (see genome_matrix.py). avg_genome_matrix: the layout of the folder, read once by create_igv_format_bed
+	prob_mat = genome_matrix.get_window_mat(avg_genome_matrix, genome_pos)
+	state_list = list(range(1, num_chromHMM_state + 1)) # columns: state_1 --> state_<num_chromHMM_state>
+	if prob_mat.shape[0] == 0:
+		return pd.DataFrame(columns = ['chrom', 'start_bp', 'end_bp', 'state'])
+	return get_segment_df(genome_pos, *get_max_prob_state_runs(prob_mat, state_list))
+
+def get_segment_df(genome_pos, start_bin_index, end_bin_index, run_state):
+	# the segments of one region (ex: chr1_3), with bin indices from the start of the region --> dataframe: chrom, start_bp, end_bp, state (E1 --> E18)
 	chr_data = genome_pos.split('_')[0]
 	offset_bp = int(genome_pos.split('_')[1])
 	offset_bp = offset_bp * helper.NUM_BP_PER_WINDOW # each window contains data in terms of NUM_BP_PER_WINDOW
-	result_df = pd.DataFrame(columns = ['chrom', 'start_bp', 'end_bp', 'state'])
-	current_start_bin_index = 0
-	current_end_bin_index = 1 
-	current_state = max_state[current_start_bin_index]
-	for index in range(1, len(max_state)): # skip the first one because it's already reported into the current data
-		if (current_state == max_state[index]):
-			current_end_bin_index = index + 1 # add one more bin to the stread of bins that are segmented here
-		else: # change of state --> report into the result_df
-			start_bp_report = offset_bp +  current_start_bin_index * helper.NUM_BP_PER_BIN
-			end_bp_report = offset_bp + current_end_bin_index * helper.NUM_BP_PER_BIN
-			add_row = [chr_data, start_bp_report, end_bp_report, current_state]
-			result_df.loc[result_df.shape[0]] = add_row
-			current_state = max_state[index]
-			current_start_bin_index = index
-			current_end_bin_index = index + 1
-	start_bp_report = offset_bp + current_start_bin_index * helper.NUM_BP_PER_BIN
-	end_bp_report = offset_bp + current_end_bin_index * helper.NUM_BP_PER_BIN
-	add_row = [chr_data, start_bp_report, end_bp_report, current_state]
-	result_df.loc[result_df.shape[0]] = add_row
-	# now we are done producing
+	result_df = pd.DataFrame({'chrom': chr_data, 'start_bp': offset_bp + start_bin_index * helper.NUM_BP_PER_BIN, 'end_bp': offset_bp + end_bin_index * helper.NUM_BP_PER_BIN, 'state': list(map(lambda x: 'E' + str(x), run_state))}) # chagne from 18 to E18
 	return result_df
 
+def merge_runs_across_windows(region_df_iterator):
+	'''
+	region_df_iterator: the results of get_max_prob_state_segmentation_one_region for consecutive windows in genomic order
+	Generator: yield the same segments, except that the last segment of a window and the first segment of the next window are merged into one segment if they are contiguous and have the same state. The last segment of each window is held back until we see the next window.
+	'''
+	pending_row = None # [chrom, start_bp, end_bp, state] of the last segment seen so far
+	for region_df in region_df_iterator:
+		if region_df.shape[0] == 0:
+			continue
+		region_df = region_df.reset_index(drop = True)
+		first_row = region_df.iloc[0]
+		if pending_row is not None:
+			if pending_row[0] == first_row['chrom'] and pending_row[2] == first_row['start_bp'] and pending_row[3] == first_row['state']:
+				region_df.loc[0, 'start_bp'] = pending_row[1]
+			else:
+				yield pd.DataFrame([pending_row], columns = region_df.columns)
+		if region_df.shape[0] > 1:
+			yield region_df.iloc[:-1]
+		pending_row = list(region_df.iloc[-1])
+	if pending_row is not None:
+		yield pd.DataFrame([pending_row], columns = ['chrom', 'start_bp', 'end_bp', 'state'])
+	return
+
+def get_sorted_genome_pos_list(genome_pos_list):
+	# sort windows by chromosome and then by the window index: chr1_0, chr1_1, ..., chr1_24, chr10_0, ... (chromosomes sorted the same way as sort -k1,1 -k2,2n)
+	return sorted(genome_pos_list, key = lambda x: (x.split('_')[0], int(x.split('_')[1])))
 
-def create_igv_format_bed(avg_folder, state_annot_fn, output_fn, igv_format, igv_track_name, num_chromHMM_state):
+def open_output_file(output_fn):
+	# compressed (with the codec of compressed_io.open_output, gzip by default) if output_fn ends with .gz, plain text otherwise
+	if output_fn.endswith('.gz'):
+		return compressed_io.open_output(output_fn, 'wt')
+	return open(output_fn, 'w')
+
+def create_igv_format_bed(avg_folder, state_annot_fn, output_fn, igv_format, igv_track_name, num_chromHMM_state, num_cores):
+	# windows are processed in parallel, and their segments are written to output_fn in genomic order as soon as all the windows before them are done, so that we never hold the whole genome's segmentation in memory
 	rep_prob_fn_list = glob.glob(avg_folder + '/*_avg_pred.txt.gz')
 	genome_pos_list = list(map(lambda x: x.split('/')[-1].split('_avg_pred.txt.gz')[0], rep_prob_fn_list))
+	genome_pos_list = get_sorted_genome_pos_list(genome_pos_list)
 	state_annot_df = read_state_annot_fn(state_annot_fn)
-	result_df = pd.DataFrame(columns = ['chrom', 'start_bp', 'end_bp', 'state'])
-	for index, rep_prob_fn in enumerate(rep_prob_fn_list):
-		this_region_max_state_df = get_max_prob_state_segmentation_one_region(rep_prob_fn, genome_pos_list[index], num_chromHMM_state)
-		result_df = result_df.append(this_region_max_state_df)
-	result_df.sort_values(['chrom', 'start_bp'], inplace = True)
-	if igv_format: # if user specified they wanted output that can then be read into ucsc genome browser
-		get_standard_ucsc_format_bed_file(result_df, state_annot_df, output_fn, igv_track_name)
+	avg_genome_matrix = genome_matrix.get_genome_matrix(avg_folder, num_chromHMM_state)
+	if avg_genome_matrix is not None: # the regions are read from the genome matrix layout of avg_folder, without opening their files
+		print('Reading the summary chromatin state assignment matrices from the genome matrix layout of {}'.format(avg_folder))
+		job_args_list = list(map(lambda x: (avg_genome_matrix, x, num_chromHMM_state), genome_pos_list))
+		region_df_iterator = helper.iterate_jobs_in_order(get_max_prob_state_segmentation_one_region_from_genome_matrix, job_args_list, num_cores)
 	else:
-		result_df.to_csv(output_fn, header = False, index = False, sep = '\t')
+		job_args_list = list(map(lambda x: (os.path.join(avg_folder, x + '_avg_pred.txt.gz'), x, num_chromHMM_state), genome_pos_list))
+		region_df_iterator = helper.iterate_jobs_in_order(get_max_prob_state_segmentation_one_region, job_args_list, num_cores)
+	outF = open_output_file(output_fn) # overwrite the existing file, if any
+	# header_comment = "track name=\"" + igv_track_name + "_" + "\" description=\"\" visibility=1 itemRgb=\"On\"\n"
+	# outF.write(header_comment) # write the comment first so that genome browser can read the file
+	for segment_df in merge_runs_across_windows(region_df_iterator):
+		if igv_format: # if user specified they wanted output that can then be read into ucsc genome browser
+			segment_df = get_standard_ucsc_format_bed_df(segment_df, state_annot_df)
+		segment_df.to_csv(outF, header = False, index = False, sep = '\t')
+	outF.close()
 	print('Done!')
 	return 
 
 def open_chrom_state_df(fn, num_chromHMM_state):
-	df = pd.read_csv(fn, header = 0, index_col = 0, sep = '\t')
-	if df.shape[1] == (num_chromHMM_state-1):
-		df = pd.read_csv(fn, header =0, index_col=None, sep = '\t')
-	elif df.shape[1] != (num_chromHMM_state):
-		print(f'The input data of file {fn} has {df.shape[1]} columns, which is fewer for the input num_chromHMM_state ({num_chromHMM_state}). The script will have to exit to ensure execution fidelity, please check that your input file is properly formatted.')
+	# the file can be in any of the formats of prob_matrix.py
+	try:
+		df = prob_matrix.read_prob_df(fn, num_chromHMM_state)
+	except AssertionError as e:
+		print(f'{e}. The input data of file {fn} does not match the input num_chromHMM_state ({num_chromHMM_state}). The script will have to exit to ensure execution fidelity, please check that your input file is properly formatted.')
 		exit(1)
 	return df
 
+def open_chrom_state_rle_mat(fn, num_chromHMM_state):
+	# same as open_chrom_state_df --> run_end_bins, run_prob_mat (see prob_matrix.read_rle_prob_mat)
+	try:
+		return prob_matrix.read_rle_prob_mat(fn, num_chromHMM_state)
+	except AssertionError as e:
+		print(f'{e}. The input data of file {fn} does not match the input num_chromHMM_state ({num_chromHMM_state}). The script will have to exit to ensure execution fidelity, please check that your input file is properly formatted.')
+		exit(1)
+
 
 
 if __name__ == '__main__':
@@ -107,7 +168,7 @@ if __name__ == '__main__':
 	parser.add_argument('--avg_folder', type = str, required = True,
 		help = 'Where there are files showing the representative chroamtin state assignment matrices for different regions on the genome')
 	parser.add_argument('--output_fn', type = str, required = True, 
-		help = 'output_fn')
+		help = 'output_fn. The output is gzip-compressed if output_fn ends with .gz')
 	parser.add_argument('--igv_format', action="store_true", required = False, default = False,
 			help = '1 means that output summary chromatin state map will be written in a form that can be read into ucsc genome browser. 0 the the output summary chromatin state map will just be a normal bed file with columns: chrom, start, end, state (ex: E1 --> E18)') # had to set this to either 0 or 1 instead of being a boolean value right  away because then I can run this on my snakemake pipeline
 	parser.add_argument('--igv_track_name', type=str, required=False,
@@ -117,10 +178,11 @@ if __name__ == '__main__':
 		default = 'test_data/state_annotation.txt',
 		help = 'If you dont provide the state_annot_fn, we will use the default which is test_data/state_annotation.txt, which is from roadmap\'s 18-state annotation. If your annotation is not from the same model, please provide this parameter otherwise the code will stop without producing output.')
 	parser.add_argument('--num_chromHMM_state', type= int, required=False, default=18, help='number of states in our chromHMM model')
+	parser.add_argument('--num_cores', type = int, required = False, default = 4, help = 'number of processes that calculate the summary chromatin state map of different regions of the genome at the same time')
 	args = parser.parse_args()
 	print(args)
 	helper.check_dir_exist(args.avg_folder)
 	helper.create_folder_for_file(args.output_fn)
 	helper.check_file_exist(args.state_annot_fn)
-	create_igv_format_bed(args.avg_folder, args.state_annot_fn, args.output_fn, args.igv_format, args.igv_track_name, args.num_chromHMM_state)
+	create_igv_format_bed(args.avg_folder, args.state_annot_fn, args.output_fn, args.igv_format, args.igv_track_name, args.num_chromHMM_state, args.num_cores)
 
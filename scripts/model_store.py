@@ -0,0 +1,73 @@
+#!/usr/bin/env python
+
+'''
+This file contains functions to save and load the trained CSREP models (multinomial logistic regression predicting the chromatin state map of one response sample from the other samples in the group), so that the predictions can be (re)done without training the models again: on new or re-ingested windows of the segmentation store, on a subset of the genome, or after a job was halted in the middle of the genome.
+Each model is stored in one file <response_ct>_model.npz (numpy's compressed archive) inside the prediction folder of the response sample (pred_<response_ct>), with arrays:
+|__ coef, intercept, classes: the fitted parameters of the model (sklearn's LogisticRegression coef_, intercept_, classes_)
+|__ train_cell_types: the predictor samples, in the order of the model's features (see train_multiLog_auto1Hot.get_X_colnames)
+|__ response_ct, num_chromHMM_state, seed, train_from_pattern_counts
+|__ train_fingerprint: fingerprint of the seed, train_from_pattern_counts and the training data files of the model (see get_train_fingerprint), so that a model is not reused after its training data were re-sampled or re-ingested
+
+List of functions:
+- get_model_fn(model_dir, response_ct) --> path to the model file of response_ct
+- get_train_fingerprint(train_fn_list, seed, train_from_pattern_counts) --> fingerprint of the training of a model
+- save_model(model_fn, regression_machine, train_cell_types, response_ct, num_chromHMM_state, seed, train_from_pattern_counts, train_fingerprint) --> write the model file
+- get_regression_machine(coef, intercept, classes) --> a LogisticRegression object that can predict, from its fitted parameters
+- load_model(model_fn) --> regression_machine (a LogisticRegression object that can predict), dictionary of the other fields
+- get_model_train_params(model_fn) --> seed, train_from_pattern_counts and train_fingerprint of a saved model, without loading its parameters
+- load_model_if_matching(model_fn, train_cell_types, num_chromHMM_state, train_fingerprint) --> the model if model_fn exists and was trained with the same predictor samples, number of states and training fingerprint, None otherwise
+'''
+import os
+import numpy as np
+import manifest
+from sklearn.linear_model import LogisticRegression
+
+MODEL_FN_SUFFIX = '_model.npz'
+
+def get_model_fn(model_dir, response_ct):
+	return os.path.join(model_dir, response_ct + MODEL_FN_SUFFIX)
+
+def get_train_fingerprint(train_fn_list, seed, train_from_pattern_counts):
+	# train_fn_list: the training data files of the predictor samples and the response sample. A model trained from the same files (same sizes and modification times, see manifest.get_file_fingerprint) with the same seed and train_from_pattern_counts has the same fingerprint
+	train_fn_dict = dict(map(lambda x: (os.path.basename(x), manifest.get_file_fingerprint(x)), train_fn_list))
+	return manifest.get_params_fingerprint({'seed': seed, 'train_from_pattern_counts': train_from_pattern_counts, 'train_fn': train_fn_dict})
+
+def save_model(model_fn, regression_machine, train_cell_types, response_ct, num_chromHMM_state, seed, train_from_pattern_counts, train_fingerprint):
+	np.savez_compressed(model_fn, coef = regression_machine.coef_, intercept = regression_machine.intercept_, classes = regression_machine.classes_, train_cell_types = np.array(train_cell_types), response_ct = np.array(response_ct), num_chromHMM_state = np.array(num_chromHMM_state), seed = np.array(seed), train_from_pattern_counts = np.array(train_from_pattern_counts), train_fingerprint = np.array(train_fingerprint))
+	print ("Done saving model: " + model_fn)
+	return
+
+def get_regression_machine(coef, intercept, classes):
+	# the object is only used to predict, so we set the fitted attributes directly instead of fitting it
+	regression_machine = LogisticRegression(random_state = 0, solver = 'lbfgs', max_iter = 10000)
+	regression_machine.coef_ = coef
+	regression_machine.intercept_ = intercept
+	regression_machine.classes_ = classes
+	regression_machine.n_features_in_ = coef.shape[1]
+	return regression_machine
+
+def load_model(model_fn):
+	with np.load(model_fn, allow_pickle = False) as model_data:
+		regression_machine = get_regression_machine(model_data['coef'], model_data['intercept'], model_data['classes'])
+		model_meta = {'train_cell_types': list(map(str, model_data['train_cell_types'])), 'response_ct': str(model_data['response_ct']), 'num_chromHMM_state': int(model_data['num_chromHMM_state'])}
+	model_meta.update(get_model_train_params(model_fn))
+	return regression_machine, model_meta
+
+def get_model_train_params(model_fn):
+	# only the small arrays of the training parameters are read from the archive. Models saved before train_fingerprint was added get None, so they never match a training fingerprint
+	with np.load(model_fn, allow_pickle = False) as model_data:
+		return {'seed': int(model_data['seed']), 'train_from_pattern_counts': int(model_data['train_from_pattern_counts']) if 'train_from_pattern_counts' in model_data.files else None, 'train_fingerprint': str(model_data['train_fingerprint']) if 'train_fingerprint' in model_data.files else None}
+
+def load_model_if_matching(model_fn, train_cell_types, num_chromHMM_state, train_fingerprint):
+	# used to skip training when a previous run has already saved the model. If the saved model was trained with different predictor samples or number of states (ex: the group was changed), or with a different seed, train_from_pattern_counts or training data (see get_train_fingerprint), we should train again
+	if not os.path.isfile(model_fn):
+		return None
+	regression_machine, model_meta = load_model(model_fn)
+	if model_meta['train_cell_types'] != list(train_cell_types) or model_meta['num_chromHMM_state'] != num_chromHMM_state:
+		print ("Model {} was trained with different samples or number of states. We will train it again".format(model_fn))
+		return None
+	if model_meta['train_fingerprint'] != train_fingerprint:
+		print ("Model {} was trained with a different seed or different training data. We will train it again".format(model_fn))
+		return None
+	print ("Loaded the model trained previously: " + model_fn)
+	return regression_machine
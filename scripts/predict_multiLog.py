@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+'''
+This file predicts the chromatin state maps of samples from CSREP models that were trained and saved previously by train_multiLog_auto1Hot.py or train_multiLog_group.py (see model_store.py), without training the models again. It is useful to predict windows that were added to (or re-ingested into) the segmentation store, to predict only a subset of the genome, or to finish the predictions of a job that was halted in the middle of the genome.
+The outputs are the same as those of train_multiLog_auto1Hot.py: <predict_outDir>/<window>_pred_out.txt.gz, in the format given by --prob_file_format (see prob_matrix.py)
+'''
+import os
+import argparse
+import helper
+import segment_store
+import model_store
+import prob_matrix
+import train_multiLog_auto1Hot as multiLog
+
+def filter_window_list(window_list, chrom_list, selected_window_list):
+	# only keep windows that are in chrom_list (ex: [chr1, chr2]) and in selected_window_list (ex: [chr1_0, chr1_1]). None means no filtering
+	if chrom_list is not None:
+		window_list = list(filter(lambda x: x.split('_')[0] in chrom_list, window_list))
+	if selected_window_list is not None:
+		window_list = list(filter(lambda x: x in selected_window_list, window_list))
+	return window_list
+
+def get_window_list_to_predict(model_fn, all_ct_segment_folder, predict_outDir, chrom_list, selected_window_list, replace_existing_files, prob_file_format):
+	# the windows whose predictions from model_fn are missing or out of date in predict_outDir (see manifest.py), among the selected windows
+	model_meta = model_store.load_model(model_fn)[1]
+	window_list = multiLog.find_uncalculated_gene_regions(predict_outDir, all_ct_segment_folder, replace_existing_files, model_meta['train_cell_types'], model_meta['response_ct'], model_meta['num_chromHMM_state'], model_fn, prob_file_format)
+	return filter_window_list(window_list, chrom_list, selected_window_list)
+
+def predict_one_model(model_fn, all_ct_segment_folder, predict_outDir, window_list, prob_file_format, num_cores):
+	# predict the windows in window_list with the model saved in model_fn, with num_cores processes sharing the model (see multiLog.predict_segmentation_window_parallel)
+	regression_machine, model_meta = model_store.load_model(model_fn)
+	train_cell_types = model_meta['train_cell_types']
+	train_ct_row_indices = segment_store.get_sample_row_indices(all_ct_segment_folder, train_cell_types)
+	output_fn_list = list(map(lambda x: os.path.join(predict_outDir, x + "_pred_out.txt.gz"), window_list))
+	multiLog.predict_segmentation_window_parallel(all_ct_segment_folder, window_list, output_fn_list, train_cell_types, train_ct_row_indices, model_meta['response_ct'], model_meta['num_chromHMM_state'], regression_machine, model_fn, prob_file_format, num_cores)
+	return
+
+def predict_all_models(model_fn_list, predict_outDir_list, all_ct_segment_folder, chrom_list, selected_window_list, replace_existing_files, prob_file_format, num_cores):
+	# one job per model, weighted by the number of windows that the model has to predict. If there is only one model, its windows are predicted by num_cores processes instead
+	job_args_list = []
+	job_weight_list = []
+	for model_fn, predict_outDir in zip(model_fn_list, predict_outDir_list):
+		helper.make_dir(predict_outDir)
+		window_list = get_window_list_to_predict(model_fn, all_ct_segment_folder, predict_outDir, chrom_list, selected_window_list, replace_existing_files, prob_file_format)
+		print ("Model {}: {} windows to predict".format(model_fn, len(window_list)))
+		job_args_list.append((model_fn, all_ct_segment_folder, predict_outDir, window_list, prob_file_format, 1))
+		job_weight_list.append(len(window_list))
+	if len(job_args_list) == 1:
+		predict_one_model(*job_args_list[0][:-1], num_cores)
+		return
+	helper.run_weighted_jobs(predict_one_model, job_args_list, job_weight_list, num_cores)
+	return
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Predict the chromatin state maps of samples from CSREP models saved by train_multiLog_auto1Hot.py or train_multiLog_group.py, without training the models again.')
+	parser.add_argument('--all_ct_segment_folder', type = str, required = True,
+		help = 'where segmentation data of all cell types are stored (the binary window store produced by get_all_ct_segment_folder.py)')
+	parser.add_argument('--model_fn', type = str, required = True, nargs = '+',
+		help = 'one or more model files <ct>_model.npz. Ex: to predict all the samples of a group: <group>/CSREP/representative_data/pred_*/*_model.npz')
+	parser.add_argument('--predict_outDir', type = str, required = False, default = None,
+		help = 'where the predictions are written, only when there is one model file. By default, the predictions of each model are written into the folder of the model file (pred_<ct>), as in train_multiLog_auto1Hot.py')
+	parser.add_argument('--chrom', type = str, required = False, default = None, nargs = '+',
+		help = 'only predict windows in these chromosomes. Ex: chr1 chr2')
+	parser.add_argument('--window', type = str, required = False, default = None, nargs = '+',
+		help = 'only predict these windows. Ex: chr1_0 chr1_1')
+	parser.add_argument('--replace_existing_files', type = int, required = False, default = 0, choices = [0, 1],
+		help = '0 (no, only predict windows whose output files are missing or out of date, see manifest.py) or 1 (yes, rewrite everything)')
+	parser.add_argument('--prob_file_format', type = str, required = False, default = prob_matrix.DEFAULT_PROB_FILE_FORMAT, choices = prob_matrix.PROB_FILE_FORMAT_LIST,
+		help = 'format of the prediction files: txt (default), float16, uint8 or rle (see prob_matrix.py for the error of the binary formats)')
+	parser.add_argument('--num_cores', type = int, required = False, default = 4,
+		help = 'number of models that predict at the same time, or number of processes that predict the windows if there is only one model')
+	args = parser.parse_args()
+	print(args)
+	helper.check_dir_exist(args.all_ct_segment_folder)
+	list(map(helper.check_file_exist, args.model_fn))
+	if args.predict_outDir is not None:
+		assert len(args.model_fn) == 1, 'predict_outDir can only be given with one model file. Otherwise, the predictions of each model are written into the folder of the model file'
+		predict_outDir_list = [args.predict_outDir]
+	else:
+		predict_outDir_list = list(map(lambda x: os.path.dirname(os.path.abspath(x)), args.model_fn))
+	predict_all_models(args.model_fn, predict_outDir_list, args.all_ct_segment_folder, args.chrom, args.window, args.replace_existing_files, args.prob_file_format, args.num_cores)
+	print ("Done predicting")
@@ -0,0 +1,159 @@
+#!/usr/bin/env python
+
+'''
+This file contains functions to write and read the matrices of chromatin state assignment probabilities (rows: genomic bins, columns: state_1 --> state_<num_chromHMM_state>): the predictions of each sample (<window>_pred_out.txt.gz), the summary chromatin state assignment matrices (<window>_avg_pred.txt.gz), and the differential scores between two groups.
+These matrices take most of the disk space of the pipeline: each sample has about 15M bins x 18 states written as decimal text. They can be written in one of the formats in PROB_FILE_FORMAT_LIST:
+- 'txt': (default) tab-separated text with a header line state_1 ... state_<num_chromHMM_state>, gzip-compressed. This is the original format, that can be read by any tool
+- 'float16': half-precision floats. For values in [-1, 1], the absolute error is at most 2^-12 (about 2.4e-4)
+- 'uint8': probabilities are stored as round(p * 255), one byte each. The absolute error is at most 1/510 (about 2e-3). Matrices with negative values (differential scores, in [-1, 1]) are stored as int8 round(d * 127), with an absolute error of at most 1/254 (about 3.9e-3)
+- 'rle': runs of consecutive bins with exactly the same probabilities are stored once (lossless). The predictions at a bin only depend on the states of the predictor samples at the bin, so long stretches of the genome (quiescent, heterochromatin, etc.) have identical rows, in the predictions of each sample and in their averages.
+Because of the quantization error, the rows of a 'float16' or 'uint8' matrix do not sum up to exactly 1, and states with almost the same probabilities at a bin can swap their order.
+All the files are compressed with the codec of compressed_io.py (gzip by default, see output_codec in config/config.yaml). The binary formats are .npy arrays, compressed, written under the same file names as the text format (<window>_pred_out.txt.gz, etc.), so that the other steps of the pipeline find the files as before. An 'rle' file holds two arrays: run_end_bins (1D, the end (exclusive) of each run, the last one is the number of bins) and run_prob_mat (rows: runs, columns: states). read_prob_df reads any of the formats: binary files are recognized by the .npy magic string at the beginning of the decompressed file, and the column names state_1 ... state_<num_chromHMM_state> are implied by the number of columns.
+read_rle_prob_mat reads any of the formats as runs (files in the other formats are compressed into runs as they are read), so that the steps after the predictions (averaging, differential scores, summary track, liftOver) work on the runs without expanding them to one row per bin.
+
+List of functions:
+- save_prob_df(prob_df, output_fn, prob_file_format, index = False) --> write prob_df into output_fn in format prob_file_format
+- read_prob_df(fn, num_chromHMM_state) --> dataframe, rows: genomic bins, columns: state_1 --> state_<num_chromHMM_state>
+- get_rle_prob_mat(prob_mat) --> run_end_bins, run_prob_mat
+- expand_rle_prob_mat(run_end_bins, run_prob_mat) --> prob_mat, one row per bin
+- gather_rle_rows(run_end_bins, run_prob_mat, bin_index) --> the rows of the bins in bin_index
+- align_rle_prob_mats(rle_mat_list) --> the matrices in rle_mat_list, cut into the same runs
+- save_rle_prob_mat(run_end_bins, run_prob_mat, output_fn, prob_file_format, index = False) --> write the matrix into output_fn in format prob_file_format
+- read_rle_prob_mat(fn, num_chromHMM_state) --> run_end_bins, run_prob_mat
+'''
+import io
+import numpy as np
+import pandas as pd
+import compressed_io
+
+PROB_FILE_FORMAT_LIST = ['txt', 'float16', 'uint8', 'rle']
+DEFAULT_PROB_FILE_FORMAT = 'txt'
+UINT8_SCALE = 255 # probabilities in [0, 1] --> 0 ... 255
+INT8_SCALE = 127 # differential scores in [-1, 1] --> -127 ... 127
+
+def check_prob_file_format(prob_file_format):
+	assert prob_file_format in PROB_FILE_FORMAT_LIST, 'prob_file_format should be one of {}'.format(PROB_FILE_FORMAT_LIST)
+	return prob_file_format
+
+def get_state_colnames(num_chromHMM_state):
+	return list(map(lambda x: 'state_' + str(x+1), range(num_chromHMM_state)))
+
+def quantize_prob_mat(prob_mat, prob_file_format):
+	# prob_mat: numpy array of floats --> the array that is written into the file, in format prob_file_format ('float16' or 'uint8')
+	if prob_file_format == 'float16':
+		return prob_mat.astype(np.float16)
+	if (prob_mat < 0).any(): # differential scores
+		return np.rint(np.clip(prob_mat, -1, 1) * INT8_SCALE).astype(np.int8)
+	return np.rint(np.clip(prob_mat, 0, 1) * UINT8_SCALE).astype(np.uint8)
+
+def dequantize_prob_mat(stored_mat):
+	# the reverse of quantize_prob_mat. The type of stored_mat tells how it was quantized
+	if stored_mat.dtype == np.uint8:
+		return stored_mat / float(UINT8_SCALE)
+	if stored_mat.dtype == np.int8:
+		return stored_mat / float(INT8_SCALE)
+	return stored_mat.astype(np.float64)
+
+def get_rle_prob_mat(prob_mat):
+	'''
+	prob_mat: rows: consecutive genomic bins, columns: states
+	--> run_end_bins: the end (exclusive) of each run of consecutive bins with identical rows, run_prob_mat: the row of each run
+	ex: prob_mat = [[1, 0], [1, 0], [0, 1]] --> [2, 3], [[1, 0], [0, 1]]
+	'''
+	prob_mat = np.asarray(prob_mat)
+	if prob_mat.shape[0] == 0:
+		return np.zeros(0, dtype = np.int64), prob_mat
+	change_index = np.flatnonzero(np.any(prob_mat[1:] != prob_mat[:-1], axis = 1)) + 1 # bins whose row is different from that of the previous bin
+	run_end_bins = np.concatenate([change_index, [prob_mat.shape[0]]]).astype(np.int64)
+	return run_end_bins, prob_mat[np.concatenate([[0], change_index])]
+
+def merge_identical_runs(run_end_bins, run_prob_mat):
+	# consecutive runs with identical rows (ex: after align_rle_prob_mats) --> one run
+	merged_run_end_bins, merged_run_prob_mat = get_rle_prob_mat(run_prob_mat)
+	return run_end_bins[merged_run_end_bins - 1], merged_run_prob_mat
+
+def expand_rle_prob_mat(run_end_bins, run_prob_mat):
+	run_length = np.diff(np.concatenate([[0], run_end_bins]))
+	return np.repeat(run_prob_mat, run_length, axis = 0)
+
+def gather_rle_rows(run_end_bins, run_prob_mat, bin_index):
+	# bin_index: indices of bins (< run_end_bins[-1]) --> rows: the bins in bin_index, columns: states
+	return run_prob_mat[np.searchsorted(run_end_bins, bin_index, side = 'right')]
+
+def align_rle_prob_mats(rle_mat_list):
+	'''
+	rle_mat_list: list of (run_end_bins, run_prob_mat) of matrices with the same number of bins
+	--> run_end_bins: the union of the ends of the runs of all the matrices, and the list of the run_prob_mat of each matrix cut into these runs, so that the matrices can be added or subtracted run by run
+	'''
+	num_bins_list = list(map(lambda x: x[0][-1] if len(x[0]) > 0 else 0, rle_mat_list))
+	assert len(set(num_bins_list)) == 1, 'The matrices have different numbers of bins: {}'.format(num_bins_list)
+	run_end_bins = np.unique(np.concatenate(list(map(lambda x: x[0], rle_mat_list)))).astype(np.int64)
+	if len(run_end_bins) == 0: # windows without bins
+		return run_end_bins, list(map(lambda x: x[1], rle_mat_list))
+	run_start_bins = np.concatenate([[0], run_end_bins[:-1]]).astype(np.int64)
+	return run_end_bins, list(map(lambda x: gather_rle_rows(x[0], x[1], run_start_bins), rle_mat_list))
+
+def save_rle_prob_mat(run_end_bins, run_prob_mat, output_fn, prob_file_format, index = False):
+	# write the matrix given as runs into output_fn. Formats other than 'rle' are written with one row per bin
+	check_prob_file_format(prob_file_format)
+	if prob_file_format != 'rle':
+		num_chromHMM_state = run_prob_mat.shape[1]
+		save_prob_df(pd.DataFrame(expand_rle_prob_mat(run_end_bins, run_prob_mat), columns = get_state_colnames(num_chromHMM_state)), output_fn, prob_file_format, index)
+		return
+	run_end_bins, run_prob_mat = merge_identical_runs(run_end_bins, run_prob_mat)
+	with compressed_io.open_output(output_fn, 'wb') as outF:
+		np.save(outF, run_end_bins.astype(np.int64))
+		np.save(outF, run_prob_mat)
+	return
+
+def save_prob_df(prob_df, output_fn, prob_file_format, index = False):
+	'''
+	prob_df: rows: genomic bins, columns: state_1 --> state_<num_chromHMM_state>
+	output_fn: compressed output file, with the codec of compressed_io.open_output (to write the file atomically, give the temporary file of manifest.atomic_output)
+	index: whether the index of prob_df is written, only used by the 'txt' format. The binary formats do not keep the index, which is always 0 ... <number of bins - 1> in the pipeline
+	'''
+	check_prob_file_format(prob_file_format)
+	if prob_file_format == 'txt':
+		with compressed_io.open_output(output_fn, 'wt') as outF:
+			prob_df.to_csv(outF, header = True, index = index, sep = '\t')
+		return
+	if prob_file_format == 'rle':
+		save_rle_prob_mat(*get_rle_prob_mat(prob_df.values), output_fn, prob_file_format)
+		return
+	with compressed_io.open_output(output_fn, 'wb') as outF:
+		np.save(outF, quantize_prob_mat(prob_df.values, prob_file_format))
+	return
+
+def read_prob_file(fn, num_chromHMM_state):
+	# read a file written in any format (or by an older version of the pipeline, with or without an index column) --> run_end_bins (None if the file has one row per bin), prob_mat (rows: runs, or bins if run_end_bins is None, columns: states)
+	data = compressed_io.read_compressed(fn) # any of the codecs of compressed_io.py
+	if data.startswith(np.lib.format.MAGIC_PREFIX):
+		buffer = io.BytesIO(data)
+		stored_mat = np.load(buffer)
+		run_end_bins = None
+		if stored_mat.ndim == 1: # an 'rle' file, the run ends come first
+			run_end_bins = stored_mat
+			stored_mat = np.load(buffer)
+		prob_mat = dequantize_prob_mat(stored_mat)
+		assert prob_mat.ndim == 2 and prob_mat.shape[1] == num_chromHMM_state, 'File {} has {} columns, while num_chromHMM_state is {}'.format(fn, prob_mat.shape[-1], num_chromHMM_state)
+		return run_end_bins, prob_mat
+	right_colnames = get_state_colnames(num_chromHMM_state)
+	df = pd.read_csv(io.BytesIO(data), header = 0, index_col = None, sep = '\t')
+	if df.shape[1] == num_chromHMM_state + 1: # the first column is the index
+		df = df.iloc[:, 1:]
+	assert list(df.columns) == right_colnames, 'File {} does not have columns {} ... {}'.format(fn, right_colnames[0], right_colnames[-1])
+	return None, df.values
+
+def read_prob_df(fn, num_chromHMM_state):
+	# read a file written in any format --> dataframe, rows: genomic bins, columns: state_1 --> state_<num_chromHMM_state>, values: floats
+	run_end_bins, prob_mat = read_prob_file(fn, num_chromHMM_state)
+	if run_end_bins is not None:
+		prob_mat = expand_rle_prob_mat(run_end_bins, prob_mat)
+	return pd.DataFrame(prob_mat, columns = get_state_colnames(num_chromHMM_state))
+
+def read_rle_prob_mat(fn, num_chromHMM_state):
+	# read a file written in any format --> run_end_bins, run_prob_mat (see get_rle_prob_mat). Files with one row per bin are compressed into runs
+	run_end_bins, prob_mat = read_prob_file(fn, num_chromHMM_state)
+	if run_end_bins is None:
+		return get_rle_prob_mat(prob_mat)
+	return run_end_bins, prob_mat
@@ -0,0 +1,80 @@
+#!/usr/bin/env python
+
+'''
+This script prints the chromatin state assignment probabilities of CSREP (or base_count) at one or more genomic intervals, for a group of samples or for the differential scores between two groups. The probabilities are read through the region index of the output folder (see region_index.py), which is built into the cache folder of the user the first time the folder is queried, and rebuilt if the folder's files have changed since. The output folder itself is only read.
+Output: tab-separated, one line per 200bp bin that overlaps the intervals: chrom, start, end, state_1 --> state_<num_chromHMM_state>
+Ex: python query_region.py chr22:20000000-20050000 --all_cg_out_dir <all_cg_out_dir> --group ESC --mode CSREP --num_chromHMM_state 18
+'''
+import os
+import sys
+import argparse
+import pandas as pd
+import helper
+import prob_matrix
+import region_index
+
+def get_group_folder(all_cg_out_dir, group, mode):
+	# the output folder of a group (ex: ESC), or of the differential scores between two groups (ex: ESC_minus_Brain), as in the Snakefile
+	if '_minus_' in group:
+		return os.path.join(all_cg_out_dir, group, mode)
+	return os.path.join(all_cg_out_dir, group, mode, 'representative_data', 'average_predictions')
+
+def read_region_list(region_list, regions_fn):
+	# regions given on the command line (chr1:1000-51000) and/or in a bed file (first 3 columns: chrom, start, end) --> list of (chrom, start_bp, end_bp)
+	result = list(map(region_index.parse_region, region_list))
+	if regions_fn is not None:
+		region_df = pd.read_csv(regions_fn, header = None, sep = '\t', usecols = [0, 1, 2], comment = '#')
+		result += list(zip(region_df[0], region_df[1], region_df[2]))
+	return result
+
+def query_region_df(this_region_index, chrom, start_bp, end_bp):
+	# --> dataframe, columns: chrom, start, end, state_1 --> state_<num_chromHMM_state>
+	bin_start_bp, bin_end_bp, prob_mat = region_index.query_region(this_region_index, chrom, start_bp, end_bp)
+	result_df = pd.DataFrame(prob_mat, columns = prob_matrix.get_state_colnames(this_region_index['num_chromHMM_state']))
+	result_df.insert(0, 'end', bin_end_bp)
+	result_df.insert(0, 'start', bin_start_bp)
+	result_df.insert(0, 'chrom', chrom)
+	return result_df
+
+def query_all_regions(folder, num_chromHMM_state, file_suffix, query_list, output_fn):
+	this_region_index = region_index.get_region_index(folder, num_chromHMM_state, file_suffix)
+	outF = sys.stdout if output_fn is None else open(output_fn, 'w')
+	header = True
+	for chrom, start_bp, end_bp in query_list:
+		result_df = query_region_df(this_region_index, chrom, start_bp, end_bp)
+		if result_df.shape[0] == 0:
+			print('Region {}:{}-{} is not in {}'.format(chrom, start_bp, end_bp, folder), file = sys.stderr)
+		result_df.to_csv(outF, header = header, index = False, sep = '\t', float_format = '%.6g')
+		header = False
+	if output_fn is not None:
+		outF.close()
+	return
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Print the chromatin state assignment probabilities of a group of samples (or the differential scores between two groups) at genomic intervals, reading only the parts of the output files that overlap the intervals.')
+	parser.add_argument('region', type = str, nargs = '*',
+		help = 'intervals of the form chrom:start-end (0-based, end-exclusive as in bed files). Ex: chr22:20000000-20050000')
+	parser.add_argument('--regions_fn', type = str, required = False, default = None,
+		help = 'bed file of intervals to query (first 3 columns: chrom, start, end), for many queries at once')
+	parser.add_argument('--folder', type = str, required = False, default = None,
+		help = 'the output folder to query. Otherwise, give --all_cg_out_dir, --group and --mode')
+	parser.add_argument('--all_cg_out_dir', type = str, required = False, default = None,
+		help = 'all_cg_out_dir in config/config.yaml')
+	parser.add_argument('--group', type = str, required = False, default = None,
+		help = 'group of samples (ex: ESC), or two groups for the differential scores (ex: ESC_minus_Brain)')
+	parser.add_argument('--mode', type = str, required = False, default = 'CSREP',
+		help = 'train mode: CSREP or base_count')
+	parser.add_argument('--num_chromHMM_state', type = int, required = True,
+		help = 'number of chromatin states')
+	parser.add_argument('--file_suffix', type = str, required = False, default = region_index.AVG_FILE_SUFFIX,
+		help = 'suffix of the files of the windows in the folder. Ex: _pred_out.txt.gz to query the predictions of one sample')
+	parser.add_argument('--output_fn', type = str, required = False, default = None,
+		help = 'where the results are written. Default: standard output')
+	args = parser.parse_args()
+	if args.folder is None:
+		assert args.all_cg_out_dir is not None and args.group is not None, 'Give either --folder, or --all_cg_out_dir and --group'
+		args.folder = get_group_folder(args.all_cg_out_dir, args.group, args.mode)
+	helper.check_dir_exist(args.folder)
+	query_list = read_region_list(args.region, args.regions_fn)
+	assert len(query_list) > 0, 'Give at least one region, or --regions_fn'
+	query_all_regions(args.folder, args.num_chromHMM_state, args.file_suffix, query_list, args.output_fn)
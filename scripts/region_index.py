@@ -0,0 +1,168 @@
+#!/usr/bin/env python
+
+'''
+This file contains functions to build, and query, an index over the files of chromatin state assignment probabilities of one output folder (ex: <group>/CSREP/representative_data/average_predictions, or a differential folder), so that the probabilities of a genomic interval (ex: a 50kb locus) can be read without knowing the window naming (chr1_0, chr1_1, ...), and without decompressing whole 10Mb windows.
+The index is not written into the output folder, which may be read-only or shared with other users: it is written into a cache folder of the user, one subfolder per output folder (see get_index_folder). The cache is CSREP_CACHE_DIR if this environment variable is set, <XDG_CACHE_HOME or ~/.cache>/csrep otherwise.
+Structure of the index (inside the subfolder of the cache):
+|__ REGION_INDEX_DATA_FN: the probabilities of all the windows of the folder, cut into blocks of BLOCK_NUM_BINS consecutive bins (rows: bins, columns: states, values: INDEX_DTYPE), each block compressed on its own with zlib and written one after the other
+|__ REGION_INDEX_META_FN: the sidecar file: num_chromHMM_state, block_num_bins, dtype, and for each chromosome the list of its blocks: start_bin (bin index from the start of the chromosome), num_bins, offset and size (bytes) in REGION_INDEX_DATA_FN
+Blocks never span two windows, because NUM_BIN_PER_WINDOW is a multiple of BLOCK_NUM_BINS. A query only decompresses the blocks that overlap the interval.
+The index is recorded in the manifest of its subfolder (see manifest.py), and is rebuilt when windows are added or recalculated. Processes that query the same folder at the same time take a lock on the subfolder, so that only one of them builds the index. If the index cannot be written (ex: no cache folder can be created), the queries read the overlapping windows directly instead.
+
+List of functions:
+- get_index_folder(folder) --> the subfolder of the cache where the index of folder is written
+- build_region_index(folder, num_chromHMM_state, file_suffix, index_folder) --> read all the files <window><file_suffix> in folder (in any format of prob_matrix.py) and write the index into index_folder
+- get_region_index(folder, num_chromHMM_state, file_suffix) --> the index of folder (a dictionary, the sidecar file), built first if it is missing or out of date. If the index cannot be written, a dictionary that makes query_region read the windows of folder instead
+- query_region(region_index, chrom, start_bp, end_bp) --> start_bp, end_bp (arrays: coordinates of the bins overlapping the interval) and prob_mat (rows: bins, columns: states)
+- parse_region(region) --> chr1:1000-51000 --> chr1, 1000, 51000
+'''
+import os
+import sys
+import glob
+import json
+import zlib
+import fcntl
+import numpy as np
+import helper
+import manifest
+import prob_matrix
+
+REGION_INDEX_DATA_FN = 'region_index.bin'
+REGION_INDEX_META_FN = 'region_index.json'
+REGION_INDEX_LOCK_FN = 'region_index.lock'
+CACHE_DIR_ENV_VAR = 'CSREP_CACHE_DIR'
+BLOCK_NUM_BINS = 1000 # 200kb per block: a 50kb query decompresses 1 or 2 blocks of 1000 x num_chromHMM_state values
+INDEX_DTYPE = 'float32' # the average probabilities are calculated in float32 (see average_pred_results.py). For the predictions of each sample (float64), the error is at most 6e-8
+AVG_FILE_SUFFIX = '_avg_pred.txt.gz'
+
+def get_window_list(folder, file_suffix):
+	window_fn_list = glob.glob(os.path.join(folder, 'chr*' + file_suffix))
+	window_list = list(map(lambda x: os.path.basename(x).split(file_suffix)[0], window_fn_list)) # from /path/to/chr9_14_avg_pred.txt.gz --> chr9_14
+	return sorted(window_list, key = lambda x: (x.split('_')[0], int(x.split('_')[1])))
+
+def get_region_index_params_fingerprint(num_chromHMM_state):
+	return manifest.get_params_fingerprint({'step': 'region_index', 'num_chromHMM_state': num_chromHMM_state, 'block_num_bins': BLOCK_NUM_BINS, 'dtype': INDEX_DTYPE})
+
+def get_index_folder(folder):
+	# the subfolder of the cache is named after the absolute path of folder, so that each output folder has its own index
+	cache_dir = os.environ.get(CACHE_DIR_ENV_VAR)
+	if cache_dir is None:
+		cache_dir = os.path.join(os.environ.get('XDG_CACHE_HOME', os.path.join(os.path.expanduser('~'), '.cache')), 'csrep')
+	return os.path.join(cache_dir, 'region_index', manifest.get_params_fingerprint({'folder': os.path.abspath(folder)}))
+
+def build_region_index(folder, num_chromHMM_state, file_suffix, index_folder):
+	# one pass over the windows of folder, in genomic order. Each window is read as runs (see prob_matrix.read_rle_prob_mat), then expanded and cut into blocks
+	window_list = get_window_list(folder, file_suffix)
+	window_fn_list = list(map(lambda x: os.path.join(folder, x + file_suffix), window_list))
+	region_index = {'num_chromHMM_state': num_chromHMM_state, 'block_num_bins': BLOCK_NUM_BINS, 'dtype': INDEX_DTYPE, 'chrom': {}}
+	data_fn = os.path.join(index_folder, REGION_INDEX_DATA_FN)
+	meta_fn = os.path.join(index_folder, REGION_INDEX_META_FN)
+	with manifest.atomic_output(data_fn) as temp_fn:
+		with open(temp_fn, 'wb') as outF:
+			offset = 0
+			for window, window_fn in zip(window_list, window_fn_list):
+				chrom = window.split('_')[0]
+				window_start_bin = int(window.split('_')[1]) * helper.NUM_BIN_PER_WINDOW
+				prob_mat = prob_matrix.expand_rle_prob_mat(*prob_matrix.read_rle_prob_mat(window_fn, num_chromHMM_state)).astype(INDEX_DTYPE)
+				chrom_block_dict = region_index['chrom'].setdefault(chrom, {'start_bin': [], 'num_bins': [], 'offset': [], 'size': []})
+				for block_start in range(0, prob_mat.shape[0], BLOCK_NUM_BINS):
+					block_data = zlib.compress(np.ascontiguousarray(prob_mat[block_start:(block_start + BLOCK_NUM_BINS)]).tobytes())
+					outF.write(block_data)
+					chrom_block_dict['start_bin'].append(window_start_bin + block_start)
+					chrom_block_dict['num_bins'].append(min(BLOCK_NUM_BINS, prob_mat.shape[0] - block_start))
+					chrom_block_dict['offset'].append(offset)
+					chrom_block_dict['size'].append(len(block_data))
+					offset += len(block_data)
+	with manifest.atomic_output(meta_fn) as temp_fn:
+		with open(temp_fn, 'w') as outF:
+			json.dump(region_index, outF)
+	manifest.record_output(meta_fn, get_region_index_params_fingerprint(num_chromHMM_state), window_fn_list + [data_fn])
+	print('Done building the region index of {} windows in {}'.format(len(window_list), folder), file = sys.stderr) # the standard output may be the results of queries (see query_region.py)
+	return
+
+def read_region_index(index_folder):
+	with open(os.path.join(index_folder, REGION_INDEX_META_FN), 'r') as inF:
+		region_index = json.load(inF)
+	region_index['data_fn'] = os.path.join(index_folder, REGION_INDEX_DATA_FN)
+	for chrom_block_dict in region_index['chrom'].values():
+		for key in chrom_block_dict:
+			chrom_block_dict[key] = np.array(chrom_block_dict[key], dtype = np.int64)
+	return region_index
+
+def get_region_index(folder, num_chromHMM_state, file_suffix = AVG_FILE_SUFFIX):
+	# the index is up to date if it was built from the same window files as those that are in folder now (see manifest.py)
+	index_folder = get_index_folder(folder)
+	try:
+		os.makedirs(index_folder, exist_ok = True)
+		with open(os.path.join(index_folder, REGION_INDEX_LOCK_FN), 'w') as lockF:
+			fcntl.flock(lockF, fcntl.LOCK_EX) # released when the file is closed. Other processes wait here while the index is built
+			window_fn_list = list(map(lambda x: os.path.join(folder, x + file_suffix), get_window_list(folder, file_suffix)))
+			job_list = [(folder, os.path.join(index_folder, REGION_INDEX_META_FN), window_fn_list + [os.path.join(index_folder, REGION_INDEX_DATA_FN)])]
+			if len(manifest.find_jobs_to_compute(job_list, get_region_index_params_fingerprint(num_chromHMM_state), 0)) > 0:
+				build_region_index(folder, num_chromHMM_state, file_suffix, index_folder)
+			return read_region_index(index_folder)
+	except OSError as e:
+		print('Cannot write the region index of {} into {} ({}). The windows will be read directly'.format(folder, index_folder, e), file = sys.stderr)
+		return {'num_chromHMM_state': num_chromHMM_state, 'dtype': INDEX_DTYPE, 'data_fn': None, 'folder': folder, 'file_suffix': file_suffix}
+
+def parse_region(region):
+	# chr1:1000-51000 (commas are allowed in the numbers) --> chr1, 1000, 51000
+	try:
+		chrom, interval = region.split(':')
+		start_bp, end_bp = map(lambda x: int(x.replace(',', '')), interval.split('-'))
+	except ValueError:
+		raise ValueError('Region {} should be of the form chrom:start-end, ex: chr1:1000-51000'.format(region))
+	assert start_bp < end_bp, 'Region {}: start should be smaller than end'.format(region)
+	return chrom, start_bp, end_bp
+
+def query_region(region_index, chrom, start_bp, end_bp):
+	'''
+	region_index: from get_region_index
+	chrom, start_bp, end_bp: the interval, 0-based and end-exclusive as in bed files
+	--> bin_start_bp, bin_end_bp: coordinates of the bins that overlap the interval and that are in the index, prob_mat: rows: these bins, columns: state_1 --> state_<num_chromHMM_state>
+	Only the blocks that overlap the interval are read and decompressed. If the index could not be written (data_fn is None, see get_region_index), the windows that overlap the interval are read instead
+	'''
+	if region_index['data_fn'] is None:
+		return query_region_from_windows(region_index, chrom, start_bp, end_bp)
+	num_chromHMM_state = region_index['num_chromHMM_state']
+	empty_result = (np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64), np.zeros((0, num_chromHMM_state), dtype = region_index['dtype']))
+	if chrom not in region_index['chrom']:
+		return empty_result
+	chrom_block_dict = region_index['chrom'][chrom]
+	first_bin = start_bp // helper.NUM_BP_PER_BIN
+	last_bin = (end_bp - 1) // helper.NUM_BP_PER_BIN # inclusive
+	block_end_bin = chrom_block_dict['start_bin'] + chrom_block_dict['num_bins']
+	block_index_list = np.flatnonzero((chrom_block_dict['start_bin'] <= last_bin) & (block_end_bin > first_bin)) # blocks are sorted by start_bin
+	if len(block_index_list) == 0:
+		return empty_result
+	bin_index_list = []
+	prob_mat_list = []
+	with open(region_index['data_fn'], 'rb') as inF:
+		for block_index in block_index_list:
+			inF.seek(chrom_block_dict['offset'][block_index])
+			block_mat = np.frombuffer(zlib.decompress(inF.read(chrom_block_dict['size'][block_index])), dtype = region_index['dtype']).reshape(-1, num_chromHMM_state)
+			block_bin_index = chrom_block_dict['start_bin'][block_index] + np.arange(block_mat.shape[0])
+			is_in_region = (block_bin_index >= first_bin) & (block_bin_index <= last_bin)
+			bin_index_list.append(block_bin_index[is_in_region])
+			prob_mat_list.append(block_mat[is_in_region])
+	bin_index = np.concatenate(bin_index_list)
+	return bin_index * helper.NUM_BP_PER_BIN, (bin_index + 1) * helper.NUM_BP_PER_BIN, np.concatenate(prob_mat_list)
+
+def query_region_from_windows(region_index, chrom, start_bp, end_bp):
+	# same results as query_region, reading the files of the windows that overlap the interval (see prob_matrix.read_rle_prob_mat)
+	first_bin = start_bp // helper.NUM_BP_PER_BIN
+	last_bin = (end_bp - 1) // helper.NUM_BP_PER_BIN # inclusive
+	bin_index_list = [np.zeros(0, dtype = np.int64)]
+	prob_mat_list = [np.zeros((0, region_index['num_chromHMM_state']), dtype = region_index['dtype'])]
+	for window_index in range(first_bin // helper.NUM_BIN_PER_WINDOW, last_bin // helper.NUM_BIN_PER_WINDOW + 1):
+		window_fn = os.path.join(region_index['folder'], '{}_{}{}'.format(chrom, window_index, region_index['file_suffix']))
+		if not os.path.isfile(window_fn):
+			continue
+		run_end_bins, run_prob_mat = prob_matrix.read_rle_prob_mat(window_fn, region_index['num_chromHMM_state'])
+		window_start_bin = window_index * helper.NUM_BIN_PER_WINDOW
+		num_window_bins = run_end_bins[-1] if len(run_end_bins) > 0 else 0
+		window_bin_index = np.arange(max(first_bin - window_start_bin, 0), min(last_bin + 1 - window_start_bin, num_window_bins))
+		bin_index_list.append(window_start_bin + window_bin_index)
+		prob_mat_list.append(prob_matrix.gather_rle_rows(run_end_bins, run_prob_mat, window_bin_index).astype(region_index['dtype']))
+	bin_index = np.concatenate(bin_index_list)
+	return bin_index * helper.NUM_BP_PER_BIN, (bin_index + 1) * helper.NUM_BP_PER_BIN, np.concatenate(prob_mat_list)
@@ -0,0 +1,209 @@
+#!/usr/bin/env python
+
+'''
+This script runs a small server on the local machine that answers queries about the chromatin state assignment probabilities of CSREP output folders (average_predictions of groups, or the differential folders), so that notebooks and scripts that query the same folders over and over do not reread and decompress the 10Mb windows each time.
+The server keeps the windows it has read in memory (WindowCache), as runs of consecutive bins with identical probabilities (see prob_matrix.read_rle_prob_mat), in float32. When the windows in memory take more than the memory budget, the least recently used windows are dropped. A window is read again if its file has changed since it was cached (ex: the folder was recalculated).
+Protocol: the client connects to HOST:port (only local connections), and sends one request per line, as json. The server answers each request with one line of json, in the same order. A connection can send any number of requests.
+Request: {"query": <query>, "region": "chr22:20000000-20050000", "folder": <output folder>} or, if the server was started with --all_cg_out_dir, {"query": <query>, "region": ..., "group": "ESC", "mode": "CSREP"} (groups such as ESC_minus_Brain give the differential folders, see query_region.get_group_folder). Coordinates are 0-based, end-exclusive as in bed files. <query> is one of:
+- 'interval': the probabilities of each 200bp bin that overlaps the region --> {"chrom", "start": [...], "end": [...], "prob": [[...], ...] (rows: bins, columns: state_1 --> state_<num_chromHMM_state>)}
+- 'summary': the summary chromatin state map in the region, as in get_summary_map_from_avg_matrix.py --> {"chrom", "start": [...], "end": [...], "state": ["E1", ...]} (one entry per segment of consecutive bins with the same max-probability state)
+- 'state_max': the maximum probability of each state in the region --> {"chrom", "max": [...], "max_start": [...]} (max_start: the start of the first bin where each state reaches its maximum)
+Batch request: {"batch": [<request>, <request>, ...]} --> {"results": [<answer>, <answer>, ...]}. Requests that fail are answered with {"error": <message>}, and the server keeps running.
+From python: import region_server; region_server.send_request({"query": "summary", "region": "chr22:20000000-20050000", "group": "ESC"}, port = 8765)
+Ex: python region_server.py --all_cg_out_dir <all_cg_out_dir> --num_chromHMM_state 18 --memory_budget_mb 2000 --port 8765
+'''
+import os
+import sys
+import json
+import socket
+import argparse
+import threading
+import socketserver
+import collections
+import numpy as np
+import helper
+import manifest
+import prob_matrix
+import region_index
+import query_region
+
+HOST = '127.0.0.1' # the server only accepts connections from the local machine
+DEFAULT_PORT = 8765
+QUERY_LIST = ['interval', 'summary', 'state_max']
+CACHE_DTYPE = 'float32' # same as region_index.INDEX_DTYPE: the average probabilities are calculated in float32
+
+class WindowCache(object):
+	'''
+	LRU cache of the windows that were read, keys: window files, values: (file fingerprint, run_end_bins, run_prob_mat)
+	Windows are dropped, least recently used first, when the windows in memory take more than memory_budget_bytes. The window that was just read is always kept, even if it alone is bigger than the budget.
+	'''
+	def __init__(self, num_chromHMM_state, memory_budget_bytes):
+		self.num_chromHMM_state = num_chromHMM_state
+		self.memory_budget_bytes = memory_budget_bytes
+		self.window_dict = collections.OrderedDict() # from the least recently used to the most recently used
+		self.num_bytes = 0
+		self.lock = threading.Lock() # the server answers each connection in its own thread
+		return
+
+	def get_window(self, window_fn):
+		# window_fn --> run_end_bins, run_prob_mat (see prob_matrix.read_rle_prob_mat). The file is read and decompressed outside of the lock, so that the threads of the server only wait for each other to look up and update the cache
+		file_fingerprint = manifest.get_file_fingerprint(window_fn)
+		with self.lock:
+			cached_window = self.get_cached_window(window_fn, file_fingerprint)
+		if cached_window is not None:
+			return cached_window
+		run_end_bins, run_prob_mat = prob_matrix.read_rle_prob_mat(window_fn, self.num_chromHMM_state)
+		run_prob_mat = run_prob_mat.astype(CACHE_DTYPE)
+		with self.lock:
+			cached_window = self.get_cached_window(window_fn, file_fingerprint) # another thread may have read the same window in the meantime
+			if cached_window is not None:
+				return cached_window
+			self.window_dict[window_fn] = (file_fingerprint, run_end_bins, run_prob_mat)
+			self.num_bytes += run_end_bins.nbytes + run_prob_mat.nbytes
+			while self.num_bytes > self.memory_budget_bytes and len(self.window_dict) > 1:
+				self.remove_window(next(iter(self.window_dict)))
+		return run_end_bins, run_prob_mat
+
+	def get_cached_window(self, window_fn, file_fingerprint):
+		# called with the lock held --> run_end_bins, run_prob_mat if window_fn is cached with the same file fingerprint, None otherwise
+		if window_fn not in self.window_dict:
+			return None
+		cached_fingerprint, run_end_bins, run_prob_mat = self.window_dict[window_fn]
+		if cached_fingerprint != file_fingerprint:
+			self.remove_window(window_fn) # the file was rewritten since it was cached
+			return None
+		self.window_dict.move_to_end(window_fn)
+		return run_end_bins, run_prob_mat
+
+	def remove_window(self, window_fn):
+		_, run_end_bins, run_prob_mat = self.window_dict.pop(window_fn)
+		self.num_bytes -= run_end_bins.nbytes + run_prob_mat.nbytes
+		return
+
+def get_region_runs(window_cache, folder, file_suffix, chrom, start_bp, end_bp):
+	'''
+	--> run_start_bins, run_end_bins (bin indices from the start of the chromosome, end exclusive), run_prob_mat: the runs of the windows of folder, cut to the bins that overlap the region. Windows that are not in folder are skipped, so consecutive runs are not always contiguous
+	'''
+	first_bin = start_bp // helper.NUM_BP_PER_BIN
+	last_bin = (end_bp - 1) // helper.NUM_BP_PER_BIN # inclusive
+	run_start_list, run_end_list, run_prob_mat_list = [], [], []
+	for window_index in range(first_bin // helper.NUM_BIN_PER_WINDOW, last_bin // helper.NUM_BIN_PER_WINDOW + 1):
+		window_fn = os.path.join(folder, '{}_{}{}'.format(chrom, window_index, file_suffix))
+		if not os.path.isfile(window_fn):
+			continue
+		window_run_end_bins, window_run_prob_mat = window_cache.get_window(window_fn)
+		if len(window_run_end_bins) == 0:
+			continue
+		window_start_bin = window_index * helper.NUM_BIN_PER_WINDOW
+		lo = max(first_bin - window_start_bin, 0) # bins of the region inside the window: lo --> hi (exclusive)
+		hi = min(last_bin + 1 - window_start_bin, window_run_end_bins[-1])
+		if lo >= hi:
+			continue
+		first_run = np.searchsorted(window_run_end_bins, lo, side = 'right')
+		last_run = np.searchsorted(window_run_end_bins, hi - 1, side = 'right')
+		cut_run_end_bins = np.minimum(window_run_end_bins[first_run:(last_run + 1)], hi)
+		run_start_list.append(window_start_bin + np.concatenate([[lo], cut_run_end_bins[:-1]]))
+		run_end_list.append(window_start_bin + cut_run_end_bins)
+		run_prob_mat_list.append(window_run_prob_mat[first_run:(last_run + 1)])
+	if len(run_start_list) == 0:
+		return np.zeros(0, dtype = np.int64), np.zeros(0, dtype = np.int64), np.zeros((0, window_cache.num_chromHMM_state), dtype = CACHE_DTYPE)
+	return np.concatenate(run_start_list).astype(np.int64), np.concatenate(run_end_list).astype(np.int64), np.concatenate(run_prob_mat_list)
+
+def answer_interval_query(chrom, run_start_bins, run_end_bins, run_prob_mat):
+	run_length = run_end_bins - run_start_bins
+	run_offset = run_length.cumsum() - run_length # the row of the first bin of each run in the result
+	bin_index = np.repeat(run_start_bins - run_offset, run_length) + np.arange(run_length.sum()) # runs are not always contiguous (missing windows)
+	return {'chrom': chrom, 'start': (bin_index * helper.NUM_BP_PER_BIN).tolist(), 'end': ((bin_index + 1) * helper.NUM_BP_PER_BIN).tolist(), 'prob': np.repeat(run_prob_mat, run_length, axis = 0).tolist()}
+
+def answer_summary_query(chrom, run_start_bins, run_end_bins, run_prob_mat):
+	# same as get_summary_map_from_avg_matrix.get_max_prob_state_runs_from_rle, except that runs on both sides of a missing window are not merged
+	if len(run_start_bins) == 0:
+		return {'chrom': chrom, 'start': [], 'end': [], 'state': []}
+	max_state = np.argmax(run_prob_mat, axis = 1) + 1 # if there are ties, the first state is picked, same as pandas idxmax
+	change_index = np.flatnonzero((max_state[1:] != max_state[:-1]) | (run_start_bins[1:] != run_end_bins[:-1])) + 1
+	start_run_index = np.concatenate([[0], change_index])
+	end_run_index = np.concatenate([change_index, [len(max_state)]])
+	return {'chrom': chrom, 'start': (run_start_bins[start_run_index] * helper.NUM_BP_PER_BIN).tolist(), 'end': (run_end_bins[end_run_index - 1] * helper.NUM_BP_PER_BIN).tolist(), 'state': list(map(lambda x: 'E' + str(x), max_state[start_run_index]))}
+
+def answer_state_max_query(chrom, run_start_bins, run_end_bins, run_prob_mat):
+	if len(run_start_bins) == 0:
+		return {'chrom': chrom, 'max': [], 'max_start': []}
+	max_run_index = np.argmax(run_prob_mat, axis = 0) # for each state, the first run where it reaches its max
+	return {'chrom': chrom, 'max': run_prob_mat.max(axis = 0).tolist(), 'max_start': (run_start_bins[max_run_index] * helper.NUM_BP_PER_BIN).tolist()}
+
+ANSWER_FUNCTION_DICT = {'interval': answer_interval_query, 'summary': answer_summary_query, 'state_max': answer_state_max_query}
+
+def answer_request(request, window_cache, all_cg_out_dir, file_suffix):
+	# request: dictionary (see the top of this file) --> dictionary
+	if 'batch' in request:
+		return {'results': list(map(lambda x: answer_request(x, window_cache, all_cg_out_dir, file_suffix), request['batch']))}
+	try:
+		assert request.get('query') in QUERY_LIST, 'query should be one of {}'.format(QUERY_LIST)
+		if 'folder' in request:
+			folder = request['folder']
+		else:
+			assert all_cg_out_dir is not None and 'group' in request, 'Give the folder, or start the server with --all_cg_out_dir and give the group'
+			folder = query_region.get_group_folder(all_cg_out_dir, request['group'], request.get('mode', 'CSREP'))
+		assert os.path.isdir(folder), 'Folder {} does not exist'.format(folder)
+		chrom, start_bp, end_bp = region_index.parse_region(request['region'])
+		run_start_bins, run_end_bins, run_prob_mat = get_region_runs(window_cache, folder, file_suffix, chrom, start_bp, end_bp)
+		return ANSWER_FUNCTION_DICT[request['query']](chrom, run_start_bins, run_end_bins, run_prob_mat)
+	except (AssertionError, ValueError, KeyError, OSError) as e: # OSError: a window file was deleted or is being rewritten
+		return {'error': '{}: {}'.format(type(e).__name__, e)}
+
+class RegionRequestHandler(socketserver.StreamRequestHandler):
+	def handle(self):
+		for line in self.rfile:
+			if line.strip() == b'':
+				continue
+			try:
+				request = json.loads(line)
+			except ValueError:
+				answer = {'error': 'The request is not valid json'}
+			else:
+				answer = answer_request(request, self.server.window_cache, self.server.all_cg_out_dir, self.server.file_suffix)
+			self.wfile.write((json.dumps(answer) + '\n').encode())
+		return
+
+class RegionServer(socketserver.ThreadingMixIn, socketserver.TCPServer):
+	daemon_threads = True
+	allow_reuse_address = True
+	def __init__(self, port, window_cache, all_cg_out_dir, file_suffix):
+		self.window_cache = window_cache
+		self.all_cg_out_dir = all_cg_out_dir
+		self.file_suffix = file_suffix
+		socketserver.TCPServer.__init__(self, (HOST, port), RegionRequestHandler)
+
+def send_request(request, port = DEFAULT_PORT):
+	# client side: send one request (or a batch request) to the server running on this machine --> the answer, as a dictionary
+	with socket.create_connection((HOST, port)) as sock:
+		sock.sendall((json.dumps(request) + '\n').encode())
+		sock.shutdown(socket.SHUT_WR)
+		with sock.makefile('rb') as inF:
+			return json.loads(inF.readline())
+
+if __name__ == '__main__':
+	parser = argparse.ArgumentParser(description = 'Run a server on this machine that answers queries about the chromatin state assignment probabilities of CSREP output folders (interval, summary and state_max queries, see the top of this file), keeping the windows that were read in memory.')
+	parser.add_argument('--all_cg_out_dir', type = str, required = False, default = None,
+		help = 'all_cg_out_dir in config/config.yaml, so that requests can name a group (and a mode) instead of a folder')
+	parser.add_argument('--num_chromHMM_state', type = int, required = True,
+		help = 'number of chromatin states')
+	parser.add_argument('--memory_budget_mb', type = float, required = False, default = 1000,
+		help = 'the windows in memory take at most this much memory (MB). Each window takes at most 50,000 bins x num_chromHMM_state x 4 bytes (3.6MB for 18 states), and often much less')
+	parser.add_argument('--port', type = int, required = False, default = DEFAULT_PORT,
+		help = 'port on 127.0.0.1 that the server listens to')
+	parser.add_argument('--file_suffix', type = str, required = False, default = region_index.AVG_FILE_SUFFIX,
+		help = 'suffix of the files of the windows in the folders. Ex: _pred_out.txt.gz to query the predictions of samples')
+	args = parser.parse_args()
+	print(args)
+	if args.all_cg_out_dir is not None:
+		helper.check_dir_exist(args.all_cg_out_dir)
+	window_cache = WindowCache(args.num_chromHMM_state, int(args.memory_budget_mb * 1e6))
+	server = RegionServer(args.port, window_cache, args.all_cg_out_dir, args.file_suffix)
+	print('Listening on {}:{}'.format(HOST, server.server_address[1]))
+	sys.stdout.flush()
+	try:
+		server.serve_forever()
+	except KeyboardInterrupt:
+		pass
+	server.server_close()
@@ -0,0 +1,82 @@
+#!/usr/bin/env python
+
+'''
+This file contains functions to write and read the binary window store of chromatin state maps for all input samples. The store is produced by get_all_ct_segment_folder.py and read by the training, prediction and averaging scripts, so that they do not have to re-parse gzip text files of state names.
+Structure of the store (all_ct_segment_folder):
+|__ <chrom>_<region_index>_combined_segment.npy: a uint8 matrix of shape (num_samples, num_bins), num_bins <= NUM_BIN_PER_WINDOW. Entry [i, j] is the one-based state index of sample i at the j-th bin of this window. 0 (NO_STATE_CODE) means no state is assigned to the bin. Example: chr1_0 corresponds to the first 50,000 genomic bins in chromosome 1.
+|__ store_meta.json: the sidecar file. It lists the sample names in the row order of all the window matrices, and the coordinates (chrom, start_bp, end_bp, num_bins) of each window.
+
+List of functions:
+- get_window_fn(segment_folder, window) --> path to the .npy file of a window (ex: chr1_0)
+- save_window(segment_folder, window, code_mat) --> write a samples-by-bins matrix of state codes for one window
+- load_window(segment_folder, window, row_indices) --> read a window matrix, optionally only some of the samples (rows)
+- list_windows(segment_folder) --> list of windows (ex: [chr1_0, chr1_1, ...]) available in the store
+- get_window_coordinates(window, num_bins) --> chrom, start_bp, end_bp of a window
+- write_store_meta(segment_folder, sample_list) --> write the sidecar file, given the windows that are currently in the store
+- read_store_meta(segment_folder) --> read the sidecar file into a dictionary
+- get_sample_row_indices(segment_folder, sample_list) --> the rows in the window matrices that correspond to sample_list
+'''
+import os
+import glob
+import json
+import numpy as np
+import helper
+
+WINDOW_SUFFIX = '_combined_segment.npy'
+STORE_META_FN = 'store_meta.json'
+STATE_CODE_DTYPE = np.uint8 # we support models with up to 255 states
+NO_STATE_CODE = 0 # states are one-based, so 0 is free to mark bins where a sample has no state assigned
+
+def get_window_fn(segment_folder, window):
+	return os.path.join(segment_folder, window + WINDOW_SUFFIX)
+
+def save_window(segment_folder, window, code_mat):
+	# code_mat: rows: samples (ordered as in the store's sample list), columns: genomic bins in the window
+	code_mat = np.ascontiguousarray(code_mat, dtype = STATE_CODE_DTYPE)
+	np.save(get_window_fn(segment_folder, window), code_mat)
+	return
+
+def load_window(segment_folder, window, row_indices = None):
+	# return a uint8 matrix of shape (num_samples, num_bins). If row_indices is given (see get_sample_row_indices), only rows of those samples are returned, in the order of row_indices
+	code_mat = np.load(get_window_fn(segment_folder, window), mmap_mode = 'r')
+	if row_indices is None:
+		return np.asarray(code_mat)
+	return code_mat[row_indices, :]
+
+def list_windows(segment_folder):
+	window_fn_list = glob.glob(os.path.join(segment_folder, 'chr*' + WINDOW_SUFFIX))
+	return list(map(lambda x: os.path.basename(x).split(WINDOW_SUFFIX)[0], window_fn_list)) # from /path/to/chr9_14_combined_segment.npy --> chr9_14
+
+def get_window_coordinates(window, num_bins):
+	# chr9_14 --> chr9, 140,000,000, 140,000,000 + num_bins * NUM_BP_PER_BIN
+	chrom = window.split('_')[0]
+	window_index = int(window.split('_')[1])
+	start_bp = window_index * helper.NUM_BP_PER_WINDOW
+	end_bp = start_bp + num_bins * helper.NUM_BP_PER_BIN
+	return chrom, start_bp, end_bp
+
+def write_store_meta(segment_folder, sample_list):
+	# the number of bins in each window is read from the header of the .npy file, so this function does not load the matrices into memory
+	windows = {}
+	for window in sorted(list_windows(segment_folder)):
+		num_bins = np.load(get_window_fn(segment_folder, window), mmap_mode = 'r').shape[1]
+		chrom, start_bp, end_bp = get_window_coordinates(window, num_bins)
+		windows[window] = {'chrom': chrom, 'start_bp': start_bp, 'end_bp': end_bp, 'num_bins': num_bins}
+	meta = {'samples': list(sample_list), 'num_bp_per_bin': helper.NUM_BP_PER_BIN, 'windows': windows}
+	with open(os.path.join(segment_folder, STORE_META_FN), 'w') as outF:
+		json.dump(meta, outF, indent = 1)
+	return meta
+
+def read_store_meta(segment_folder):
+	meta_fn = os.path.join(segment_folder, STORE_META_FN)
+	helper.check_file_exist(meta_fn)
+	with open(meta_fn, 'r') as inF:
+		meta = json.load(inF)
+	return meta
+
+def get_sample_row_indices(segment_folder, sample_list):
+	# given a list of samples, return the indices of rows in the window matrices that correspond to these samples, in the order of sample_list
+	store_sample_list = read_store_meta(segment_folder)['samples']
+	missing_samples = np.setdiff1d(sample_list, store_sample_list)
+	assert len(missing_samples) == 0, 'Samples {} are not present in the segmentation store {}. Please rerun get_all_ct_segment_folder.py with these samples included.'.format(missing_samples, segment_folder)
+	return np.array(list(map(lambda x: store_sample_list.index(x), sample_list)))
@@ -9,6 +9,7 @@ all_ct_segment_folder: where segmentation data of all cell types are stored, for
 predict_outDir: where the beta values obtained from training the data will be stored (e.g. pred_E###)
 num_chromHMM_state: Number of chromHMM states that are shared across different cell types
 all_ct_fn: filename of all ct being used in the model to get the baseline representative cell types
+num_cores: (optional, default 4) number of processes that predict different windows of the genome at the same time
 '''
 import pandas as pd
 import numpy as np
@@ -17,112 +18,53 @@ import sys
 import time
 import glob
 import helper
-import multiprocessing as mp
+import segment_store
+import compressed_io
 
-def get_X_colnames (train_cell_types, num_chromHMM_state):
+def get_state_count_matrix(code_mat, num_chromHMM_state):
     '''
-    train_cell_types = ['E034', 'E037']
-    num_chromHMM_state = 2
-    --> ['E034_1', 'E034_2', 'E037_1', 'E037_2']
+    code_mat: rows: train_cell_types, columns: genomic bins, values: one-based state codes from the segmentation store (0 if no state is assigned)
+    --> a numpy array, rows: genomic bins, columns: states 1 --> num_chromHMM_state, values: number of cell types that are in each state at each bin
+    ex: code_mat = [[1, 2], [1, 0]], num_chromHMM_state = 2 --> [[2, 0], [0, 1]]
     '''
-    results = []
-    for ct in train_cell_types:
-            results += [ct + "_" + str(x + 1) for x in range(num_chromHMM_state)]
-    return results
+    num_bins = code_mat.shape[1]
+    # each (bin, state code) pair gets its own slot, so that one bincount call counts all the cell types at all the bins. Code 0 (no state assigned) gets its own column, which we drop
+    slot_mat = np.arange(num_bins)[np.newaxis, :] * (num_chromHMM_state + 1) + code_mat
+    count_mat = np.bincount(slot_mat.ravel(), minlength = num_bins * (num_chromHMM_state + 1)).reshape(num_bins, num_chromHMM_state + 1)
+    return count_mat[:, 1:]
 
-def get_state_number(state_annot):
-    # 'E18' --> 18 (integers)
-    return int(state_annot[1:])
-
-def get_binary_state_assignment(state_train_segment, num_chromHMM_state):
-    '''
-    a series of state assignment with indices ['E034', 'E037'] --> [E1, E2]
-    num_chromHMM_state = 2
-    --> a series of 0/1 with indices ['E034_1', 'E034_2', 'E037_1', 'E037_2'] --> [1,0,0,1]
-    '''
-    results = [0] * (len(state_train_segment) * num_chromHMM_state)
-    for ct_index, train_segment in enumerate(state_train_segment):
-            train_segment = train_segment[1:] # get rid of the E as a prefix
-            index_to_put_one = (int(train_segment) - 1) + ct_index * num_chromHMM_state
-            results[index_to_put_one] = 1
-    return pd.Series(results)
-
-
-def get_predictorX_segmentation_data(train_cell_types, num_chromHMM_state, segment_fn):
-    # given the segmentation data of multiple cell types, we want to extract information from the cell types that we will use as predictor (X). Predictor will be binarized with ct_state combinations as columns. Rows of this data frame correspond to different positions on the genome.
-    segment_df = pd.read_csv(segment_fn, sep = '\t', header = 0)
-    segment_df = segment_df[train_cell_types] # only get the data of the cell types that we need as predictors
-    #segment_df = segment_df.applymap(get_state_number)# get the state train_segmentation from 'E18' --> 18 (integers)
-    segment_df = segment_df.apply(lambda x: get_binary_state_assignment(x, num_chromHMM_state), axis = 1) # apply function row-wise, change from the state train_segmentation to binarized of state
-    segment_df.columns = get_X_colnames(train_cell_types, num_chromHMM_state)
-    return segment_df
-
-def predict_baseline_segmentation(predictor_df, num_chromHMM_state):
-    # predictor_df : <ct>_state<state_index> --> each columns corresponds to 0/1 based on segmentation of that specific cell type
-    # rows: genomic positions
+def predict_baseline_segmentation(code_mat, num_chromHMM_state):
+    # code_mat: rows: train_cell_types, columns: genomic bins
     # return response_df: rows: genomic pos, columns: state<state_index> --> probability that each pos is in each state
-    num_train_ct = int(len(predictor_df.columns) / num_chromHMM_state)
-    train_df_list = []
+    # The baseline estimate of the probability that a position is in a state is the fraction of cell types where this position is assigned to the state, i.e. the average of the one-hot encoding of the state assignment across cell types.
     state_colnames = ["state_" + str(x+1) for x in range(num_chromHMM_state)] # ex: [state_1, state_2, ..., state_18]
-    for ct_index in range(num_train_ct): # get data for each ct that we use to train the model
-        start_colname_index = ct_index * num_chromHMM_state # starting from <ct>_state1
-        end_colname_index = (ct_index + 1) * num_chromHMM_state # till <ct>_state<num_chromHMM_state>
-        this_ct_train_df = predictor_df[predictor_df.columns[start_colname_index:end_colname_index]] # get the data corresponding to states in this particular cell type
-        this_ct_train_df.columns = state_colnames
-        train_df_list.append(this_ct_train_df)
-    # Now we have obtained the training data for each of the cell types, we will average out the one-hot encoding of the state assignment across cell types. That's the basis of the baseline training where basically the state assigned to each position is the state that have the highest count of cell types where this position is assigned to.
-    response_df = pd.concat(train_df_list).groupby(level = 0).mean() # get the average across all the df. So what we get is a df : rows: genomic positions, columns: states, each entry is the average of the respective cells in all the input dfa
+    count_mat = get_state_count_matrix(code_mat, num_chromHMM_state)
+    response_df = pd.DataFrame(count_mat / code_mat.shape[0], columns = state_colnames)
     return response_df
 
-def predict_segmentation_one_genomic_window(segment_fn, output_fn, train_cell_types, num_chromHMM_state, train_mode):
-    # based on the machine created through training, predict the segmentation corresponding to one specific window on the genome, specified in segment_fn. And print out, for each position, and for each chromHMM state, the probability that the region fall in to the state.
-    # 1. Get the data of predictor cell types into the right format
-    predictor_df = get_predictorX_segmentation_data(train_cell_types, num_chromHMM_state, segment_fn) # rows: predictor cell type - state combinations, columns: positions inside a  window on the genome
+def predict_segmentation_one_genomic_window(all_ct_segment_folder, window, output_fn, train_cell_types, train_ct_row_indices, num_chromHMM_state, train_mode):
+    # based on the machine created through training, predict the segmentation corresponding to one specific window on the genome (ex: chr1_0). And print out, for each position, and for each chromHMM state, the probability that the region fall in to the state.
+    # 1. Get the data of predictor cell types
+    code_mat = segment_store.load_window(all_ct_segment_folder, window, train_ct_row_indices) # rows: train_cell_types, columns: positions inside a window on the genome
     # 2. Do the prediction job. Different model has different prediction functions
-    response_df = predict_baseline_segmentation(predictor_df, num_chromHMM_state)
-    response_df.to_csv(output_fn, header = True, index = False, compression = 'gzip', sep = '\t')
+    response_df = predict_baseline_segmentation(code_mat, num_chromHMM_state)
+    with compressed_io.open_output(output_fn, 'wt') as outF: # with the codec of compressed_io.py (gzip by default)
+        response_df.to_csv(outF, header = True, index = False, sep = '\t')
     print("Done producing file: " + output_fn)
 
-def one_job_run_predict_segmentation(segment_fn_list, output_fn_list, train_cell_types, num_chromHMM_state, train_mode):
-    '''
-    segment_fn_list and output_fn_list: the orders of regions in these two lists are similar (look at function predict_segmentation).
-    Each element corresponds to a region on the genome
-    '''
-    for (window_index, segment_fn) in enumerate(segment_fn_list):
-            output_fn = output_fn_list[window_index]
-            predict_segmentation_one_genomic_window(segment_fn, output_fn, train_cell_types, num_chromHMM_state, train_mode)
-    return
-
-def partition_file_list(file_list, num_cores):
-    results = [] # list of lists of file names
-    num_files_per_core = int(len(file_list) / num_cores)
-    for core_i in range(num_cores):
-        if core_i < (num_cores - 1):
-            this_core_files = file_list[core_i * num_files_per_core : (core_i + 1) * num_files_per_core]
-        elif core_i == (num_cores - 1):
-            this_core_files = file_list[core_i * num_files_per_core :]
-        results.append(this_core_files)
-    return results
-
-def predict_segmentation (all_ct_segment_folder, predict_outDir, train_cell_types, num_chromHMM_state, train_mode):
+def predict_segmentation (all_ct_segment_folder, predict_outDir, train_cell_types, num_chromHMM_state, train_mode, num_cores):
     # 1. Get list of segmentation files corresponding to different windows on the genome.
-    segment_fn_list = glob.glob(all_ct_segment_folder + "/*.bed.gz")
-    genome_pos_list = [(x.split('/')[-1]).split('_combined_segment.bed.gz')[0] for x in segment_fn_list] # from /path/to/chr9_14_combined_segment.bed.gz --> chr9_14
+    genome_pos_list = segment_store.list_windows(all_ct_segment_folder) # [chr9_14, chr9_15, etc.]
+    train_ct_row_indices = segment_store.get_sample_row_indices(all_ct_segment_folder, train_cell_types)
     output_fn_list = [os.path.join(predict_outDir, x + "_avg_pred.txt.gz") for x in genome_pos_list]# get the output file names corresponding to different regions on the genome
-    # 2. partition the list of file names into groups, for later putting into jobs for multiple processes
-    num_cores = 1
-    partition_segment_fn_list = partition_file_list(segment_fn_list, num_cores)
-    partition_output_fn_list = partition_file_list(output_fn_list, num_cores)
-    processes = [mp.Process(target = one_job_run_predict_segmentation, args = (partition_segment_fn_list[i], partition_output_fn_list[i], train_cell_types, num_chromHMM_state, train_mode)) for i in range(num_cores)]
-    for p in processes:
-        p.start()
-    for i, p in enumerate(processes):
-        p.join()
-        print("Process " + str(i) + " is finished!")
+    # 2. one job per window, handed out to a pool of num_cores processes from the largest window to the smallest
+    job_args_list = [(all_ct_segment_folder, window, output_fn_list[window_index], train_cell_types, train_ct_row_indices, num_chromHMM_state, train_mode) for (window_index, window) in enumerate(genome_pos_list)]
+    job_weight_list = helper.get_file_size_list([segment_store.get_window_fn(all_ct_segment_folder, x) for x in genome_pos_list])
+    helper.run_weighted_jobs(predict_segmentation_one_genomic_window, job_args_list, job_weight_list, num_cores)
 
 def main():
 	num_mandatory_args = 6
-	if len(sys.argv) != num_mandatory_args:
+	if len(sys.argv) not in [num_mandatory_args, num_mandatory_args + 1]:
 		usage()
 	print("training baseline model")
 	train_data_folder = sys.argv[1]
@@ -141,11 +83,14 @@ def main():
 	all_ct_fn = sys.argv[5]
 	print("Done getting command line arguments train_baseline_model.py")
 	all_ct = [line.strip() for line in open(all_ct_fn, "r").readlines()]
+	num_cores = 4
+	if len(sys.argv) == num_mandatory_args + 1:
+		num_cores = helper.get_command_line_integer(sys.argv[6])
 	# 1. Get the data of predictors and response for training
 	train_mode = 'baseline'
 	# 2. no need to train model
 	# 3. process training data and predict segmentation at each position
-	predict_segmentation (all_ct_segment_folder, predict_outDir, all_ct, num_chromHMM_state, train_mode)
+	predict_segmentation (all_ct_segment_folder, predict_outDir, all_ct, num_chromHMM_state, train_mode, num_cores)
 	print("Done predicting whole genome")
 
 def usage():
@@ -155,6 +100,7 @@ def usage():
 	print("predict_outDir: where the beta values obtained from training the data will be stored (e.g. pred_E###)")
 	print("num_chromHMM_state: Number of chromHMM states that are shared across different cell types")
 	print("all_ct_fn: filename of all ct being used in the model to get the baseline representative cell types")
+	print("num_cores: (optional, default 4) number of processes that predict different windows of the genome at the same time")
 	exit(1)
 
 if __name__ == '__main__':
@@ -1,29 +1,40 @@
 #!/usr/bin/env python
 '''
 This file will train a multi-variate logistic regression model to predict the chromatin state maps for a sample, based on the chromatin state maps in other samples. 
+The trained model is saved into predict_outDir/<response_ct>_model.npz (see model_store.py). If replace_existing_files is 0 and the model file already exists, the model is loaded instead of trained again. To only predict from saved models, use predict_multiLog.py
 
 command-line argument: 
 python train_multiLog_auto1Hot.py 
 train_data_folder: where the state assignment and of training data are stored for all cell types. Each cell type has its own file
-all_ct_segment_folder: where segmentation data of all cell types are stored, for the entire genome, so that we can get data for prediction out.
+all_ct_segment_folder: where segmentation data of all cell types are stored, for the entire genome, so that we can get data for prediction out. This is the binary window store produced by get_all_ct_segment_folder.py (see segment_store.py)
 predict_outDir: where output data of the predictions of cell types are stored
 response_ct: the cell type that we are trying to predict from the training dataset. This data is the Y value in our model training
 num_chromHMM_state: Number of chromHMM states that are shared across different cell types
 all_ct_fn: number of cell types that we will train
-replace_existing_files: whether or not we would want to replace_existing_ output files 0 (no, only create result files for those that have not been outputted) or 1 (yes, rewrite everything)
+replace_existing_files: whether or not we would want to replace_existing_ output files 0 (no, only create result files that are missing or out of date, see manifest.py) or 1 (yes, rewrite everything)
 seed: random seed for reproducibility
+train_from_pattern_counts: (optional, default 1) 1: compress the training data into a table of distinct (predictor states, response state) patterns and their counts, and fit the model on that table with the counts as sample weights. 0: fit the model on one row per training position, as in the original implementation
+num_cores: (optional, default 1) number of processes that predict the windows of the genome at the same time. The model is put into shared memory once and the processes take the windows one at a time from a shared counter, so they are kept busy until the last windows. Requires train_from_pattern_counts to be given
+prob_file_format: (optional, default txt) format of the output files: txt, float16, uint8 or rle (see prob_matrix.py for the error of the binary formats). Requires num_cores to be given
 '''
 import pandas as pd 
 import numpy as np 
 from sklearn.linear_model import LogisticRegression
-from sklearn.preprocessing import OneHotEncoder
-from sklearn.compose import make_column_transformer
-# import multiprocessing as mp
+from scipy import sparse
+import multiprocessing as mp
+from multiprocessing import shared_memory
 import os
 import sys
-import glob
 import helper
+import segment_store
+import model_store
+import manifest
+import prob_matrix
 import time
+
+PATTERN_COUNT_TOL = 1e-8 # stopping tolerance of lbfgs when training from pattern counts. Each iteration is cheap with a few thousand distinct patterns, so we can afford to converge much closer to the optimum than sklearn's default (1e-4). The coefficients then agree, within the default tolerance, with the coefficients fit on one row per position
+MAX_NUM_CACHED_PATTERNS = 2000000 # maximum number of distinct predictor-state patterns whose predicted probabilities we keep in memory across windows (each pattern takes about (num_train_ct + 8 * num_chromHMM_state) bytes)
+
 def get_X_colnames (train_cell_types, num_chromHMM_state):
 	'''
 	train_cell_types = ['E034', 'E037']
@@ -43,55 +54,162 @@ def get_state_number(state_annot):
 		print('State number format in Y_df is not correct. You should recheck your input data. After preprocessing of data, all states should be of the form \'E<state_index_one_based>\', except for the case in training data where it could be that multiple states get mapped to the same training location. If the multi-state map problem occurs, it may be that your input data is not valid, because our assumption is that each position on the genome should be assigned to one single state. You can check this by looking at the bed file showing the regions  selected for training data, and bedtools intersect between the sampled regions and the input chromatin state map for the response_ct. If there are positins being mapped to multiple states, your data is invalid. If you cannot figure out, you may contact the authors: Ha Vu and Jason Ernst. Exitting ...')
 		exit(1)
 
-def transform_oneHot_trainCt_df(X_segment_df, train_cell_types, num_chromHMM_state, n_jobs):
-	if not (X_segment_df.columns == train_cell_types).all():
-		X_segment_df = X_segment_df[train_cell_types] # to make sure that we order the ct correctly, so that there will be matching columns as input features into the model for both training and for prediction
-	all_states = np.array(list(map(lambda x: 'E{}'.format(x+1), range(num_chromHMM_state))))
-	transformer = make_column_transformer((OneHotEncoder(categories = [all_states]*len(train_cell_types), handle_unknown = 'ignore'), train_cell_types), n_jobs = n_jobs, remainder='drop')
-	X_data = transformer.fit_transform(X_segment_df)
-	return X_data.toarray() # do not forget the .toarray function because I found out that the weights change slightly with and without the .toarray() function
+def get_oneHot_column_indices(pattern_mat, num_chromHMM_state):
+	'''
+	pattern_mat: rows: positions (or distinct patterns), columns: train_cell_types, values: one-based state indices (0: no state assigned)
+	--> column index of each entry in the one-hot matrix, whose columns are ordered as in get_X_colnames: <ct1>_1 ... <ct1>_<num_chromHMM_state>, <ct2>_1, ...
+	Entries with no state assigned get index -1, they are all zeros in the one-hot matrix.
+	ex: pattern_mat = [[1, 2], [0, 1]], num_chromHMM_state = 2 --> [[0, 3], [-1, 2]]
+	'''
+	pattern_mat = np.asarray(pattern_mat).astype(int)
+	ct_offset = np.arange(pattern_mat.shape[1]) * num_chromHMM_state
+	return np.where(pattern_mat == segment_store.NO_STATE_CODE, -1, ct_offset[np.newaxis, :] + pattern_mat - 1)
+
+def transform_oneHot_code_mat(pattern_mat, num_chromHMM_state, sparse_output):
+	# encode the states of the train_cell_types (columns of pattern_mat) into 0/1 columns, one per (ct, state) combination. The state codes are mapped directly to column indices (get_oneHot_column_indices), so there is no encoder to fit. If sparse_output, return a CSR matrix, otherwise a dense float numpy array
+	num_rows, num_ct = np.asarray(pattern_mat).shape
+	column_index_mat = get_oneHot_column_indices(pattern_mat, num_chromHMM_state)
+	is_assigned = column_index_mat >= 0
+	row_index = np.repeat(np.arange(num_rows), num_ct).reshape(num_rows, num_ct)[is_assigned] # row-major, so the CSR indices of each row are sorted
+	column_index = column_index_mat[is_assigned]
+	if sparse_output:
+		indptr = np.concatenate([[0], np.cumsum(is_assigned.sum(axis = 1))])
+		return sparse.csr_matrix((np.ones(len(column_index)), column_index, indptr), shape = (num_rows, num_ct * num_chromHMM_state))
+	X_data = np.zeros((num_rows, num_ct * num_chromHMM_state))
+	X_data[row_index, column_index] = 1
+	return X_data
 
-def get_XY_segmentation_data (train_cell_types, response_ct, num_chromHMM_state, train_data_folder):
-	# given the segmentation data of multiple cell types, we want to extract information from the cell types that we will use as predictor (X) and response (Y). Predictor will be binarized with ct_state combinations as columns. Response will be just state labels 1 --> num_chromHMM_state. Rows of these two data frames correspond to different positions on the genome. Genome positions in all cell types' data are ordered exactly as in /u/home/h/havu73/project-ernst/diff_pete/roadmap/sample_genome_regions.gz
+def get_train_data_fn(train_data_folder, ct):
+	return os.path.join(train_data_folder, ct + '_train_data.bed.gz')
+
+def get_train_fingerprint(train_data_folder, train_cell_types, response_ct, seed, train_from_pattern_counts):
+	# the model of response_ct is trained from the training data files of train_cell_types and response_ct (see model_store.get_train_fingerprint)
+	return model_store.get_train_fingerprint(list(map(lambda x: get_train_data_fn(train_data_folder, x), train_cell_types + [response_ct])), seed, train_from_pattern_counts)
+
+def get_train_segment_code_df(ct_list, train_data_folder):
+	# read the state assignments of ct_list at the training positions, and return a dataframe of one-based state indices (rows: training positions, columns: ct_list). Genome positions in all cell types' data are ordered exactly as in /u/home/h/havu73/project-ernst/diff_pete/roadmap/sample_genome_regions.gz
 	all_segment_df = pd.DataFrame()
-	for ct in train_cell_types + [response_ct]:
-		this_ct_fn = os.path.join(train_data_folder, ct + '_train_data.bed.gz') # file correponding to this X_ct
+	for ct in ct_list:
+		this_ct_fn = get_train_data_fn(train_data_folder, ct) # file correponding to this X_ct
 		this_ct_df = pd.read_csv(this_ct_fn, sep = '\t', header = 0) # open that file
 		this_ct_df = this_ct_df[ct] # only pick columns that annotates the chromatin state for this cell type at each of those position
 		all_segment_df = pd.merge(all_segment_df, this_ct_df, how = 'outer', left_index = True, right_index = True) # join columns, index-based. This is equivalent to a cbind in R
 	all_segment_df = all_segment_df[all_segment_df.apply(lambda x: (~x.str.contains('[.,]', regex=True)))].dropna() # drop rows where in at least one cell type the state annnotation is either an empty match (.) or a multiple-state match (,). The multiple state match should not happen if the input data provided by users are directly learned from ChromHMM. However, in some cases, when the input annotations are actually lifted-Over from one ref.genome to another, it can happen that multiple states are maped to the same place. Usually, we want to get rid of those regions, but if the users forgot to do that, we will do that instead here for training data.
+	return all_segment_df.apply(lambda x: x.apply(get_state_number)) # 'E18' --> 18, to match the state codes in the segmentation store
+
+def get_XY_segmentation_data (train_cell_types, response_ct, num_chromHMM_state, train_data_folder):
+	# given the segmentation data of multiple cell types, we want to extract information from the cell types that we will use as predictor (X) and response (Y). Predictor will be the one-based state indices with train_cell_types as columns (see get_pattern_count_table and get_predictorX_segmentation_data for how they are binarized). Response will be just state labels 1 --> num_chromHMM_state. Rows of these two data frames correspond to different positions on the genome.
+	all_segment_df = get_train_segment_code_df(train_cell_types + [response_ct], train_data_folder)
 	Xtrain_segment_df = all_segment_df[train_cell_types]
-	# after getting the state segmentations for all response cell types (E003 --> E127). Now we binarize the data: E003_S1 --> E003_S18 etc.
-	print("Xtrain_segment_df before one hot encoding")
-	n_jobs = 4
-	Xtrain_segment_df = transform_oneHot_trainCt_df(Xtrain_segment_df, train_cell_types, num_chromHMM_state, n_jobs) #now , Xtrain_segment_df is actually a numpy array with 0 and 1 --> one-hot representation of states in training cell types
-	print('Done getting binarized data for input sample annotations')
 	Y_df = all_segment_df[response_ct]  
-	Y_df = Y_df.apply(get_state_number)
-	return Xtrain_segment_df, Y_df # X is binarized, Y is just state label 1 --> num_chromHMM_state
+	return Xtrain_segment_df, Y_df # X is state labels of train_cell_types, Y is just state label 1 --> num_chromHMM_state
+
 
+def get_pattern_count_table(Xtrain_code_mat, Y):
+	# Because all the features are categorical, the training data is summarized exactly by the counts of each distinct combination of (states in train_cell_types, state in response_ct). The log-likelihood of the multinomial logistic regression on the original rows is the same as the count-weighted log-likelihood on the distinct rows.
+	# Xtrain_code_mat: rows: positions, columns: train_cell_types, values: one-based state indices. Y: one-based state indices of response_ct at the same positions
+	# return: pattern_mat (rows: distinct combinations, columns: train_cell_types), pattern_Y, pattern_counts
+	XY_code_mat = np.column_stack([Xtrain_code_mat, Y]).astype(segment_store.STATE_CODE_DTYPE)
+	XY_pattern_mat, pattern_counts = np.unique(XY_code_mat, axis = 0, return_counts = True)
+	return XY_pattern_mat[:, :-1], XY_pattern_mat[:, -1].astype(int), pattern_counts
 
-def get_predictorX_segmentation_data(train_cell_types, num_chromHMM_state, segment_fn):
-	# given the segmentation data of multiple cell types, we want to extract information from the cell types that we will use as predictor (X). Predictor will be binarized with ct_state combinations as columns. Rows of this data frame correspond to different positions on the genome.
-	segment_df = pd.read_csv(segment_fn, sep = '\t', header = 0)
-	segment_df = segment_df[train_cell_types] # only get the data of the cell types that we need as predictors
-	n_jobs = 4
-	segment_df = transform_oneHot_trainCt_df(segment_df, train_cell_types, num_chromHMM_state, n_jobs)
-	return segment_df
+def get_predictorX_segmentation_data(train_cell_types, num_chromHMM_state, pattern_mat, sparse_output = False):
+	# given the states of the cell types that we will use as predictor (X), binarize them with ct_state combinations as columns. 
+	# pattern_mat: rows: distinct patterns of states across train_cell_types (or positions on the genome), columns: train_cell_types (in this order), values: one-based state indices
+	# We train the models on dense matrices (I found out that the weights change slightly when sklearn is given sparse training data). sparse_output avoids allocating positions x (num_train_ct * num_chromHMM_state) floats when the matrix is only used to predict
+	assert np.asarray(pattern_mat).shape[1] == len(train_cell_types), 'pattern_mat should have one column per train cell type'
+	return transform_oneHot_code_mat(pattern_mat, num_chromHMM_state, sparse_output)
 
-def train_multinomial_logistic_regression(X_df, Y_df, num_chromHMM_state, seed):
-	# give the Xtrain_segment_df and Y_df obtained from get_XY_segmentation_data --> train a logistic regression object
+def get_softmax_proba(pattern_mat, num_chromHMM_state, coef, intercept):
+	'''
+	Predicted probabilities of the multinomial logistic regression with parameters coef and intercept (regression_machine.coef_ and intercept_), computed without the one-hot matrix: each row of the one-hot matrix has one 1 per predictor cell type (none if no state is assigned), so the score of each class is the intercept plus the sum, over the predictor cell types, of the coefficient of the (ct, state) at that row.
+	pattern_mat: rows: patterns of states, columns: train_cell_types, values: one-based state indices
+	With 2 classes, sklearn keeps only the coefficients of the second class, and the first class has score 0.
+	Return a numpy array, rows: patterns, columns: states in regression_machine.classes_. The same as regression_machine.predict_proba up to rounding, but without calling sklearn, so that it can run on model parameters in shared memory (see predict_segmentation_window_parallel)
+	'''
+	column_index_mat = get_oneHot_column_indices(pattern_mat, num_chromHMM_state)
+	coef_by_column = np.vstack([coef.T, np.zeros((1, coef.shape[0]))]) # rows: one-hot columns, plus a last row of zeros for the index -1 (no state assigned)
+	score_mat = np.tile(intercept, (column_index_mat.shape[0], 1)) # rows: patterns, columns: classes
+	for ct_index in range(column_index_mat.shape[1]):
+		score_mat += coef_by_column[column_index_mat[:, ct_index]]
+	if coef.shape[0] == 1:
+		score_mat = np.column_stack([np.zeros(score_mat.shape[0]), score_mat])
+	score_mat -= score_mat.max(axis = 1, keepdims = True) # softmax, shifted so that exp does not overflow
+	prob_mat = np.exp(score_mat)
+	prob_mat /= prob_mat.sum(axis = 1, keepdims = True)
+	return prob_mat
+
+def predict_proba_with_pattern_cache(code_mat, train_cell_types, num_chromHMM_state, regression_machine, pattern_prob_cache):
+	'''
+	code_mat: rows: train_cell_types, columns: genomic bins in one window.
+	The model's input at each bin is only the tuple of states of the predictor cell types at that bin, so all the bins with the same tuple (pattern) get the same predicted probabilities. Therefore, we predict each distinct pattern only once, and copy the results back to all the bins with that pattern. Large parts of the genome (quiescent, heterochromatin, etc.) share a small number of patterns.
+	pattern_prob_cache: dictionary, keys: pattern (bytes), values: predicted probabilities of the pattern, ordered as regression_machine.classes_. It is shared across all the windows that we predict with the same regression_machine, so that a pattern is predicted only once in the whole run. It keeps at most MAX_NUM_CACHED_PATTERNS patterns.
+	Return a numpy array, rows: genomic bins, columns: states in regression_machine.classes_
+	'''
+	pattern_mat, bin_pattern_index = np.unique(code_mat.T, axis = 0, return_inverse = True) # pattern_mat: rows: distinct patterns, columns: train_cell_types. bin_pattern_index: for each bin, the row of its pattern in pattern_mat
+	bin_pattern_index = bin_pattern_index.reshape(-1)
+	pattern_key_list = list(map(lambda x: x.tobytes(), pattern_mat))
+	pattern_prob_mat = np.empty((pattern_mat.shape[0], len(regression_machine.classes_)))
+	new_pattern_index_list = []
+	for pattern_index, pattern_key in enumerate(pattern_key_list):
+		if pattern_key in pattern_prob_cache:
+			pattern_prob_mat[pattern_index] = pattern_prob_cache[pattern_key]
+		else:
+			new_pattern_index_list.append(pattern_index)
+	if len(new_pattern_index_list) > 0: # predict the patterns that we have not seen in previous windows
+		assert pattern_mat.shape[1] == len(train_cell_types), 'code_mat should have one row per train cell type'
+		pattern_prob_mat[new_pattern_index_list] = get_softmax_proba(pattern_mat[new_pattern_index_list], num_chromHMM_state, regression_machine.coef_, regression_machine.intercept_)
+		if len(pattern_prob_cache) + len(new_pattern_index_list) <= MAX_NUM_CACHED_PATTERNS:
+			pattern_prob_cache.update(zip(map(lambda x: pattern_key_list[x], new_pattern_index_list), pattern_prob_mat[new_pattern_index_list]))
+	return pattern_prob_mat[bin_pattern_index]
+
+def train_multinomial_logistic_regression(X_df, Y_df, num_chromHMM_state, seed, sample_weight = None):
+	# give the binarized predictor data and Y_df --> train a logistic regression object. If sample_weight is given, each row of X_df and Y_df stands for sample_weight of them (see get_pattern_count_table)
+	# lbfgs fits the multinomial loss whenever there are more than 2 classes, so we do not pass multi_class (it was removed from recent versions of sklearn)
 	np.random.seed(seed)
-	regression_machine = LogisticRegression(random_state = 0, solver = 'lbfgs', multi_class = 'multinomial', max_iter = 10000).fit(X_df, Y_df)
+	if sample_weight is None:
+		regression_machine = LogisticRegression(random_state = 0, solver = 'lbfgs', max_iter = 10000).fit(X_df, Y_df)
+	else:
+		regression_machine = LogisticRegression(random_state = 0, solver = 'lbfgs', max_iter = 10000, tol = PATTERN_COUNT_TOL).fit(X_df, Y_df, sample_weight = sample_weight)
 	print(regression_machine.coef_)
 	return regression_machine 
 
-def predict_segmentation_one_genomic_window(segment_fn, output_fn, train_cell_types, response_ct, num_chromHMM_state, regression_machine):
-	# based on the machine created through training, predict the segmentation corresponding to one specific window on the genome, specified in segment_fn. And print out, for each position, and for each chromHMM state, the probability that the region fall in to the state.
-	# 1. Get the data of predictor cell types into the right format
-	predictor_df = get_predictorX_segmentation_data(train_cell_types, num_chromHMM_state, segment_fn) # rows: predictor cell type - state combinations, columns: positions inside a  window on the genome
-	# 2. Do the prediction job. Different model has different prediction functions
-	response_df = regression_machine.predict_proba(predictor_df) # --> 2D: rows: positions (observations), columns: states (types) --> probability that each obs is of each type
+def get_pred_params_fingerprint(train_cell_types, response_ct, num_chromHMM_state, prob_file_format, model_fn):
+	# the parameters that the predictions of response_ct depend on, other than the input files (see get_pred_input_fn_list). They include the seed, train_from_pattern_counts and the fingerprint of the training data of the model (see model_store.get_train_fingerprint), read from model_fn
+	params = {'step': 'predict', 'train_cell_types': list(train_cell_types), 'response_ct': response_ct, 'num_chromHMM_state': num_chromHMM_state, 'prob_file_format': prob_file_format}
+	params.update(model_store.get_model_train_params(model_fn))
+	return manifest.get_params_fingerprint(params)
+
+def get_pred_input_fn_list(all_ct_segment_folder, window, model_fn):
+	# the predictions at a window depend on the segmentation data of the window, and on the model. The model file is rewritten whenever the model is trained again, so all the predictions of a retrained model are recalculated
+	return [segment_store.get_window_fn(all_ct_segment_folder, window), model_fn]
+
+def record_pred_output(output_fn, all_ct_segment_folder, window, train_cell_types, response_ct, num_chromHMM_state, model_fn, prob_file_format):
+	manifest.record_output(output_fn, get_pred_params_fingerprint(train_cell_types, response_ct, num_chromHMM_state, prob_file_format, model_fn), get_pred_input_fn_list(all_ct_segment_folder, window, model_fn))
+
+def predict_segmentation_one_genomic_window(all_ct_segment_folder, window, output_fn, train_cell_types, train_ct_row_indices, response_ct, num_chromHMM_state, regression_machine, model_fn, pattern_prob_cache, prob_file_format):
+	# based on the machine created through training, predict the segmentation corresponding to one specific window on the genome (ex: chr1_0). And print out, for each position, and for each chromHMM state, the probability that the region fall in to the state.
+	# 1. Get the data of predictor cell types
+	code_mat = segment_store.load_window(all_ct_segment_folder, window, train_ct_row_indices) # rows: train_cell_types, columns: positions inside a window on the genome
+	# 2. Do the prediction job and write the results
+	predict_segmentation_from_code_mat(code_mat, output_fn, train_cell_types, num_chromHMM_state, regression_machine, pattern_prob_cache, prob_file_format)
+	# 3. Record the output file in the manifest of predict_outDir, so that reruns know that it is complete (see find_uncalculated_gene_regions)
+	record_pred_output(output_fn, all_ct_segment_folder, window, train_cell_types, response_ct, num_chromHMM_state, model_fn, prob_file_format)
+
+def predict_segmentation_from_code_mat(code_mat, output_fn, train_cell_types, num_chromHMM_state, regression_machine, pattern_prob_cache, prob_file_format):
+	# code_mat: rows: train_cell_types, columns: positions inside a window on the genome. Predict, for each position, and for each chromHMM state, the probability that the position falls into the state, and write the results into output_fn, in format prob_file_format (see prob_matrix.py)
+	response_df = get_response_prob_df(code_mat, train_cell_types, num_chromHMM_state, regression_machine, pattern_prob_cache)
+	save_response_prob_df(response_df, output_fn, prob_file_format)
+
+def save_response_prob_df(response_df, output_fn, prob_file_format):
+	with manifest.atomic_output(output_fn) as temp_fn:
+		prob_matrix.save_prob_df(response_df, temp_fn, prob_file_format)
+	print ("Done producing file: " + output_fn)
+
+def get_response_prob_df(code_mat, train_cell_types, num_chromHMM_state, regression_machine, pattern_prob_cache):
+	# return a dataframe, rows: positions inside the window, columns: state_1 --> state_<num_chromHMM_state>, values: predicted probabilities that each position is in each state
+	# 1. Do the prediction job, once for each distinct pattern of predictor states (see predict_proba_with_pattern_cache)
+	response_df = predict_proba_with_pattern_cache(code_mat, train_cell_types, num_chromHMM_state, regression_machine, pattern_prob_cache) # --> 2D: rows: positions (observations), columns: states (types) --> probability that each obs is of each type
 	response_df = pd.DataFrame(response_df) # convert to a dataframe 
 	response_df.columns = regression_machine.classes_
 	# soemtimes, due to the the training data not having observations of certain classes (states), therefore, we do not see that state included in the regression machine. Therefore, we assign the probabilities of missing states from the model to be 0. Usually, this is not an issue when we train using 10% of the genome.
@@ -99,67 +217,128 @@ def predict_segmentation_one_genomic_window(segment_fn, output_fn, train_cell_ty
 	for state in missing_states:
 		response_df[state] = 0 # fill up missing states with probabilities 0
 	response_df = response_df[np.arange(1, num_chromHMM_state + 1, 1)] # rearrange the columns from 1 --> num_chromHMM_state
-	# 3. Turn the results into readable format, then write to file. 
+	# 2. Turn the results into readable format
 	response_df.columns = list(map(lambda x: "state_" + str(x + 1), range(num_chromHMM_state)))
-	response_df.to_csv(output_fn, header = True, index = False, compression = 'gzip', sep = '\t')	
-	print ("Done producing file: " + output_fn)
+	return response_df
 
 
-def one_job_run_predict_segmentation(segment_fn_list, output_fn_list, train_cell_types, response_ct, num_chromHMM_state, regression_machine):
+def one_job_run_predict_segmentation(all_ct_segment_folder, window_list, output_fn_list, train_cell_types, train_ct_row_indices, response_ct, num_chromHMM_state, regression_machine, model_fn, prob_file_format):
 	'''
-	segment_fn_list and output_fn_list: the orders of regions in these two lists are similar (look at function predict_segmentation).  
+	window_list and output_fn_list: the orders of regions in these two lists are similar (look at function predict_segmentation).  
 	Each element corresponds to a region on the genome
+	model_fn: the file where regression_machine is saved (see model_store.py)
+	prob_file_format: format of the output files (see prob_matrix.py)
 	'''
-	for (window_index, segment_fn) in enumerate(segment_fn_list):
+	pattern_prob_cache = {} # predicted probabilities of the patterns of predictor states, shared across all windows
+	for (window_index, window) in enumerate(window_list):
 		output_fn = output_fn_list[window_index]
-		predict_segmentation_one_genomic_window(segment_fn, output_fn, train_cell_types, response_ct, num_chromHMM_state, regression_machine)
+		predict_segmentation_one_genomic_window(all_ct_segment_folder, window, output_fn, train_cell_types, train_ct_row_indices, response_ct, num_chromHMM_state, regression_machine, model_fn, pattern_prob_cache, prob_file_format)
+	print('Number of distinct patterns of predictor states predicted: {}'.format(len(pattern_prob_cache)))
 	return 
 
-def find_uncalculated_gene_regions(predict_outDir, all_ct_segment_folder, replace_existing_files):
+def find_uncalculated_gene_regions(predict_outDir, all_ct_segment_folder, replace_existing_files, train_cell_types, response_ct, num_chromHMM_state, model_fn, prob_file_format):
 	"""
 	predict_outDir: the output folder where output files <gene_region>_pred_out.txt.gz are stored
 	all_ct_segment_folder: the folder of input data files for the training. 
-	output: a list of genomic regions that were in the input folder, but missing in the output folder --> uncalculated regions of the genome
+	output: a list of genomic regions that were in the input folder, and whose output files are not up to date in the output folder (missing, cut short by a killed job, or calculated from a different model, different segmentation data or in a different format, see manifest.py) --> uncalculated regions of the genome
 	"""
-	calculated_fn_list = glob.glob(predict_outDir + '/*_pred_out.txt.gz')
-	calculated_region_list = list(map(lambda x: x.split('/')[-1].split('_pred_out.txt.gz')[0], calculated_fn_list)) # chr<chrom>_<region_index>
-	all_input_fn_list = glob.glob(all_ct_segment_folder + '/*_combined_segment.bed.gz')
-	all_region_list = list(map(lambda x: x.split('/')[-1].split('_combined_segment.bed.gz')[0], all_input_fn_list))
-	if replace_existing_files == 1: # the user wants to replace existing files in the output_folder, we willl return all the regions. If not, we return only regions whose output files are missing and hence need to be recalcualted
-		return all_region_list
-	not_calculated_region_list = list(np.setdiff1d(all_region_list, calculated_region_list))
+	all_region_list = sorted(segment_store.list_windows(all_ct_segment_folder))
+	job_list = list(map(lambda x: (x, os.path.join(predict_outDir, x + "_pred_out.txt.gz"), get_pred_input_fn_list(all_ct_segment_folder, x, model_fn)), all_region_list))
+	# if the user wants to replace existing files in the output_folder, we willl return all the regions. If not, we return only regions whose output files need to be recalcualted
+	not_calculated_region_list = manifest.find_jobs_to_compute(job_list, get_pred_params_fingerprint(train_cell_types, response_ct, num_chromHMM_state, prob_file_format, model_fn), replace_existing_files)
+	print("Number of windows that will be predicted for {}: {}".format(response_ct, len(not_calculated_region_list)))
 	return not_calculated_region_list
 
-def predict_segmentation (all_ct_segment_folder, regression_machine, predict_outDir, train_cell_types, response_ct, num_chromHMM_state, replace_existing_files):
+def create_shared_array(array):
+	# copy array into a new block of shared memory. Return the block (the caller closes and unlinks it) and the description that workers use to attach to it (see attach_shared_array)
+	shm = shared_memory.SharedMemory(create = True, size = max(array.nbytes, 1))
+	shared_array = np.ndarray(array.shape, dtype = array.dtype, buffer = shm.buf)
+	shared_array[:] = array
+	return shm, (shm.name, array.shape, array.dtype.str)
+
+def attach_shared_array(shared_array_desc):
+	# shared_array_desc: (name, shape, dtype) from create_shared_array. Return the block (the worker closes it) and a numpy view of it, without copying
+	name, shape, dtype = shared_array_desc
+	shm = shared_memory.SharedMemory(name = name)
+	return shm, np.ndarray(shape, dtype = np.dtype(dtype), buffer = shm.buf)
+
+def window_parallel_worker(all_ct_segment_folder, window_list, output_fn_list, train_cell_types, train_ct_row_indices, response_ct, num_chromHMM_state, model_array_desc_list, model_fn, prob_file_format, next_window_index):
+	'''
+	One worker of predict_segmentation_window_parallel. The model's coef_, intercept_ and classes_ are read from shared memory, and next_window_index (a shared counter) is the work queue: each worker takes the next window that no worker has taken yet, until all windows are taken, so that workers that get windows with fewer distinct patterns predict more windows.
+	Each worker keeps its own pattern_prob_cache across the windows that it predicts.
+	'''
+	shm_list, model_array_list = zip(*map(attach_shared_array, model_array_desc_list))
+	regression_machine = model_store.get_regression_machine(*model_array_list) # only holds the arrays, the probabilities are calculated by get_softmax_proba
+	pattern_prob_cache = {}
+	while True:
+		with next_window_index.get_lock():
+			window_index = next_window_index.value
+			next_window_index.value += 1
+		if window_index >= len(window_list):
+			break
+		predict_segmentation_one_genomic_window(all_ct_segment_folder, window_list[window_index], output_fn_list[window_index], train_cell_types, train_ct_row_indices, response_ct, num_chromHMM_state, regression_machine, model_fn, pattern_prob_cache, prob_file_format)
+	del regression_machine, model_array_list
+	for shm in shm_list:
+		shm.close()
+	return
+
+def predict_segmentation_window_parallel(all_ct_segment_folder, window_list, output_fn_list, train_cell_types, train_ct_row_indices, response_ct, num_chromHMM_state, regression_machine, model_fn, prob_file_format, num_cores):
+	# predict the windows with num_cores worker processes. The model parameters are put into shared memory once, instead of pickling the model for each process, and the workers take windows from a shared counter (see window_parallel_worker)
+	num_cores = min(num_cores, len(window_list))
+	if num_cores <= 1:
+		one_job_run_predict_segmentation(all_ct_segment_folder, window_list, output_fn_list, train_cell_types, train_ct_row_indices, response_ct, num_chromHMM_state, regression_machine, model_fn, prob_file_format)
+		return
+	shm_list, model_array_desc_list = zip(*map(create_shared_array, [regression_machine.coef_, regression_machine.intercept_, regression_machine.classes_]))
+	next_window_index = mp.Value('l', 0)
+	try:
+		processes = [mp.Process(target = window_parallel_worker, args = (all_ct_segment_folder, window_list, output_fn_list, train_cell_types, train_ct_row_indices, response_ct, num_chromHMM_state, model_array_desc_list, model_fn, prob_file_format, next_window_index)) for i in range(num_cores)]
+		for p in processes:
+			p.start()
+		for i, p in enumerate(processes):
+			p.join()
+			assert p.exitcode == 0, "Prediction process {} failed with exit code {}".format(i, p.exitcode)
+	finally:
+		for shm in shm_list:
+			shm.close()
+			shm.unlink()
+	return
+
+def predict_segmentation (all_ct_segment_folder, regression_machine, model_fn, predict_outDir, train_cell_types, response_ct, num_chromHMM_state, replace_existing_files, num_cores = 1, prob_file_format = prob_matrix.DEFAULT_PROB_FILE_FORMAT):
 	# 1. Get list of segmentation files corresponding to different windows on the genome.
-	uncalculated_region_list = find_uncalculated_gene_regions(predict_outDir, all_ct_segment_folder, replace_existing_files) 
-	segment_fn_list = list(map(lambda x: os.path.join(all_ct_segment_folder, x + '_combined_segment.bed.gz'), uncalculated_region_list))
+	uncalculated_region_list = find_uncalculated_gene_regions(predict_outDir, all_ct_segment_folder, replace_existing_files, train_cell_types, response_ct, num_chromHMM_state, model_fn, prob_file_format)
+	train_ct_row_indices = segment_store.get_sample_row_indices(all_ct_segment_folder, train_cell_types)
 	output_fn_list = list(map(lambda x: os.path.join(predict_outDir, x + "_pred_out.txt.gz"), uncalculated_region_list)) # get the output file names corresponding to different regions on the genome
-	# 2. partition the list of file names into groups, for later putting into jobs for multiple processes
-	one_job_run_predict_segmentation(segment_fn_list, output_fn_list, train_cell_types, response_ct, num_chromHMM_state, regression_machine)
-	# num_cores = 4
-	# partition_segment_fn_list = helper.partition_file_list(segment_fn_list, num_cores) # [process_index][file_index]
-	# partition_output_fn_list = helper.partition_file_list(output_fn_list, num_cores)
-	# processes = [mp.Process(target = one_job_run_predict_segmentation, args = (partition_segment_fn_list[i], partition_output_fn_list[i], train_cell_types, response_ct, num_chromHMM_state, regression_machine)) for i in range(num_cores)]
-	# for p in processes:
-	# 	p.start()
-	# for i, p in enumerate(processes):
-	# 	p.join()
-	# 	print ("Process " + str(i) + " is finished!")
+	# 2. predict the windows, with num_cores processes sharing the model
+	predict_segmentation_window_parallel(all_ct_segment_folder, uncalculated_region_list, output_fn_list, train_cell_types, train_ct_row_indices, response_ct, num_chromHMM_state, regression_machine, model_fn, prob_file_format, num_cores)
 	
 def get_train_cell_types(all_ct_fn, response_ct):
 	# given the files that list all cell types of this cell groups, we would like to get the list of train cell types, which is the list of cell types that are not response_ct and are also listed in all_ct_fn
-	ct_list =  list(pd.read_csv(all_ct_fn, sep = '\n', header = None)[0]) # -->  a list with each entry being the cell type in this cell group
+	ct_list = helper.get_list_from_line_seperated_file(all_ct_fn) # -->  a list with each entry being the cell type in this cell group
 	# get the index of the validation ct and then remove it from the list, so that we can focus this training process on ct other than the validation ct
 	response_ct_index = ct_list.index(response_ct)
 	assert response_ct_index != -1, "the validation ct is not present in the list of all cell type of the group that we are trying to train on"
 	ct_list = ct_list[:response_ct_index] + ct_list[(response_ct_index + 1):] # skip the validation ct
 	return ct_list
 
+def train_one_response_ct_model(train_data_folder, train_cell_types, response_ct, num_chromHMM_state, seed, train_from_pattern_counts):
+	# 1. Get the data of predictors and response for training
+	Xtrain_segment_df, Y_df = get_XY_segmentation_data (train_cell_types, response_ct, num_chromHMM_state, train_data_folder)
+	sample_weight = None
+	if train_from_pattern_counts == 1:
+		pattern_mat, Y_df, sample_weight = get_pattern_count_table(Xtrain_segment_df.values, Y_df.values)
+		print ("Compressed {} training positions into {} distinct patterns".format(Xtrain_segment_df.shape[0], pattern_mat.shape[0]))
+	else: 
+		pattern_mat = Xtrain_segment_df.values
+	# now we binarize the data: E003_S1 --> E003_S18 etc.
+	Xtrain_segment_df = get_predictorX_segmentation_data(train_cell_types, num_chromHMM_state, pattern_mat) # numpy array with 0 and 1 --> one-hot representation of states in training cell types
+	print ("Done getting one hot data")
+	# 2. Get the regression machine
+	return train_multinomial_logistic_regression(Xtrain_segment_df, Y_df, num_chromHMM_state, seed, sample_weight)
+
 def main():
 	start_time = time.time()
 	num_mandatory_args = 9
-	if len(sys.argv)!= num_mandatory_args: 
+	if len(sys.argv) not in [num_mandatory_args, num_mandatory_args + 1, num_mandatory_args + 2, num_mandatory_args + 3]: 
 		usage()
 	train_data_folder = sys.argv[1]
 	helper.check_dir_exist(train_data_folder)
@@ -177,22 +356,35 @@ def main():
 	all_ct_fn = sys.argv[6]
 	helper.check_file_exist(all_ct_fn)
 	replace_existing_files = helper.get_command_line_integer(sys.argv[7])
-	assert replace_existing_files in [0,1], 'replace_existing_files should be 0 (no, only create result files for those that have not been outputted) or 1 (yes, rewrite everything)'
+	assert replace_existing_files in [0,1], 'replace_existing_files should be 0 (no, only create result files that are missing or out of date, see manifest.py) or 1 (yes, rewrite everything)'
 	# get the list of train_cell_types as our training features
 	seed = helper.get_command_line_integer(sys.argv[8])
+	train_from_pattern_counts = 1
+	if len(sys.argv) > num_mandatory_args:
+		train_from_pattern_counts = helper.get_command_line_integer(sys.argv[9])
+		assert train_from_pattern_counts in [0,1], 'train_from_pattern_counts should be 0 (fit on one row per training position) or 1 (fit on the counts of distinct patterns)'
+	num_cores = 1
+	if len(sys.argv) > num_mandatory_args + 1:
+		num_cores = helper.get_command_line_integer(sys.argv[10])
+		assert num_cores > 0, 'num_cores should be positive'
+	prob_file_format = prob_matrix.DEFAULT_PROB_FILE_FORMAT
+	if len(sys.argv) > num_mandatory_args + 2:
+		prob_file_format = prob_matrix.check_prob_file_format(sys.argv[11])
 	train_cell_types = get_train_cell_types(all_ct_fn, response_ct)
 	print ("Done getting command line arguments")
-	# 1. Get the data of predictors and response for training
-	Xtrain_segment_df, Y_df = get_XY_segmentation_data (train_cell_types, response_ct, num_chromHMM_state, train_data_folder)
-	end_time = time.time()
-	print ("Done getting one hot data: {}".format(end_time - start_time))
-	# 2. Get the regression machine
-	regression_machine = train_multinomial_logistic_regression(Xtrain_segment_df, Y_df, num_chromHMM_state, seed)
-	print(regression_machine.coef_)
+	# 1. Get the regression machine, trained now or in a previous run
+	model_fn = model_store.get_model_fn(predict_outDir, response_ct)
+	train_fingerprint = get_train_fingerprint(train_data_folder, train_cell_types, response_ct, seed, train_from_pattern_counts)
+	regression_machine = None
+	if replace_existing_files == 0:
+		regression_machine = model_store.load_model_if_matching(model_fn, train_cell_types, num_chromHMM_state, train_fingerprint)
+	if regression_machine is None:
+		regression_machine = train_one_response_ct_model(train_data_folder, train_cell_types, response_ct, num_chromHMM_state, seed, train_from_pattern_counts)
+		model_store.save_model(model_fn, regression_machine, train_cell_types, response_ct, num_chromHMM_state, seed, train_from_pattern_counts, train_fingerprint)
 	end_time = time.time()
 	print ("Done training: {}".format(end_time - start_time))
-	# 3. Based on the machine just created, process training data and then predict the segmentation at each position for the response_ct
-	predict_segmentation (all_ct_segment_folder, regression_machine, predict_outDir, train_cell_types, response_ct, num_chromHMM_state,  replace_existing_files)
+	# 2. Based on the machine just created, process training data and then predict the segmentation at each position for the response_ct
+	predict_segmentation (all_ct_segment_folder, regression_machine, model_fn, predict_outDir, train_cell_types, response_ct, num_chromHMM_state,  replace_existing_files, num_cores, prob_file_format)
 	end_time = time.time()
 	print ("Done predicting whole genome: {}".format(end_time - start_time))
 	
@@ -204,8 +396,11 @@ def usage():
 	print ("response_ct: the cell type that we are trying to predict from the training dataset. This data is the Y value in our model training")
 	print ("num_chromHMM_state: Number of chromHMM states that are shared across different cell types")
 	print ("all_ct_fn: number of cell types that we will train")
-	print ("replace_existing_files: whether or not we would want to replace_existing_ output files 0 (no, only create result files for those that have not been outputted) or 1 (yes, rewrite everything)")
+	print ("replace_existing_files: whether or not we would want to replace_existing_ output files 0 (no, only create result files that are missing or out of date, see manifest.py) or 1 (yes, rewrite everything)")
 	print ('seed: random seed for reproducibility')
+	print ('train_from_pattern_counts: (optional, default 1) 1: fit the model on the counts of distinct (predictor states, response state) patterns. 0: fit the model on one row per training position')
+	print ('num_cores: (optional, default 1) number of processes that predict the windows of the genome at the same time. Requires train_from_pattern_counts to be given')
+	print ('prob_file_format: (optional, default txt) format of the output files: txt, float16, uint8 or rle (see prob_matrix.py). Requires num_cores to be given')
 	exit(1)
 
 if __name__ == '__main__':
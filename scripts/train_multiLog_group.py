@@ -0,0 +1,232 @@
+#!/usr/bin/env python
+'''
+This file trains the multinomial logistic regression models of all samples in a group (leave-one-out: each sample is predicted from all the other samples in the group), and predicts the chromatin state maps of all the samples. It produces the same outputs as calling train_multiLog_auto1Hot.py once for each sample in the group, but the training data and each window of the genome-wide segmentation data are read only once for the whole group, instead of once per sample.
+The model of each sample is saved into all_ct_pred_dir/pred_<ct>/<ct>_model.npz (see model_store.py). If replace_existing_files is 0, models that are already saved are loaded instead of trained again.
+
+command-line argument:
+python train_multiLog_group.py
+train_data_folder: where the state assignment and of training data are stored for all cell types. Each cell type has its own file
+all_ct_segment_folder: where segmentation data of all cell types are stored, for the entire genome, so that we can get data for prediction out. This is the binary window store produced by get_all_ct_segment_folder.py (see segment_store.py)
+all_ct_pred_dir: the folder where the predictions of each cell type <ct> are stored in subfolder pred_<ct>, as in the outputs of train_multiLog_auto1Hot.py
+num_chromHMM_state: Number of chromHMM states that are shared across different cell types
+all_ct_fn: file listing the cell types in this group, one per line
+replace_existing_files: whether or not we would want to replace_existing_ output files 0 (no, only create result files that are missing or out of date, see manifest.py) or 1 (yes, rewrite everything)
+seed: random seed for reproducibility
+train_from_pattern_counts: 1: fit the models on the counts of distinct (predictor states, response state) patterns. 0: fit the models on one row per training position (see train_multiLog_auto1Hot.py)
+num_cores: number of processes used to train the models, and to predict the windows
+avg_outDir: (optional) if given, the predictions of all the samples are averaged as each window is predicted, and only the average predictions <window>_avg_pred.txt.gz are written into avg_outDir (same outputs as average_pred_results.py). Windows whose average prediction file is up to date (see manifest.py) are skipped if replace_existing_files is 0. none: do not average the predictions
+write_per_sample_pred: (optional, only with avg_outDir, default 0) 1: also write the predictions of each sample into all_ct_pred_dir/pred_<ct>. 0: do not write them
+prob_file_format: (optional, default txt) format of the prediction files and the average prediction files: txt, float16, uint8 or rle (see prob_matrix.py). To give it without averaging the predictions, give none as avg_outDir and 1 as write_per_sample_pred
+'''
+import pandas as pd
+import numpy as np
+import os
+import sys
+import time
+import helper
+import segment_store
+import model_store
+import manifest
+import prob_matrix
+import train_multiLog_auto1Hot as multiLog
+import average_pred_results
+
+def get_train_cell_types(ct_list, response_ct):
+	# all the cell types of the group except response_ct, in the order of ct_list
+	response_ct_index = ct_list.index(response_ct)
+	return ct_list[:response_ct_index] + ct_list[(response_ct_index + 1):]
+
+def get_group_pattern_count_table(group_code_mat):
+	# group_code_mat: rows: training positions, columns: all cell types in the group. The training data of every leave-one-out model are columns of this matrix, so we compress it once into the distinct patterns of states across the whole group and their counts. The training table of each model is then obtained from this much smaller table (see get_one_response_ct_training_data)
+	group_pattern_mat, group_pattern_counts = np.unique(group_code_mat.astype(segment_store.STATE_CODE_DTYPE), axis = 0, return_counts = True)
+	return group_pattern_mat, group_pattern_counts
+
+def get_one_response_ct_training_data(group_pattern_mat, group_pattern_counts, response_ct_index, train_from_pattern_counts):
+	# return the predictor states (rows: training rows, columns: all cell types in the group except the response_ct), the response states, and the weights of the training rows of the model that predicts the response_ct
+	Y = group_pattern_mat[:, response_ct_index]
+	Xtrain_code_mat = np.delete(group_pattern_mat, response_ct_index, axis = 1)
+	if train_from_pattern_counts == 1: # patterns of the group that only differ at the response_ct are different rows of the model's training table, so we merge the patterns that are the same among the predictor cell types and the response_ct
+		XY_code_mat = np.column_stack([Xtrain_code_mat, Y])
+		XY_pattern_mat, pattern_index = np.unique(XY_code_mat, axis = 0, return_inverse = True)
+		pattern_counts = np.bincount(pattern_index.reshape(-1), weights = group_pattern_counts).astype(int)
+		return XY_pattern_mat[:, :-1], XY_pattern_mat[:, -1].astype(int), pattern_counts
+	# one row per training position, as in train_multiLog_auto1Hot.py with train_from_pattern_counts = 0
+	return np.repeat(Xtrain_code_mat, group_pattern_counts, axis = 0), np.repeat(Y, group_pattern_counts).astype(int), None
+
+def train_one_response_ct(group_pattern_mat, group_pattern_counts, ct_list, response_ct, num_chromHMM_state, seed, train_from_pattern_counts):
+	# train the model that predicts response_ct from all the other cell types in ct_list
+	response_ct_index = ct_list.index(response_ct)
+	train_cell_types = get_train_cell_types(ct_list, response_ct)
+	Xtrain_code_mat, Y, sample_weight = get_one_response_ct_training_data(group_pattern_mat, group_pattern_counts, response_ct_index, train_from_pattern_counts)
+	Xtrain_segment_df = multiLog.get_predictorX_segmentation_data(train_cell_types, num_chromHMM_state, Xtrain_code_mat)
+	regression_machine = multiLog.train_multinomial_logistic_regression(Xtrain_segment_df, Y, num_chromHMM_state, seed, sample_weight)
+	print ("Done training the model of {}".format(response_ct))
+	return regression_machine
+
+def train_all_response_ct(train_data_folder, all_ct_pred_dir, ct_list, num_chromHMM_state, seed, train_from_pattern_counts, replace_existing_files, num_cores):
+	# read the training data of the group once, then train the leave-one-out model of each cell type in ct_list, and save the models. Models saved by a previous run are loaded instead, unless replace_existing_files is 1. Return a dictionary, keys: response_ct, values: regression machines
+	regression_machine_dict = {}
+	for response_ct in ct_list:
+		helper.make_dir(get_pred_dir(all_ct_pred_dir, response_ct))
+		if replace_existing_files == 0:
+			regression_machine = model_store.load_model_if_matching(get_model_fn(all_ct_pred_dir, response_ct), get_train_cell_types(ct_list, response_ct), num_chromHMM_state, multiLog.get_train_fingerprint(train_data_folder, get_train_cell_types(ct_list, response_ct), response_ct, seed, train_from_pattern_counts))
+			if regression_machine is not None:
+				regression_machine_dict[response_ct] = regression_machine
+	untrained_ct_list = list(filter(lambda x: x not in regression_machine_dict, ct_list))
+	if len(untrained_ct_list) == 0:
+		return regression_machine_dict
+	group_code_df = multiLog.get_train_segment_code_df(ct_list, train_data_folder)
+	group_pattern_mat, group_pattern_counts = get_group_pattern_count_table(group_code_df.values)
+	print ("Compressed {} training positions into {} distinct patterns of the group".format(group_code_df.shape[0], group_pattern_mat.shape[0]))
+	job_args_list = list(map(lambda x: (group_pattern_mat, group_pattern_counts, ct_list, x, num_chromHMM_state, seed, train_from_pattern_counts), untrained_ct_list))
+	regression_machine_list = helper.run_weighted_jobs(train_one_response_ct, job_args_list, [1] * len(untrained_ct_list), num_cores) # all models have the same amount of training data
+	for response_ct, regression_machine in zip(untrained_ct_list, regression_machine_list):
+		model_store.save_model(get_model_fn(all_ct_pred_dir, response_ct), regression_machine, get_train_cell_types(ct_list, response_ct), response_ct, num_chromHMM_state, seed, train_from_pattern_counts, multiLog.get_train_fingerprint(train_data_folder, get_train_cell_types(ct_list, response_ct), response_ct, seed, train_from_pattern_counts))
+		regression_machine_dict[response_ct] = regression_machine
+	return regression_machine_dict
+
+def predict_window_list_all_response_ct(all_ct_segment_folder, window_list, response_ct_list_per_window, all_ct_pred_dir, ct_list, num_chromHMM_state, regression_machine_dict, avg_outDir, write_per_sample_pred, prob_file_format):
+	'''
+	window_list: windows to predict in this job (ex: all the windows of one chromosome).
+	response_ct_list_per_window: for each window, the cell types whose predictions at this window are to be produced.
+	avg_outDir: None, or the folder where the average predictions of all cell types are written. In the latter case, response_ct_list_per_window should list all the cell types for each window
+	write_per_sample_pred: 0 or 1, whether the predictions of each cell type are written into all_ct_pred_dir/pred_<ct>
+	prob_file_format: format of the prediction files and the average prediction files (see prob_matrix.py)
+	Each window is read from the store only once, then all the models predict it from their own rows of the window matrix. Each model keeps its own pattern_prob_cache across the windows of this job (see multiLog.predict_proba_with_pattern_cache)
+	'''
+	ct_row_indices = segment_store.get_sample_row_indices(all_ct_segment_folder, ct_list)
+	pattern_prob_cache_dict = dict(map(lambda x: (x, {}), ct_list))
+	for (window_index, window) in enumerate(window_list):
+		group_code_mat = segment_store.load_window(all_ct_segment_folder, window, ct_row_indices) # rows: ct_list, columns: positions inside the window
+		sum_prob_df = None # sum of the predicted probabilities across cell types, used if avg_outDir is given
+		for response_ct in response_ct_list_per_window[window_index]:
+			response_ct_index = ct_list.index(response_ct)
+			train_cell_types = get_train_cell_types(ct_list, response_ct)
+			code_mat = np.delete(group_code_mat, response_ct_index, axis = 0)
+			response_df = multiLog.get_response_prob_df(code_mat, train_cell_types, num_chromHMM_state, regression_machine_dict[response_ct], pattern_prob_cache_dict[response_ct])
+			if write_per_sample_pred == 1:
+				output_fn = os.path.join(get_pred_dir(all_ct_pred_dir, response_ct), window + '_pred_out.txt.gz')
+				multiLog.save_response_prob_df(response_df, output_fn, prob_file_format)
+				multiLog.record_pred_output(output_fn, all_ct_segment_folder, window, train_cell_types, response_ct, num_chromHMM_state, get_model_fn(all_ct_pred_dir, response_ct), prob_file_format)
+			if avg_outDir is not None:
+				sum_prob_df = response_df if sum_prob_df is None else sum_prob_df + response_df
+		if avg_outDir is not None: # average across cell types, then normalize the rows, as in average_pred_results.average_multiple_result_files
+			avg_output_fn = os.path.join(avg_outDir, window + '_avg_pred.txt.gz')
+			average_pred_results.save_row_normalized_avg_df(sum_prob_df / len(response_ct_list_per_window[window_index]), avg_output_fn, prob_file_format)
+			manifest.record_output(avg_output_fn, average_pred_results.get_avg_params_fingerprint(ct_list, num_chromHMM_state, prob_file_format), get_fused_avg_input_fn_list(all_ct_segment_folder, window, all_ct_pred_dir, ct_list))
+			print ("Done averaging region: " + window)
+	return
+
+def get_pred_dir(all_ct_pred_dir, response_ct):
+	return os.path.join(all_ct_pred_dir, 'pred_' + response_ct)
+
+def get_model_fn(all_ct_pred_dir, response_ct):
+	return model_store.get_model_fn(get_pred_dir(all_ct_pred_dir, response_ct), response_ct)
+
+def get_fused_avg_input_fn_list(all_ct_segment_folder, window, all_ct_pred_dir, ct_list):
+	# when the average predictions are calculated as the models predict, the average file of a window depends on the segmentation data of the window and on the models of all the cell types
+	return [segment_store.get_window_fn(all_ct_segment_folder, window)] + list(map(lambda x: get_model_fn(all_ct_pred_dir, x), ct_list))
+
+def get_response_ct_list_per_window(all_ct_segment_folder, all_ct_pred_dir, ct_list, num_chromHMM_state, replace_existing_files, prob_file_format):
+	# return a dictionary, keys: windows that need to be predicted for at least one cell type, values: list of cell types whose predictions at the window are missing or out of date (or all cell types if replace_existing_files == 1)
+	response_ct_list_per_window = {}
+	for response_ct in ct_list:
+		predict_outDir = get_pred_dir(all_ct_pred_dir, response_ct)
+		helper.make_dir(predict_outDir)
+		for window in multiLog.find_uncalculated_gene_regions(predict_outDir, all_ct_segment_folder, replace_existing_files, get_train_cell_types(ct_list, response_ct), response_ct, num_chromHMM_state, get_model_fn(all_ct_pred_dir, response_ct), prob_file_format):
+			response_ct_list_per_window.setdefault(window, []).append(response_ct)
+	return response_ct_list_per_window
+
+def get_response_ct_list_per_avg_window(all_ct_segment_folder, avg_outDir, all_ct_pred_dir, ct_list, num_chromHMM_state, replace_existing_files, prob_file_format):
+	# when we only write the average predictions, all the cell types are predicted at each window whose average prediction file is missing or out of date (or at all windows if replace_existing_files == 1)
+	window_list = average_pred_results.get_genomic_positions_list(all_ct_segment_folder, avg_outDir, replace_existing_files, average_pred_results.get_avg_params_fingerprint(ct_list, num_chromHMM_state, prob_file_format), lambda x: get_fused_avg_input_fn_list(all_ct_segment_folder, x, all_ct_pred_dir, ct_list))
+	return dict(map(lambda x: (x, ct_list), window_list))
+
+def predict_segmentation_all_response_ct(all_ct_segment_folder, all_ct_pred_dir, ct_list, num_chromHMM_state, regression_machine_dict, replace_existing_files, num_cores, avg_outDir = None, write_per_sample_pred = 1, prob_file_format = prob_matrix.DEFAULT_PROB_FILE_FORMAT):
+	if avg_outDir is None:
+		response_ct_list_per_window = get_response_ct_list_per_window(all_ct_segment_folder, all_ct_pred_dir, ct_list, num_chromHMM_state, replace_existing_files, prob_file_format)
+	else:
+		response_ct_list_per_window = get_response_ct_list_per_avg_window(all_ct_segment_folder, avg_outDir, all_ct_pred_dir, ct_list, num_chromHMM_state, replace_existing_files, prob_file_format)
+	# one job per chromosome, so that the models' pattern caches are reused across the windows of a chromosome. Jobs are weighted by the number of (window, response_ct) pairs to predict
+	window_df = pd.DataFrame({'window': list(response_ct_list_per_window.keys())})
+	window_df['chrom'] = window_df['window'].apply(lambda x: x.split('_')[0])
+	window_df['window_index'] = window_df['window'].apply(lambda x: int(x.split('_')[1]))
+	window_df = window_df.sort_values(['chrom', 'window_index'])
+	job_args_list = []
+	job_weight_list = []
+	for chrom, chrom_window_df in window_df.groupby('chrom'):
+		window_list = list(chrom_window_df['window'])
+		chrom_response_ct_list = list(map(lambda x: response_ct_list_per_window[x], window_list))
+		job_args_list.append((all_ct_segment_folder, window_list, chrom_response_ct_list, all_ct_pred_dir, ct_list, num_chromHMM_state, regression_machine_dict, avg_outDir, write_per_sample_pred, prob_file_format))
+		job_weight_list.append(sum(map(len, chrom_response_ct_list)))
+	helper.run_weighted_jobs(predict_window_list_all_response_ct, job_args_list, job_weight_list, num_cores)
+	return
+
+def main():
+	start_time = time.time()
+	num_mandatory_args = 10
+	if len(sys.argv) not in [num_mandatory_args, num_mandatory_args + 1, num_mandatory_args + 2, num_mandatory_args + 3]:
+		usage()
+	train_data_folder = sys.argv[1]
+	helper.check_dir_exist(train_data_folder)
+	all_ct_segment_folder = sys.argv[2]
+	helper.check_dir_exist(all_ct_segment_folder)
+	all_ct_pred_dir = sys.argv[3]
+	helper.make_dir(all_ct_pred_dir)
+	try:
+		num_chromHMM_state = int(sys.argv[4])
+		assert num_chromHMM_state > 0, "num_chromHMM_state needs to be positive"
+	except:
+		print ("num_chromHMM_state is not valid")
+		usage()
+	all_ct_fn = sys.argv[5]
+	helper.check_file_exist(all_ct_fn)
+	replace_existing_files = helper.get_command_line_integer(sys.argv[6])
+	assert replace_existing_files in [0,1], 'replace_existing_files should be 0 (no, only create result files that are missing or out of date, see manifest.py) or 1 (yes, rewrite everything)'
+	seed = helper.get_command_line_integer(sys.argv[7])
+	train_from_pattern_counts = helper.get_command_line_integer(sys.argv[8])
+	assert train_from_pattern_counts in [0,1], 'train_from_pattern_counts should be 0 (fit on one row per training position) or 1 (fit on the counts of distinct patterns)'
+	num_cores = helper.get_command_line_integer(sys.argv[9])
+	avg_outDir = None
+	write_per_sample_pred = 1 # if we do not average the predictions here, the predictions of each sample are the outputs
+	if len(sys.argv) > num_mandatory_args and sys.argv[10] != 'none':
+		avg_outDir = sys.argv[10]
+		helper.make_dir(avg_outDir)
+		write_per_sample_pred = 0
+	if len(sys.argv) > num_mandatory_args + 1:
+		write_per_sample_pred = helper.get_command_line_integer(sys.argv[11])
+		assert write_per_sample_pred in [0,1], 'write_per_sample_pred should be 0 (only write the average predictions) or 1 (also write the predictions of each sample)'
+		assert avg_outDir is not None or write_per_sample_pred == 1, 'write_per_sample_pred should be 1 if the predictions are not averaged (avg_outDir is none)'
+	prob_file_format = prob_matrix.DEFAULT_PROB_FILE_FORMAT
+	if len(sys.argv) > num_mandatory_args + 2:
+		prob_file_format = prob_matrix.check_prob_file_format(sys.argv[12])
+	ct_list = helper.get_list_from_line_seperated_file(all_ct_fn)
+	assert len(ct_list) > 1, 'There should be at least 2 cell types in the group to train leave-one-out models'
+	print ("Done getting command line arguments")
+	# 1. Train the leave-one-out models of all the cell types in the group
+	regression_machine_dict = train_all_response_ct(train_data_folder, all_ct_pred_dir, ct_list, num_chromHMM_state, seed, train_from_pattern_counts, replace_existing_files, num_cores)
+	end_time = time.time()
+	print ("Done training {} models: {}".format(len(ct_list), end_time - start_time))
+	# 2. Predict the segmentation of all the cell types, reading each window once. If avg_outDir is given, the predictions are averaged across cell types as each window is predicted
+	predict_segmentation_all_response_ct(all_ct_segment_folder, all_ct_pred_dir, ct_list, num_chromHMM_state, regression_machine_dict, replace_existing_files, num_cores, avg_outDir, write_per_sample_pred, prob_file_format)
+	end_time = time.time()
+	print ("Done predicting whole genome: {}".format(end_time - start_time))
+
+def usage():
+	print ("python train_multiLog_group.py ")
+	print ("train_data_folder: where the state assignment and of training data are stored for all cell types. Each cell type has its own file")
+	print ("all_ct_segment_folder: where segmentation data of all cell types are stored, for the entire genome, so that we can get data for prediction out.")
+	print ("all_ct_pred_dir: the folder where the predictions of each cell type <ct> are stored in subfolder pred_<ct>")
+	print ("num_chromHMM_state: Number of chromHMM states that are shared across different cell types")
+	print ("all_ct_fn: file listing the cell types in this group, one per line")
+	print ("replace_existing_files: whether or not we would want to replace_existing_ output files 0 (no, only create result files that are missing or out of date, see manifest.py) or 1 (yes, rewrite everything)")
+	print ('seed: random seed for reproducibility')
+	print ('train_from_pattern_counts: 1: fit the models on the counts of distinct (predictor states, response state) patterns. 0: fit the models on one row per training position')
+	print ('num_cores: number of processes used to train the models, and to predict the windows')
+	print ('avg_outDir: (optional) if given, only the average predictions across samples <window>_avg_pred.txt.gz are written into avg_outDir, as the windows are predicted. none: do not average the predictions')
+	print ('write_per_sample_pred: (optional, only with avg_outDir, default 0) 1: also write the predictions of each sample into all_ct_pred_dir/pred_<ct>. 0: do not write them')
+	print ('prob_file_format: (optional, default txt) format of the prediction files and the average prediction files: txt, float16, uint8 or rle (see prob_matrix.py)')
+	exit(1)
+
+if __name__ == '__main__':
+	main()
@@ -2,15 +2,18 @@ import unittest
 import os
 import sys
 import shutil
+import numpy as np
+import pandas as pd
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts/')))
 import average_pred_results as avg
+import manifest
 import helper
 
 
 def create_fake_all_ct_segment_folder(all_ct_segment_folder, total_num_files):
     helper.make_dir(all_ct_segment_folder)
     for i in range(total_num_files):
-        fn = os.path.join(all_ct_segment_folder, 'chr22_{}_combined_segment.bed.gz'.format(i))
+        fn = os.path.join(all_ct_segment_folder, 'chr22_{}_combined_segment.npy'.format(i))
         f = open(fn, 'w+')  # create this file if it does not exist
         f.close()
     return
@@ -30,19 +33,63 @@ class TestAvgMethods(unittest.TestCase):
         all_ct_segment_folder = os.path.join(testdata_folder, 'all_ct_segments')
         avg_folder = os.path.join(testdata_folder, 'avg_folder')
         create_fake_all_ct_segment_folder(all_ct_segment_folder, self.total_num_files)
-        create_fake_avg_result_folder(avg_folder, 1)
-        exp_result = list(map(lambda x: 'chr22_{}'.format(x), range(1, self.total_num_files)))
+        create_fake_avg_result_folder(avg_folder, 3)
+        params_fingerprint = avg.get_avg_params_fingerprint(['E003', 'E008'], 3, 'txt')
+        get_window_input_fn_list = lambda x: [os.path.join(all_ct_segment_folder, x + '_combined_segment.npy')]
+        # chr22_0 and chr22_1 are recorded in the manifest, chr22_2 exists but was never recorded (ex: cut short by a killed job)
+        for window in ['chr22_0', 'chr22_1']:
+            manifest.record_output(os.path.join(avg_folder, window + '_avg_pred.txt.gz'), params_fingerprint, get_window_input_fn_list(window))
+        exp_result = list(map(lambda x: 'chr22_{}'.format(x), range(2, self.total_num_files)))
         replace_existing_file = 0
-        obs_result = avg.get_genomic_positions_list(all_ct_segment_folder, avg_folder, replace_existing_file)
+        obs_result = avg.get_genomic_positions_list(all_ct_segment_folder, avg_folder, replace_existing_file, params_fingerprint, get_window_input_fn_list)
         self.assertCountEqual(exp_result, obs_result)
+        # different parameters, or a changed input file, make the recorded outputs out of date
+        obs_result = avg.get_genomic_positions_list(all_ct_segment_folder, avg_folder, replace_existing_file, avg.get_avg_params_fingerprint(['E003', 'E014'], 3, 'txt'), get_window_input_fn_list)
+        self.assertCountEqual(list(map(lambda x: 'chr22_{}'.format(x), range(self.total_num_files))), obs_result)
+        with open(get_window_input_fn_list('chr22_1')[0], 'w') as outF:
+            outF.write('changed')
+        obs_result = avg.get_genomic_positions_list(all_ct_segment_folder, avg_folder, replace_existing_file, params_fingerprint, get_window_input_fn_list)
+        self.assertCountEqual(['chr22_1'] + exp_result, obs_result)
         replace_existing_file = 1
         exp_result = list(map(lambda x: 'chr22_{}'.format(x), range(self.total_num_files)))
-        obs_result = avg.get_genomic_positions_list(all_ct_segment_folder, avg_folder, replace_existing_file)
+        obs_result = avg.get_genomic_positions_list(all_ct_segment_folder, avg_folder, replace_existing_file, params_fingerprint, get_window_input_fn_list)
         self.assertCountEqual(exp_result, obs_result)
         # after all the tests, we will remove all the fake folders we created to test the functions
         shutil.rmtree(all_ct_segment_folder)
         shutil.rmtree(avg_folder)
         return
 
+    def test_average_multiple_result_files(self):
+        testdata_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../testdata/'))
+        pred_folder = os.path.join(testdata_folder, 'test_avg_pred')
+        helper.make_dir(pred_folder)
+        num_chromHMM_state = 3
+        colnames = list(map(lambda x: 'state_' + str(x+1), range(num_chromHMM_state)))
+        rng = np.random.default_rng(0)
+        result_fn_list = []
+        result_df_list = []
+        for i in range(5):
+            df = pd.DataFrame(rng.dirichlet(np.ones(num_chromHMM_state), size = 100), columns = colnames)
+            fn = os.path.join(pred_folder, 'sample{}_pred_out.txt.gz'.format(i))
+            df.to_csv(fn, header = True, index = False, compression = 'gzip', sep = '\t')
+            result_fn_list.append(fn)
+            result_df_list.append(df)
+        output_fn = os.path.join(pred_folder, 'avg_pred.txt.gz')
+        avg.average_multiple_result_files(result_fn_list, output_fn, num_chromHMM_state, 'txt')
+        exp_df = pd.concat(result_df_list).groupby(level = 0).mean()
+        exp_df = exp_df.div(exp_df.sum(axis = 1), axis = 0)
+        obs_df = avg.read_rep_df(output_fn, num_chromHMM_state)
+        self.assertEqual(exp_df.shape, obs_df.shape)
+        self.assertTrue(np.allclose(exp_df.values, obs_df.values, rtol = 0, atol = 1e-6)) # the sum is accumulated in float32
+        # the same average, written as runs of bins with identical probabilities
+        avg.average_multiple_result_files(result_fn_list, output_fn, num_chromHMM_state, 'rle')
+        self.assertTrue(np.allclose(obs_df.values, avg.read_rep_df(output_fn, num_chromHMM_state).values, rtol = 0, atol = 1e-7))
+        # if one of the files is missing, the average is not calculated
+        os.remove(output_fn)
+        avg.average_multiple_result_files(result_fn_list + [os.path.join(pred_folder, 'missing_pred_out.txt.gz')], output_fn, num_chromHMM_state, 'txt')
+        self.assertFalse(os.path.isfile(output_fn))
+        shutil.rmtree(pred_folder)
+        return
+
 if __name__ == "__main__":
     unittest.main()
\ No newline at end of file
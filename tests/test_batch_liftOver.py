@@ -0,0 +1,69 @@
+import unittest
+import os
+import sys
+import gzip
+import shutil
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts/')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../liftOver_csrep_output/'))) # after scripts/, so that helper is the same module for all the tests
+import mapping_index
+import prob_matrix
+import batch_liftOver
+
+NUM_STATE = 3
+# (org chrom, org bin) --> (dest chrom, dest start): the bins of chr1 are mapped to chr2 and chr3 of the destination assembly, bin 3 of chr2 is mapped in between them
+MAP_LIST = [(0, 0, 1, 1000), (0, 1, 2, 0), (0, 2, 1, 400), (0, 3, 1, 600), (1, 3, 1, 200)]
+SUM_TEXT = '''track name=test
+chr1\t0\t600\tE1
+chr1\t600\t1000\tE2
+chr2\t0\t1000\tE3
+'''
+
+class TestBatchLiftOverMethods(unittest.TestCase):
+    def test_batch_liftOver(self):
+        output_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../testdata/test_batch_liftOver'))
+        org_all_ct_folder, dest_all_ct_folder = os.path.join(output_folder, 'org'), os.path.join(output_folder, 'dest')
+        org_chrom, org_bin, dest_chrom, dest_start = map(np.array, zip(*MAP_LIST))
+        map_fn = os.path.join(output_folder, 'bin_map.npz')
+        os.makedirs(output_folder, exist_ok = True)
+        mapping_index.save_mapping_index(mapping_index.sort_mapping_index({'org_chrom': org_chrom, 'org_bin': org_bin, 'dest_chrom': dest_chrom, 'dest_start': dest_start, 'dest_end': dest_start + 200, 'chrom_names': ['chr1', 'chr2', 'chr3']}), map_fn)
+        # the average predictions (5 bins per window) and summary chromatin state maps of two groups
+        rng = np.random.default_rng(0)
+        cell_group_list = ['ESC', 'Brain']
+        window_mat_dict = {}
+        for cell_group in cell_group_list:
+            csrep_folder = os.path.join(batch_liftOver.get_group_folder(org_all_ct_folder, cell_group, 'multi_logistic'), 'average_predictions')
+            os.makedirs(csrep_folder, exist_ok = True)
+            for window in ['chr1_0', 'chr2_0']:
+                window_mat_dict[(cell_group, window)] = rng.random((5, NUM_STATE))
+                prob_matrix.save_prob_df(pd.DataFrame(window_mat_dict[(cell_group, window)], columns = prob_matrix.get_state_colnames(NUM_STATE)), os.path.join(csrep_folder, window + '_avg_pred.txt.gz'), 'txt')
+            with gzip.open(os.path.join(csrep_folder, 'summary_state_track.bed.gz'), 'wt') as outF:
+                outF.write(SUM_TEXT)
+        batch_liftOver.batch_liftOver(map_fn, 'orgDest', org_all_ct_folder, dest_all_ct_folder, cell_group_list, ['multi_logistic'], NUM_STATE, 1, False, 2)
+        output_fn_list = []
+        for cell_group in cell_group_list:
+            group_folder = batch_liftOver.get_group_folder(dest_all_ct_folder, cell_group, 'multi_logistic')
+            # the rows of each chromosome are sorted by their start in the destination assembly, wherever they come from in the original assembly
+            exp_dict = {'2': [('chr2_0', 3, 200), ('chr1_0', 2, 400), ('chr1_0', 3, 600), ('chr1_0', 0, 1000)], '3': [('chr1_0', 1, 0)], '1': []}
+            for chrom, exp_row_list in exp_dict.items():
+                output_fn = os.path.join(group_folder, 'state_assign_matrix', 'chr{}_liftOver_probState.txt.gz'.format(chrom))
+                output_fn_list.append(output_fn)
+                obs_df = pd.read_csv(output_fn, sep = '\t', header = 0)
+                self.assertEqual(list(obs_df['chrom']), ['chr' + chrom] * len(exp_row_list))
+                self.assertEqual(list(obs_df['start']), list(map(lambda x: x[2], exp_row_list)))
+                exp_mat = np.array(list(map(lambda x: window_mat_dict[(cell_group, x[0])][x[1]], exp_row_list))).reshape(-1, NUM_STATE)
+                self.assertTrue(np.allclose(obs_df[prob_matrix.get_state_colnames(NUM_STATE)].values, exp_mat))
+            output_fn = os.path.join(group_folder, 'summary_state_track.bed.gz')
+            output_fn_list.append(output_fn)
+            with gzip.open(output_fn, 'rt') as inF:
+                self.assertEqual(inF.read(), 'chr2\t200\t400\tE3\nchr2\t400\t600\tE1\nchr2\t600\t800\tE2\nchr2\t1000\t1200\tE1\nchr3\t0\t200\tE1\n')
+        # all the outputs are up to date: a second call does not rewrite any of them
+        mtime_list = list(map(lambda x: os.stat(x).st_mtime_ns, output_fn_list))
+        batch_liftOver.batch_liftOver(map_fn, 'orgDest', org_all_ct_folder, dest_all_ct_folder, cell_group_list, ['multi_logistic'], NUM_STATE, 1, False, 2)
+        self.assertEqual(list(map(lambda x: os.stat(x).st_mtime_ns, output_fn_list)), mtime_list)
+        shutil.rmtree(output_folder)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
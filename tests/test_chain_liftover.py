@@ -0,0 +1,73 @@
+import unittest
+import os
+import sys
+import gzip
+import shutil
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts/')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../liftOver_csrep_output/'))) # after scripts/, so that helper is the same module for all the tests
+import chain_liftover
+import mapping_index
+
+# chrA (2000bp, 10 bins) --> chrB (forward strand) and chrC (reverse strand)
+CHAIN_TEXT = '''chain 1000 chrA 2000 + 0 1000 chrB 5000 + 100 1080 1
+200 0 30
+190 40 0
+200 10 0
+360
+
+chain 900 chrA 2000 + 1000 1400 chrC 3000 - 500 900 2
+400
+
+chain 500 chrA 2000 + 1200 1800 chrB 5000 + 1000 1600 3
+600
+
+chain 100 chrA 2000 + 1800 2000 chrB 5000 + 1150 1350 4
+200
+
+'''
+
+class TestChainLiftoverMethods(unittest.TestCase):
+    def test_build_bin_map(self):
+        output_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../testdata/test_chain_liftover'))
+        os.makedirs(output_folder, exist_ok = True)
+        chain_fn = os.path.join(output_folder, 'test.over.chain.gz')
+        with gzip.open(chain_fn, 'wt') as outF:
+            outF.write(CHAIN_TEXT)
+        chrom_length_fn = os.path.join(output_folder, 'chrom_length.bed')
+        with open(chrom_length_fn, 'w') as outF:
+            outF.write('chrA\t0\t2000\n')
+        bin_map = chain_liftover.build_bin_map(chain_fn, chrom_length_fn, 200, 0.95, None)
+        chrom_names = bin_map['chrom_names']
+        mapped_dict = dict(zip(bin_map['org_bin'], zip(chrom_names[bin_map['dest_chrom']], bin_map['dest_start'], bin_map['dest_end'])))
+        # bin 0: aligned, with a gap in chrB before bin 1. bin 1: 190/200 bases aligned (>= 95%), bin 2: 170/200 bases aligned (< 95%)
+        self.assertEqual(mapped_dict[0], ('chrB', 100, 300))
+        self.assertEqual(mapped_dict[1], ('chrB', 330, 520))
+        self.assertNotIn(2, mapped_dict)
+        # bin 3: 190/200 bases aligned, in two blocks (10 bases in chrA between them are not aligned): mapped from the first to the last aligned base
+        self.assertEqual(mapped_dict[3], ('chrB', 690, 880))
+        self.assertEqual(mapped_dict[4], ('chrB', 880, 1080))
+        # bin 5: on the reverse strand of chrC: chrC positions 500 --> 700 on the - strand are 2300 --> 2500 on the + strand
+        self.assertEqual(mapped_dict[5], ('chrC', 2300, 2500))
+        # bin 6 is aligned by two chains (Duplicated), bins 7 and 8 only by chain 3
+        self.assertNotIn(6, mapped_dict)
+        self.assertEqual(mapped_dict[8], ('chrB', 1400, 1600))
+        # bin 9 is mapped onto chrB 1150 --> 1350, which overlaps the mapping of bin 7 (chrB 1200 --> 1400): both are removed
+        self.assertEqual(sorted(mapped_dict.keys()), [0, 1, 3, 4, 5, 8])
+        # only keep the bins mapped onto chrB, and read back the saved index and the text files
+        bin_map = chain_liftover.build_bin_map(chain_fn, chrom_length_fn, 200, 0.95, ['chrB'])
+        bin_map_fn = os.path.join(output_folder, 'bin_map.npz')
+        mapping_index.save_mapping_index(bin_map, bin_map_fn)
+        bin_map = mapping_index.read_mapping_index(bin_map_fn)
+        self.assertEqual(list(bin_map['org_bin']), [0, 1, 3, 4, 8])
+        destOrg_fn, orgDest_fn = os.path.join(output_folder, 'destOrg.bed.gz'), os.path.join(output_folder, 'orgDest.bed.gz')
+        mapping_index.write_text_map(bin_map, destOrg_fn, 'destOrg', 200)
+        mapping_index.write_text_map(bin_map, orgDest_fn, 'orgDest', 200)
+        with gzip.open(orgDest_fn, 'rt') as inF:
+            self.assertEqual(inF.readline(), 'chrA\t0\t200\tchrB_100_300\n')
+        with gzip.open(destOrg_fn, 'rt') as inF:
+            self.assertEqual(inF.readlines()[-1], 'chrB\t1400\t1600\tchrA_1600_1800\n')
+        shutil.rmtree(output_folder)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,50 @@
+import unittest
+import os
+import sys
+import gzip
+import shutil
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts/')))
+import compressed_io
+import helper
+
+
+class TestCompressedIOMethods(unittest.TestCase):
+    def test_open_output(self):
+        output_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../testdata/test_compressed_io'))
+        helper.make_dir(output_folder)
+        fn = os.path.join(output_folder, 'chr22_0_avg_pred.txt.gz')
+        rng = np.random.default_rng(0)
+        df = pd.DataFrame(rng.random((30000, 5)), columns = list(map(lambda x: 'state_' + str(x + 1), range(5)))) # several blocks of compressed_io.BLOCK_SIZE bytes
+        for num_threads in [1, 3]:
+            with compressed_io.open_output(fn, 'wt', 'gzip:1', num_threads) as outF:
+                df.to_csv(outF, header = True, index = False, sep = '\t')
+            # files with one gzip member per block are read as one file by gzip, pandas, and compressed_io
+            with gzip.open(fn, 'rt') as inF:
+                self.assertEqual(inF.read(), df.to_csv(header = True, index = False, sep = '\t'))
+            self.assertTrue(np.allclose(pd.read_csv(fn, header = 0, sep = '\t').values, df.values, rtol = 0, atol = 1e-15))
+            self.assertEqual(compressed_io.read_compressed(fn).decode(), df.to_csv(header = True, index = False, sep = '\t'))
+        # binary data, and empty files
+        with compressed_io.open_output(fn, 'wb', 'gzip:1', 2) as outF:
+            np.save(outF, df.values)
+        self.assertTrue(np.array_equal(np.load(compressed_io.open_input(fn, 'rb')), df.values))
+        with compressed_io.open_output(fn, 'wb', 'gzip', 2) as outF:
+            pass
+        self.assertEqual(gzip.open(fn, 'rb').read(), b'')
+        # the codec is given by the environment variable, and files that are not compressed are read as they are
+        os.environ[compressed_io.CODEC_ENV_VAR] = 'gzip:2'
+        self.assertEqual(compressed_io.parse_codec(compressed_io.get_default_codec()), ('gzip', 2))
+        del os.environ[compressed_io.CODEC_ENV_VAR]
+        with open(fn, 'w') as outF:
+            outF.write('state_1\n0.5\n')
+        self.assertEqual(compressed_io.open_input(fn, 'rt').read(), 'state_1\n0.5\n')
+        with self.assertRaises(AssertionError):
+            compressed_io.parse_codec('bzip2')
+        with self.assertRaises(AssertionError):
+            compressed_io.parse_codec('gzip:10')
+        shutil.rmtree(output_folder)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
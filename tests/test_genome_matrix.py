@@ -0,0 +1,65 @@
+import unittest
+import os
+import sys
+import time
+import shutil
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts/')))
+import genome_matrix
+import prob_matrix
+import calculate_diff_rep_state_map
+import get_summary_map_from_avg_matrix
+import helper
+
+
+class TestGenomeMatrixMethods(unittest.TestCase):
+    num_chromHMM_state = 5
+    def write_avg_folder(self, folder, seed):
+        # windows chr22_0, chr22_1 and chr1_0, in different formats, with runs of identical rows
+        helper.make_dir(folder)
+        colnames = prob_matrix.get_state_colnames(self.num_chromHMM_state)
+        rng = np.random.default_rng(seed)
+        row_mat = rng.dirichlet(np.ones(self.num_chromHMM_state), size = 4).astype(np.float32)
+        prob_df_dict = {}
+        for window, num_bins, prob_file_format in [('chr22_0', 3000, 'txt'), ('chr22_1', 1200, 'rle'), ('chr1_0', 800, 'float16')]:
+            prob_df_dict[window] = pd.DataFrame(row_mat[np.repeat(rng.integers(4, size = num_bins // 100), 100)], columns = colnames)
+            prob_matrix.save_prob_df(prob_df_dict[window], os.path.join(folder, window + '_avg_pred.txt.gz'), prob_file_format)
+        return prob_df_dict
+
+    def test_genome_matrix(self):
+        output_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../testdata/test_genome_matrix'))
+        group1_folder = os.path.join(output_folder, 'group1')
+        group2_folder = os.path.join(output_folder, 'group2')
+        self.write_avg_folder(group1_folder, 0)
+        self.write_avg_folder(group2_folder, 1)
+        self.assertIsNone(genome_matrix.get_genome_matrix(group1_folder, self.num_chromHMM_state))
+        genome_matrix.build_genome_matrix(group1_folder, self.num_chromHMM_state)
+        genome_matrix.build_genome_matrix(group2_folder, self.num_chromHMM_state)
+        this_genome_matrix = genome_matrix.get_genome_matrix(group1_folder, self.num_chromHMM_state)
+        self.assertEqual(this_genome_matrix['chrom']['chr22']['start_row'], [0, 3000])
+        for window in ['chr22_0', 'chr22_1', 'chr1_0']:
+            window_mat = genome_matrix.get_window_mat(this_genome_matrix, window)
+            self.assertIsInstance(window_mat.base, np.memmap) # a view of the memory-mapped array, not a copy
+            self.assertTrue(np.allclose(window_mat, prob_matrix.read_prob_df(os.path.join(group1_folder, window + '_avg_pred.txt.gz'), self.num_chromHMM_state).values, rtol = 0, atol = 1e-7))
+        # the differential scores and the summary segments are the same whether the windows are read from the layout or from their files
+        diff_folder_dict = {}
+        for use_genome_matrix in [False, True]:
+            diff_folder_dict[use_genome_matrix] = os.path.join(output_folder, 'diff_{}'.format(use_genome_matrix))
+            helper.make_dir(diff_folder_dict[use_genome_matrix])
+            genome_matrix_pair = (this_genome_matrix, genome_matrix.get_genome_matrix(group2_folder, self.num_chromHMM_state)) if use_genome_matrix else None
+            calculate_diff_rep_state_map.get_diff_rep_state_one_genomic_region('chr22_1_avg_pred.txt.gz', group1_folder, group2_folder, diff_folder_dict[use_genome_matrix], self.num_chromHMM_state, 'txt', genome_matrix_pair)
+        diff_df_list = list(map(lambda x: prob_matrix.read_prob_df(os.path.join(x, 'chr22_1_avg_pred.txt.gz'), self.num_chromHMM_state), diff_folder_dict.values()))
+        self.assertTrue(np.allclose(diff_df_list[0].values, diff_df_list[1].values, rtol = 0, atol = 1e-7))
+        file_segment_df = get_summary_map_from_avg_matrix.get_max_prob_state_segmentation_one_region(os.path.join(group1_folder, 'chr22_1_avg_pred.txt.gz'), 'chr22_1', self.num_chromHMM_state)
+        layout_segment_df = get_summary_map_from_avg_matrix.get_max_prob_state_segmentation_one_region_from_genome_matrix(this_genome_matrix, 'chr22_1', self.num_chromHMM_state)
+        self.assertTrue(file_segment_df.equals(layout_segment_df))
+        # the layout is not used once a window file is rewritten
+        time.sleep(0.01)
+        prob_matrix.save_prob_df(diff_df_list[0], os.path.join(group1_folder, 'chr22_1_avg_pred.txt.gz'), 'txt')
+        self.assertIsNone(genome_matrix.get_genome_matrix(group1_folder, self.num_chromHMM_state))
+        shutil.rmtree(output_folder)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
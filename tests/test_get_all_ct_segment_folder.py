@@ -0,0 +1,56 @@
+import unittest
+import os
+import sys
+import shutil
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts/')))
+import get_all_ct_segment_folder as seg
+import segment_store
+import helper
+
+
+def write_fake_segment_fn(fn, segment_list):
+    # segment_list: list of (chrom, start_bp, end_bp, state)
+    helper.create_folder_for_file(fn)
+    pd.DataFrame(segment_list).to_csv(fn, header = False, index = False, sep = '\t', compression = 'gzip')
+    return
+
+class TestGetAllCtSegmentMethods(unittest.TestCase):
+    def test_combine_all_ct_segment_folder(self):
+        testdata_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../testdata/'))
+        input_folder = os.path.join(testdata_folder, 'test_raw_segments')
+        output_folder = os.path.join(testdata_folder, 'test_all_ct_segments')
+        helper.make_dir(output_folder)
+        bin_size = helper.NUM_BP_PER_BIN
+        # sample A lists chr2 before chr1, sample B lists chr1 before chr2 and uses state mnenomics. chrY is not in helper.CHROMOSOME_LIST so it is skipped
+        write_fake_segment_fn(os.path.join(input_folder, 'A', 'A_segments.bed.gz'), [('chr2', 0, 2 * bin_size, 'E3'), ('chr2', 2 * bin_size, 3 * bin_size, 'E1'), ('chr1', 0, bin_size, 'E2'), ('chr1', bin_size, 4 * bin_size, 'E18'), ('chrY', 0, bin_size, 'E1')])
+        write_fake_segment_fn(os.path.join(input_folder, 'B', 'B_segments.bed.gz'), [('chr1', 0, 3 * bin_size, 'TssA'), ('chr1', 3 * bin_size, 4 * bin_size, 'Quies'), ('chr2', 0, 3 * bin_size, 'E5')])
+        state_annot_dict = {'TssA': 1, 'Quies': 18}
+        old_chunk_num_rows = seg.STREAM_CHUNK_NUM_ROWS
+        seg.STREAM_CHUNK_NUM_ROWS = 2 # so that chromosomes are split across chunks
+        seg.combine_all_ct_segment_folder(input_folder, output_folder, '_segments.bed.gz', state_annot_dict, 1)
+        seg.STREAM_CHUNK_NUM_ROWS = old_chunk_num_rows
+        self.assertCountEqual(['chr1_0', 'chr2_0'], segment_store.list_windows(output_folder))
+        row_indices = segment_store.get_sample_row_indices(output_folder, ['A', 'B'])
+        obs_chr1 = segment_store.load_window(output_folder, 'chr1_0', row_indices)
+        obs_chr2 = segment_store.load_window(output_folder, 'chr2_0', row_indices)
+        self.assertTrue((obs_chr1 == np.array([[2, 18, 18, 18], [1, 1, 1, 18]])).all())
+        self.assertTrue((obs_chr2 == np.array([[3, 3, 1], [5, 5, 5]])).all())
+        # the samples are listed in sorted order. Existing windows are only kept if they were written with the same samples
+        self.assertEqual(segment_store.read_store_meta(output_folder)['samples'], ['A', 'B'])
+        self.assertEqual(seg.get_redo_existing_files(output_folder, ['A', 'B'], 0), 0)
+        self.assertEqual(seg.get_redo_existing_files(output_folder, ['B', 'A'], 0), 1)
+        self.assertEqual(seg.get_redo_existing_files(output_folder, ['A', 'B', 'C'], 0), 1)
+        # adding a sample rewrites the windows with one row per sample, even if redo_existing_files is 0
+        write_fake_segment_fn(os.path.join(input_folder, 'C', 'C_segments.bed.gz'), [('chr1', 0, 4 * bin_size, 'E7'), ('chr2', 0, 3 * bin_size, 'E8')])
+        seg.combine_all_ct_segment_folder(input_folder, output_folder, '_segments.bed.gz', state_annot_dict, 0)
+        self.assertEqual(segment_store.read_store_meta(output_folder)['samples'], ['A', 'B', 'C'])
+        row_indices = segment_store.get_sample_row_indices(output_folder, ['C', 'A'])
+        self.assertTrue((segment_store.load_window(output_folder, 'chr2_0', row_indices) == np.array([[8, 8, 8], [3, 3, 1]])).all())
+        shutil.rmtree(input_folder)
+        shutil.rmtree(output_folder)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,52 @@
+import unittest
+import os
+import sys
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts/')))
+import get_summary_map_from_avg_matrix as summ
+import helper
+
+
+class TestSummaryMapMethods(unittest.TestCase):
+    def test_get_max_prob_state_runs(self):
+        # max-probability states: [1, 1, 3, 3, 3, 2], the tie at the last bin goes to the first state
+        prob_mat = np.array([[0.6, 0.2, 0.2], [0.5, 0.1, 0.4], [0.1, 0.2, 0.7], [0.2, 0.2, 0.6], [0.3, 0.3, 0.4], [0.1, 0.45, 0.45]])
+        start_bin_index, end_bin_index, run_state = summ.get_max_prob_state_runs(prob_mat, [1, 2, 3])
+        self.assertEqual(list(start_bin_index), [0, 2, 5])
+        self.assertEqual(list(end_bin_index), [2, 5, 6])
+        self.assertEqual(list(run_state), [1, 3, 2])
+        # columns are not necessarily ordered by state
+        start_bin_index, end_bin_index, run_state = summ.get_max_prob_state_runs(prob_mat[:5, [2, 0, 1]], [3, 1, 2])
+        self.assertEqual(list(run_state), [1, 3])
+        return
+
+    def test_get_max_prob_state_runs_from_rle(self):
+        # the same runs as get_max_prob_state_runs on the expanded matrix
+        run_prob_mat = np.array([[0.6, 0.2, 0.2], [0.1, 0.2, 0.7], [0.2, 0.2, 0.6], [0.1, 0.45, 0.45]])
+        run_end_bins = np.array([2, 3, 5, 6])
+        start_bin_index, end_bin_index, run_state = summ.get_max_prob_state_runs_from_rle(run_end_bins, run_prob_mat, [1, 2, 3])
+        self.assertEqual(list(start_bin_index), [0, 2, 5])
+        self.assertEqual(list(end_bin_index), [2, 5, 6])
+        self.assertEqual(list(run_state), [1, 3, 2])
+        return
+
+    def test_merge_runs_across_windows(self):
+        bin_size = helper.NUM_BP_PER_BIN
+        window_size = helper.NUM_BP_PER_WINDOW
+        colnames = ['chrom', 'start_bp', 'end_bp', 'state']
+        region_df_list = [pd.DataFrame([['chr1', 0, bin_size, 'E1'], ['chr1', bin_size, window_size, 'E2']], columns = colnames),
+            pd.DataFrame([['chr1', window_size, window_size + bin_size, 'E2'], ['chr1', window_size + bin_size, window_size + 2 * bin_size, 'E3']], columns = colnames), # first segment continues the last segment of chr1_0
+            pd.DataFrame(columns = colnames), # empty window
+            pd.DataFrame([['chr2', 0, bin_size, 'E3']], columns = colnames)] # same state, but on another chromosome
+        exp_result = [['chr1', 0, bin_size, 'E1'], ['chr1', bin_size, window_size + bin_size, 'E2'], ['chr1', window_size + bin_size, window_size + 2 * bin_size, 'E3'], ['chr2', 0, bin_size, 'E3']]
+        obs_result = pd.concat(list(summ.merge_runs_across_windows(iter(region_df_list))))
+        self.assertEqual(exp_result, obs_result.values.tolist())
+        return
+
+    def test_get_sorted_genome_pos_list(self):
+        self.assertEqual(['chr1_0', 'chr1_2', 'chr1_10', 'chr10_0', 'chr2_0'], summ.get_sorted_genome_pos_list(['chr2_0', 'chr1_10', 'chr10_0', 'chr1_2', 'chr1_0']))
+        return
+
+if __name__ == "__main__":
+    unittest.main()
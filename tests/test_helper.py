@@ -4,26 +4,38 @@ import sys
 sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts/')))
 import helper
 
+def square_job(x):
+    return x * x
+
+def produce_jobs(num_jobs):
+    for x in range(num_jobs):
+        yield (x,)
+
 class TestHelperMethods(unittest.TestCase):
-    def test_partition_file_list(self):
-        data = [1,2,3,4]
-        num_cores = 4
-        exp_result = [[1], [2], [3], [4]]
-        obs_result = helper.partition_file_list(data, num_cores)
-        self.assertCountEqual(exp_result, obs_result)
-        data = [1,2,3]
-        exp_result = [[1], [2], [3], []]
-        obs_result = helper.partition_file_list(data, num_cores)
-        self.assertCountEqual(exp_result, obs_result)
-        data = [1,2]
-        exp_result = [[1], [2], [], []]
-        obs_result = helper.partition_file_list(data, num_cores)
-        self.assertCountEqual(exp_result, obs_result)
-        data = [1,2,3,4,5,6]
-        exp_result = [[1,2], [3,4], [5,6], []]
-        obs_result = helper.partition_file_list(data, num_cores)
-        self.assertCountEqual(exp_result, obs_result)
+    def test_run_weighted_jobs(self):
+        data = [1, 2, 3, 4, 5, 6]
+        weights = [1, 100, 3, 50, 2, 7]
+        exp_result = [1, 4, 9, 16, 25, 36]
+        for num_cores in [1, 4]:
+            obs_result = helper.run_weighted_jobs(square_job, list(map(lambda x: (x,), data)), weights, num_cores)
+            self.assertEqual(exp_result, obs_result) # results are in the order of the input jobs, not the order of execution
+        obs_result = helper.run_weighted_jobs(square_job, [], [], 4)
+        self.assertEqual([], obs_result)
+        return
+
+    def test_run_jobs_as_produced(self):
+        exp_result = [0, 1, 4, 9, 16]
+        for num_cores in [1, 2]:
+            obs_result = helper.run_jobs_as_produced(square_job, produce_jobs(5), num_cores)
+            self.assertEqual(exp_result, obs_result)
+        return
+
+    def test_iterate_jobs_in_order(self):
+        exp_result = [0, 1, 4, 9, 16]
+        for num_cores in [1, 2]:
+            obs_result = list(helper.iterate_jobs_in_order(square_job, list(produce_jobs(5)), num_cores))
+            self.assertEqual(exp_result, obs_result)
         return
 
 if __name__ == "__main__":
-    unittest.main()
\ No newline at end of file
+    unittest.main()
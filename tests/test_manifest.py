@@ -0,0 +1,61 @@
+import unittest
+import os
+import sys
+import shutil
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts/')))
+import manifest
+import helper
+
+
+def write_file(fn, text):
+    with open(fn, 'w') as outF:
+        outF.write(text)
+    return
+
+class TestManifestMethods(unittest.TestCase):
+    def test_atomic_output(self):
+        output_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../testdata/test_manifest_atomic'))
+        helper.make_dir(output_folder)
+        output_fn = os.path.join(output_folder, 'chr22_0_avg_pred.txt.gz')
+        with manifest.atomic_output(output_fn) as temp_fn:
+            self.assertTrue(temp_fn.endswith('chr22_0_avg_pred.txt.gz'))
+            write_file(temp_fn, 'done')
+            self.assertFalse(os.path.isfile(output_fn)) # the file only appears under its final name once it is completely written
+        self.assertEqual(os.listdir(output_folder), ['chr22_0_avg_pred.txt.gz'])
+        # a job that fails in the middle of writing leaves neither a partial file nor a temporary file
+        with self.assertRaises(ValueError):
+            with manifest.atomic_output(os.path.join(output_folder, 'chr22_1_avg_pred.txt.gz')) as temp_fn:
+                write_file(temp_fn, 'partial')
+                raise ValueError
+        self.assertEqual(os.listdir(output_folder), ['chr22_0_avg_pred.txt.gz'])
+        shutil.rmtree(output_folder)
+        return
+
+    def test_find_jobs_to_compute(self):
+        output_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../testdata/test_manifest'))
+        helper.make_dir(output_folder)
+        input_fn_list = list(map(lambda x: os.path.join(output_folder, 'input_{}.txt'.format(x)), range(3)))
+        output_fn_list = list(map(lambda x: os.path.join(output_folder, 'output_{}.txt'.format(x)), range(3)))
+        for fn in input_fn_list + output_fn_list:
+            write_file(fn, fn)
+        params_fingerprint = manifest.get_params_fingerprint({'num_chromHMM_state': 18, 'ct_list': ['E003', 'E008']})
+        self.assertEqual(params_fingerprint, manifest.get_params_fingerprint({'ct_list': ['E003', 'E008'], 'num_chromHMM_state': 18}))
+        job_list = list(map(lambda x: (x, output_fn_list[x], [input_fn_list[x]]), range(3)))
+        self.assertEqual(manifest.find_jobs_to_compute(job_list, params_fingerprint, 0), [0, 1, 2]) # nothing is recorded yet
+        for job, output_fn, job_input_fn_list in job_list:
+            manifest.record_output(output_fn, params_fingerprint, job_input_fn_list)
+        self.assertEqual(manifest.find_jobs_to_compute(job_list, params_fingerprint, 0), [])
+        self.assertEqual(manifest.find_jobs_to_compute(job_list, params_fingerprint, 1), [0, 1, 2])
+        self.assertEqual(manifest.find_jobs_to_compute(job_list, manifest.get_params_fingerprint({'num_chromHMM_state': 15}), 0), [0, 1, 2])
+        write_file(input_fn_list[0], 'a changed input file')
+        write_file(output_fn_list[1], 'an output file that was changed after it was recorded')
+        with open(manifest.get_manifest_fn(output_folder), 'a') as outF:
+            outF.write('\n{"output": "output_2.txt", "par') # a record cut short by a killed job is ignored
+        self.assertEqual(manifest.find_jobs_to_compute(job_list, params_fingerprint, 0), [0, 1])
+        manifest.record_output(output_fn_list[0], params_fingerprint, [input_fn_list[0]]) # the last record of an output file is used
+        self.assertEqual(manifest.find_jobs_to_compute(job_list, params_fingerprint, 0), [1])
+        shutil.rmtree(output_folder)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,59 @@
+import unittest
+import os
+import sys
+import shutil
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts/')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../liftOver_csrep_output/'))) # after scripts/, so that helper is the same module for all the tests
+import mapping_index
+import manifest
+import prob_matrix
+import map_state_assign_matrix
+
+NUM_STATE = 3
+# (org chrom, org bin) --> (dest chrom, dest start). The bins of window chr1_0 are mapped to chr2 and chr3, bin 7 is not in the file of chr1_0 (5 bins), window chr1_1 (bin 50000) has no file
+MAP_LIST = [(0, 0, 1, 1000), (0, 1, 2, 0), (0, 2, 1, 400), (0, 7, 1, 2000), (0, 50000, 2, 800), (1, 3, 1, 200)]
+
+class TestMapStateAssignMatrixMethods(unittest.TestCase):
+    def test_map_assign_matrix_allChrom(self):
+        output_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../testdata/test_map_state_assign_matrix'))
+        csrep_folder, dest_folder = os.path.join(output_folder, 'average_predictions'), os.path.join(output_folder, 'state_assign_matrix')
+        os.makedirs(csrep_folder, exist_ok = True)
+        org_chrom, org_bin, dest_chrom, dest_start = map(np.array, zip(*MAP_LIST))
+        orgDest_fn = os.path.join(output_folder, 'bin_map.npz')
+        mapping_index.save_mapping_index(mapping_index.sort_mapping_index({'org_chrom': org_chrom, 'org_bin': org_bin, 'dest_chrom': dest_chrom, 'dest_start': dest_start, 'dest_end': dest_start + 200, 'chrom_names': ['chr1', 'chr2', 'chr3']}), orgDest_fn)
+        rng = np.random.default_rng(0)
+        window_mat_dict = {}
+        for window in ['chr1_0', 'chr2_0']:
+            window_mat_dict[window] = rng.random((5, NUM_STATE))
+            prob_matrix.save_prob_df(pd.DataFrame(window_mat_dict[window], columns = prob_matrix.get_state_colnames(NUM_STATE)), os.path.join(csrep_folder, window + '_avg_pred.txt.gz'), 'txt')
+        map_state_assign_matrix.map_assign_matrix_allChrom_multiProcess(csrep_folder, orgDest_fn, NUM_STATE, dest_folder, False, 2)
+        # the rows of each chromosome are sorted by their start in the destination assembly, wherever they come from in the original assembly. Bins that are not in any file are left out
+        exp_dict = {'2': [('chr2_0', 3, 200), ('chr1_0', 2, 400), ('chr1_0', 0, 1000)], '3': [('chr1_0', 1, 0)], '1': []}
+        for chrom, exp_row_list in exp_dict.items():
+            obs_df = pd.read_csv(map_state_assign_matrix.get_chrom_output_fn(dest_folder, chrom), sep = '\t', header = 0)
+            self.assertEqual(list(obs_df.columns), ['chrom', 'start', 'end'] + prob_matrix.get_state_colnames(NUM_STATE))
+            self.assertEqual(list(obs_df['chrom']), ['chr' + chrom] * len(exp_row_list))
+            self.assertEqual(list(obs_df['start']), list(map(lambda x: x[2], exp_row_list)))
+            self.assertEqual(list(obs_df['end']), list(map(lambda x: x[2] + 200, exp_row_list)))
+            exp_mat = np.array(list(map(lambda x: window_mat_dict[x[0]][x[1]], exp_row_list))).reshape(-1, NUM_STATE)
+            self.assertTrue(np.allclose(obs_df[prob_matrix.get_state_colnames(NUM_STATE)].values, exp_mat))
+        # the inputs of each output in the manifest: the files of the windows that are mapped to the chromosome and exist, and the mapping
+        manifest_dict = manifest.read_manifest(dest_folder)
+        exp_input_dict = {'2': ['chr1_0', 'chr2_0'], '3': ['chr1_0'], '1': []}
+        for chrom, window_list in exp_input_dict.items():
+            exp_input_fn_list = list(map(lambda x: os.path.join(csrep_folder, x + '_avg_pred.txt.gz'), window_list)) + [orgDest_fn]
+            self.assertEqual(sorted(manifest_dict[os.path.basename(map_state_assign_matrix.get_chrom_output_fn(dest_folder, chrom))]['inputs'].keys()), sorted(exp_input_fn_list))
+        # the outputs are up to date, until a window file that they are mapped from is rewritten
+        orgDest_index = mapping_index.read_mapping_index(orgDest_fn)
+        dest_offsets_dict = map_state_assign_matrix.get_dest_offsets_dict(orgDest_index)
+        self.assertEqual(map_state_assign_matrix.get_map_jobs_one_group(csrep_folder, orgDest_fn, orgDest_index, dest_offsets_dict, NUM_STATE, dest_folder, False)[0], [])
+        prob_matrix.save_prob_df(pd.DataFrame(window_mat_dict['chr2_0'][:4], columns = prob_matrix.get_state_colnames(NUM_STATE)), os.path.join(csrep_folder, 'chr2_0_avg_pred.txt.gz'), 'txt')
+        job_list = map_state_assign_matrix.get_map_jobs_one_group(csrep_folder, orgDest_fn, orgDest_index, dest_offsets_dict, NUM_STATE, dest_folder, False)[0]
+        self.assertEqual(list(map(lambda x: x[1], job_list)), ['2'])
+        shutil.rmtree(output_folder)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,45 @@
+import unittest
+import os
+import sys
+import gzip
+import shutil
+import numpy as np
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts/')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../liftOver_csrep_output/'))) # after scripts/, so that helper is the same module for all the tests
+import mapping_index
+import map_summary_chromatin_state_map
+
+# the summary chromatin state map of chrA (2000bp, 10 bins) in the ucsc genome browser format. Bin 5 (1000 --> 1200) overlaps 2 segments, bin 9 does not overlap any segment
+SUM_TEXT = '''track name=test
+chrA\t600\t1100\tE2
+chrA\t0\t600\tE1
+chrA\t1100\t1800\tE3
+chrZ\t0\t5000\tE1
+'''
+
+class TestMapSummaryChromatinStateMapMethods(unittest.TestCase):
+    def test_map_summary_chromatin_state_map(self):
+        output_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../testdata/test_map_summary_chromatin_state_map'))
+        os.makedirs(output_folder, exist_ok = True)
+        sum_fn = os.path.join(output_folder, 'summary_state_track.bed.gz')
+        with gzip.open(sum_fn, 'wt') as outF:
+            outF.write(SUM_TEXT)
+        # bin --> (dest chrom, dest start): bins 0, 1, 2 are mapped next to each other, there is a gap in chrB before bin 3, bin 6 is mapped to chrC
+        dest_dict = {0: (0, 100), 1: (0, 300), 2: (0, 500), 3: (0, 800), 4: (0, 1000), 5: (0, 1200), 6: (1, 0), 7: (0, 1400), 8: (0, 0), 9: (1, 200)}
+        org_bin = np.arange(10)
+        dest_chrom = np.array(list(map(lambda x: dest_dict[x][0], org_bin))) + 1
+        dest_start = np.array(list(map(lambda x: dest_dict[x][1], org_bin)))
+        dest_end = dest_start + 200
+        dest_end[8] = 100
+        map_index = mapping_index.sort_mapping_index({'org_chrom': np.zeros(10, dtype = int), 'org_bin': org_bin, 'dest_chrom': dest_chrom, 'dest_start': dest_start, 'dest_end': dest_end, 'chrom_names': ['chrA', 'chrB', 'chrC']})
+        output_fn = os.path.join(output_folder, 'dest_summary_state_track.bed.gz')
+        map_summary_chromatin_state_map.map_summary_chromatin_state_map(sum_fn, map_index, output_fn, 1)
+        with gzip.open(output_fn, 'rt') as inF:
+            segment_list = list(map(lambda x: x.rstrip('\n').split('\t'), inF.readlines()))
+        # consecutive bins of the same state are combined, bin 5 gets both states (as bedtools map -o collapse), bin 9 is left out
+        self.assertEqual(segment_list, [['chrB', '0', '100', 'E3'], ['chrB', '100', '700', 'E1'], ['chrB', '800', '1200', 'E2'], ['chrB', '1200', '1400', 'E2,E3'], ['chrB', '1400', '1600', 'E3'], ['chrC', '0', '200', 'E3']])
+        shutil.rmtree(output_folder)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,75 @@
+import unittest
+import os
+import sys
+import shutil
+import numpy as np
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts/')))
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '../liftOver_csrep_output/'))) # after scripts/, so that helper is the same module for all the tests
+import mapping_index
+import manifest
+
+
+class TestMappingIndexMethods(unittest.TestCase):
+    def get_test_index(self):
+        # bins of chr1 and chr2 (org), mapped to chr1, chr2 and chr3_random_alt (dest), in any order
+        rng = np.random.default_rng(0)
+        org_chrom = np.repeat([0, 1], [600, 400])
+        org_bin = np.concatenate([rng.choice(120000, 600, replace = False), rng.choice(60000, 400, replace = False)])
+        dest_chrom = rng.integers(3, size = 1000)
+        dest_start = rng.choice(10000000, 1000, replace = False) * 10
+        unsorted_index = {'org_chrom': org_chrom, 'org_bin': org_bin, 'dest_chrom': dest_chrom, 'dest_start': dest_start, 'dest_end': dest_start + 200, 'chrom_names': ['chr1', 'chr2', 'chr3_random_alt']}
+        return mapping_index.sort_mapping_index(unsorted_index)
+
+    def test_text_map(self):
+        output_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../testdata/test_mapping_index'))
+        os.makedirs(output_folder, exist_ok = True)
+        this_index = self.get_test_index()
+        # the index is the same after it is written into the text files of the older pipeline and read back
+        for map_format in mapping_index.MAP_FORMAT_LIST:
+            map_fn = os.path.join(output_folder, '{}.bed.gz'.format(map_format))
+            mapping_index.write_text_map(this_index, map_fn, map_format)
+            read_index = mapping_index.get_mapping_index(map_fn, map_format)
+            for key in this_index:
+                self.assertTrue(np.array_equal(read_index[key], this_index[key]), '{} {}'.format(map_format, key))
+            # the index of the text file is saved next to it, and recorded in the manifest
+            self.assertIn(os.path.basename(mapping_index.get_index_fn(map_fn)), manifest.read_manifest(output_folder))
+        shutil.rmtree(output_folder)
+        return
+
+    def test_org_window_slice(self):
+        this_index = self.get_test_index()
+        for chrom, chrom_code in [('chr1', 0), ('chr2', 1), ('chrX', -1)]:
+            chrom_index = mapping_index.get_org_chrom_index(this_index, chrom)
+            self.assertTrue(np.all(chrom_index['org_chrom'] == chrom_code))
+            self.assertEqual(len(chrom_index['org_bin']), np.sum(this_index['org_chrom'] == chrom_code))
+            for window_index in range(3):
+                window_slice = mapping_index.get_org_window_slice(chrom_index, chrom, window_index, 50000)
+                window_org_bin = chrom_index['org_bin'][window_slice]
+                self.assertTrue(np.all((window_org_bin >= window_index * 50000) & (window_org_bin < (window_index + 1) * 50000)))
+                self.assertEqual(len(window_org_bin), np.sum((chrom_index['org_bin'] // 50000) == window_index))
+        return
+
+    def test_shared_mapping_index(self):
+        this_index = self.get_test_index()
+        shm_list, shared_index_desc = mapping_index.share_mapping_index(this_index)
+        try:
+            worker_shm_list, shared_index = mapping_index.attach_mapping_index(shared_index_desc)
+            for key in this_index:
+                self.assertTrue(np.array_equal(shared_index[key], this_index[key]), key)
+            # the entries of each chromosome of the destination assembly, sorted by their start
+            for chrom, (start, end) in mapping_index.get_dest_chrom_offsets(shared_index).items():
+                entry_index = shared_index['dest_order'][start:end]
+                self.assertTrue(np.all(shared_index['chrom_names'][shared_index['dest_chrom'][entry_index]] == chrom))
+                self.assertEqual(end - start, np.sum(this_index['chrom_names'][this_index['dest_chrom']] == chrom))
+                self.assertTrue(np.all(np.diff(shared_index['dest_start'][entry_index]) > 0))
+            del shared_index, entry_index
+            for shm in worker_shm_list:
+                shm.close()
+        finally:
+            for shm in shm_list:
+                shm.close()
+                shm.unlink()
+        return
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,51 @@
+import unittest
+import os
+import sys
+import shutil
+import numpy as np
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts/')))
+import model_store
+import train_multiLog_auto1Hot as multiLog
+import helper
+
+
+class TestModelStoreMethods(unittest.TestCase):
+    def test_save_load_model(self):
+        testdata_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../testdata/'))
+        output_folder = os.path.join(testdata_folder, 'test_model_store')
+        helper.make_dir(output_folder)
+        num_chromHMM_state = 4
+        train_cell_types = ['E003', 'E008']
+        rng = np.random.default_rng(0)
+        X = rng.integers(1, num_chromHMM_state + 1, size = (300, len(train_cell_types)))
+        Y = rng.integers(1, num_chromHMM_state + 1, size = 300)
+        regression_machine = multiLog.train_multinomial_logistic_regression(multiLog.get_predictorX_segmentation_data(train_cell_types, num_chromHMM_state, X), Y, num_chromHMM_state, 0)
+        # the training data files of the model
+        for ct in train_cell_types + ['E014']:
+            with open(multiLog.get_train_data_fn(output_folder, ct), 'w') as outF:
+                outF.write(ct + '\n')
+        train_fingerprint = multiLog.get_train_fingerprint(output_folder, train_cell_types, 'E014', 0, 1)
+        model_fn = model_store.get_model_fn(output_folder, 'E014')
+        model_store.save_model(model_fn, regression_machine, train_cell_types, 'E014', num_chromHMM_state, 0, 1, train_fingerprint)
+        loaded_machine, model_meta = model_store.load_model(model_fn)
+        self.assertEqual(model_meta, {'train_cell_types': train_cell_types, 'response_ct': 'E014', 'num_chromHMM_state': num_chromHMM_state, 'seed': 0, 'train_from_pattern_counts': 1, 'train_fingerprint': train_fingerprint})
+        # the loaded model predicts exactly the same probabilities
+        code_mat = rng.integers(1, num_chromHMM_state + 1, size = (len(train_cell_types), 500))
+        exp_df = multiLog.get_response_prob_df(code_mat, train_cell_types, num_chromHMM_state, regression_machine, {})
+        obs_df = multiLog.get_response_prob_df(code_mat, train_cell_types, num_chromHMM_state, loaded_machine, {})
+        self.assertTrue((exp_df.values == obs_df.values).all())
+        # the model is only reused if it was trained with the same samples, number of states, seed, train_from_pattern_counts and training data
+        self.assertIsNotNone(model_store.load_model_if_matching(model_fn, train_cell_types, num_chromHMM_state, train_fingerprint))
+        self.assertIsNone(model_store.load_model_if_matching(model_fn, ['E003', 'E015'], num_chromHMM_state, train_fingerprint))
+        self.assertIsNone(model_store.load_model_if_matching(model_fn, train_cell_types, 5, train_fingerprint))
+        self.assertIsNone(model_store.load_model_if_matching(model_store.get_model_fn(output_folder, 'E015'), train_cell_types, num_chromHMM_state, train_fingerprint))
+        self.assertIsNone(model_store.load_model_if_matching(model_fn, train_cell_types, num_chromHMM_state, multiLog.get_train_fingerprint(output_folder, train_cell_types, 'E014', 1, 1)))
+        self.assertIsNone(model_store.load_model_if_matching(model_fn, train_cell_types, num_chromHMM_state, multiLog.get_train_fingerprint(output_folder, train_cell_types, 'E014', 0, 0)))
+        with open(multiLog.get_train_data_fn(output_folder, 'E008'), 'w') as outF: # the training data of one sample are re-sampled
+            outF.write('E008\nE008\n')
+        self.assertIsNone(model_store.load_model_if_matching(model_fn, train_cell_types, num_chromHMM_state, multiLog.get_train_fingerprint(output_folder, train_cell_types, 'E014', 0, 1)))
+        shutil.rmtree(output_folder)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,80 @@
+import unittest
+import os
+import sys
+import shutil
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts/')))
+import prob_matrix
+import helper
+
+
+class TestProbMatrixMethods(unittest.TestCase):
+    num_chromHMM_state = 5
+    def test_save_read_prob_df(self):
+        output_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../testdata/test_prob_matrix'))
+        helper.make_dir(output_folder)
+        colnames = prob_matrix.get_state_colnames(self.num_chromHMM_state)
+        rng = np.random.default_rng(0)
+        prob_df = pd.DataFrame(rng.dirichlet(np.ones(self.num_chromHMM_state), size = 1000), columns = colnames)
+        diff_df = prob_df - pd.DataFrame(rng.dirichlet(np.ones(self.num_chromHMM_state), size = 1000), columns = colnames)
+        # the error bounds documented in prob_matrix.py, for probabilities and for differential scores
+        max_error_dict = {'txt': 1e-15, 'float16': 2.0 ** -12, 'uint8': 1.0 / 510, 'rle': 0}
+        for prob_file_format in prob_matrix.PROB_FILE_FORMAT_LIST:
+            fn = os.path.join(output_folder, 'chr22_0_avg_pred.txt.gz')
+            prob_matrix.save_prob_df(prob_df, fn, prob_file_format)
+            obs_df = prob_matrix.read_prob_df(fn, self.num_chromHMM_state)
+            self.assertEqual(list(obs_df.columns), colnames)
+            self.assertLessEqual(np.abs(obs_df.values - prob_df.values).max(), max_error_dict[prob_file_format] + 1e-12)
+            prob_matrix.save_prob_df(diff_df, fn, prob_file_format, index = True)
+            obs_df = prob_matrix.read_prob_df(fn, self.num_chromHMM_state)
+            self.assertEqual(list(obs_df.columns), colnames)
+            self.assertEqual(list(obs_df.index), list(range(diff_df.shape[0])))
+            max_error = 1.0 / 254 if prob_file_format == 'uint8' else max_error_dict[prob_file_format]
+            self.assertLessEqual(np.abs(obs_df.values - diff_df.values).max(), max_error + 1e-12)
+            # the number of states is checked in all formats
+            with self.assertRaises(AssertionError):
+                prob_matrix.read_prob_df(fn, self.num_chromHMM_state + 1)
+        # the binary formats are smaller than the text format
+        size_dict = {}
+        for prob_file_format in prob_matrix.PROB_FILE_FORMAT_LIST:
+            fn = os.path.join(output_folder, prob_file_format + '_avg_pred.txt.gz')
+            prob_matrix.save_prob_df(prob_df, fn, prob_file_format)
+            size_dict[prob_file_format] = os.path.getsize(fn)
+        self.assertLess(size_dict['float16'], size_dict['txt'])
+        self.assertLess(size_dict['uint8'], size_dict['float16'])
+        shutil.rmtree(output_folder)
+        return
+
+    def test_rle_prob_mat(self):
+        output_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../testdata/test_prob_matrix_rle'))
+        helper.make_dir(output_folder)
+        rng = np.random.default_rng(1)
+        # runs of identical rows, as in the predictions of windows where many bins have the same states in the predictor samples
+        row_mat = rng.dirichlet(np.ones(self.num_chromHMM_state), size = 6)
+        prob_mat = row_mat[[0, 0, 0, 1, 2, 2, 0, 3, 3, 3, 3, 4, 5, 5]]
+        run_end_bins, run_prob_mat = prob_matrix.get_rle_prob_mat(prob_mat)
+        self.assertEqual(list(run_end_bins), [3, 4, 6, 7, 11, 12, 14])
+        self.assertTrue((prob_matrix.expand_rle_prob_mat(run_end_bins, run_prob_mat) == prob_mat).all())
+        self.assertTrue((prob_matrix.gather_rle_rows(run_end_bins, run_prob_mat, [13, 0, 3, 6, 2]) == prob_mat[[13, 0, 3, 6, 2]]).all())
+        # two matrices with different runs are cut into the same runs, so that they can be subtracted run by run
+        other_prob_mat = row_mat[[1] * 5 + [2] * 9]
+        aligned_run_end_bins, (aligned_mat, other_aligned_mat) = prob_matrix.align_rle_prob_mats([(run_end_bins, run_prob_mat), prob_matrix.get_rle_prob_mat(other_prob_mat)])
+        self.assertEqual(list(aligned_run_end_bins), [3, 4, 5, 6, 7, 11, 12, 14])
+        self.assertTrue((prob_matrix.expand_rle_prob_mat(aligned_run_end_bins, aligned_mat - other_aligned_mat) == prob_mat - other_prob_mat).all())
+        # files in any format are read as runs, and the runs cut by align_rle_prob_mats are merged back when they are written
+        fn = os.path.join(output_folder, 'chr22_0_avg_pred.txt.gz')
+        for prob_file_format in prob_matrix.PROB_FILE_FORMAT_LIST:
+            prob_matrix.save_rle_prob_mat(aligned_run_end_bins, aligned_mat, fn, prob_file_format)
+            obs_run_end_bins, obs_run_prob_mat = prob_matrix.read_rle_prob_mat(fn, self.num_chromHMM_state)
+            self.assertEqual(list(obs_run_end_bins), list(run_end_bins))
+            self.assertTrue(np.allclose(obs_run_prob_mat, run_prob_mat, rtol = 0, atol = 2.0 ** -12 if prob_file_format == 'float16' else 1.0 / 510))
+        # windows without bins
+        empty_rle_mat = prob_matrix.get_rle_prob_mat(np.zeros((0, self.num_chromHMM_state)))
+        self.assertEqual(len(empty_rle_mat[0]), 0)
+        self.assertEqual(len(prob_matrix.align_rle_prob_mats([empty_rle_mat, empty_rle_mat])[0]), 0)
+        shutil.rmtree(output_folder)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,72 @@
+import unittest
+import os
+import sys
+import time
+import shutil
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts/')))
+import region_index
+import prob_matrix
+import manifest
+import helper
+
+
+class TestRegionIndexMethods(unittest.TestCase):
+    num_chromHMM_state = 5
+    def test_query_region(self):
+        output_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../testdata/test_region_index'))
+        cache_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../testdata/test_region_index_cache'))
+        helper.make_dir(output_folder)
+        old_cache_dir = os.environ.get(region_index.CACHE_DIR_ENV_VAR)
+        os.environ[region_index.CACHE_DIR_ENV_VAR] = cache_dir
+        colnames = prob_matrix.get_state_colnames(self.num_chromHMM_state)
+        rng = np.random.default_rng(0)
+        # two consecutive windows of chr22 (the second one is shorter, as at the end of a chromosome), written in different formats
+        prob_df_dict = {'chr22_0': pd.DataFrame(rng.dirichlet(np.ones(self.num_chromHMM_state), size = helper.NUM_BIN_PER_WINDOW), columns = colnames),
+                        'chr22_1': pd.DataFrame(rng.dirichlet(np.ones(self.num_chromHMM_state), size = 1500), columns = colnames)}
+        prob_matrix.save_prob_df(prob_df_dict['chr22_0'], os.path.join(output_folder, 'chr22_0' + region_index.AVG_FILE_SUFFIX), 'txt')
+        prob_matrix.save_prob_df(prob_df_dict['chr22_1'], os.path.join(output_folder, 'chr22_1' + region_index.AVG_FILE_SUFFIX), 'rle')
+        this_region_index = region_index.get_region_index(output_folder, self.num_chromHMM_state)
+        # an interval across the two windows, starting and ending in the middle of bins
+        chrom, start_bp, end_bp = region_index.parse_region('chr22:9,999,750-10,000,450')
+        self.assertEqual((chrom, start_bp, end_bp), ('chr22', 9999750, 10000450))
+        bin_start_bp, bin_end_bp, prob_mat = region_index.query_region(this_region_index, chrom, start_bp, end_bp)
+        self.assertEqual(list(bin_start_bp), [9999600, 9999800, 10000000, 10000200, 10000400])
+        self.assertEqual(list(bin_end_bp), [9999800, 10000000, 10000200, 10000400, 10000600])
+        exp_mat = np.concatenate([prob_df_dict['chr22_0'].values[-2:], prob_df_dict['chr22_1'].values[:3]])
+        self.assertTrue(np.allclose(prob_mat, exp_mat, rtol = 0, atol = 1e-7))
+        # intervals past the end of the chromosome, or on chromosomes without windows
+        self.assertEqual(len(region_index.query_region(this_region_index, 'chr22', 11000000, 12000000)[0]), 0)
+        self.assertEqual(len(region_index.query_region(this_region_index, 'chr1', 0, 1000)[0]), 0)
+        with self.assertRaises(ValueError):
+            region_index.parse_region('chr22:1000')
+        # the index is rebuilt when a window is recalculated
+        time.sleep(0.01)
+        new_prob_df = pd.DataFrame(rng.dirichlet(np.ones(self.num_chromHMM_state), size = 1500), columns = colnames)
+        prob_matrix.save_prob_df(new_prob_df, os.path.join(output_folder, 'chr22_1' + region_index.AVG_FILE_SUFFIX), 'float16')
+        this_region_index = region_index.get_region_index(output_folder, self.num_chromHMM_state)
+        prob_mat = region_index.query_region(this_region_index, 'chr22', 10000000, 10000200)[2]
+        self.assertTrue(np.allclose(prob_mat, new_prob_df.values[:1], rtol = 0, atol = 2.0 ** -12))
+        # the index is written into the cache, not into the output folder
+        self.assertIn(region_index.REGION_INDEX_META_FN, manifest.read_manifest(region_index.get_index_folder(output_folder)))
+        self.assertEqual(sorted(os.listdir(output_folder)), ['chr22_0' + region_index.AVG_FILE_SUFFIX, 'chr22_1' + region_index.AVG_FILE_SUFFIX])
+        # if the index cannot be written (here, the cache is under a file), the queries read the windows and give the same results
+        exp_result = region_index.query_region(this_region_index, chrom, start_bp, end_bp)
+        os.environ[region_index.CACHE_DIR_ENV_VAR] = os.path.join(output_folder, 'chr22_0' + region_index.AVG_FILE_SUFFIX, 'cache')
+        window_region_index = region_index.get_region_index(output_folder, self.num_chromHMM_state)
+        self.assertIsNone(window_region_index['data_fn'])
+        obs_result = region_index.query_region(window_region_index, chrom, start_bp, end_bp)
+        self.assertEqual(list(obs_result[0]), list(exp_result[0]))
+        self.assertTrue(np.array_equal(obs_result[2], exp_result[2]))
+        self.assertEqual(len(region_index.query_region(window_region_index, 'chr22', 11000000, 12000000)[0]), 0)
+        if old_cache_dir is None:
+            del os.environ[region_index.CACHE_DIR_ENV_VAR]
+        else:
+            os.environ[region_index.CACHE_DIR_ENV_VAR] = old_cache_dir
+        shutil.rmtree(output_folder)
+        shutil.rmtree(cache_dir)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,73 @@
+import unittest
+import os
+import sys
+import time
+import shutil
+import threading
+import numpy as np
+import pandas as pd
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts/')))
+import region_server
+import prob_matrix
+import helper
+
+
+class DeletedWindowCache(region_server.WindowCache):
+    def get_window(self, window_fn):
+        os.remove(window_fn)
+        return region_server.WindowCache.get_window(self, window_fn)
+
+class TestRegionServerMethods(unittest.TestCase):
+    num_chromHMM_state = 4
+    def test_region_server(self):
+        all_cg_out_dir = os.path.abspath(os.path.join(os.path.dirname(__file__), '../testdata/test_region_server'))
+        folder = os.path.join(all_cg_out_dir, 'ESC', 'CSREP', 'representative_data', 'average_predictions')
+        helper.make_dir(folder)
+        colnames = prob_matrix.get_state_colnames(self.num_chromHMM_state)
+        # runs of identical rows, across the border of the windows chr22_0 and chr22_1. Window chr22_3 is missing
+        row_mat = np.array([[0.7, 0.1, 0.1, 0.1], [0.1, 0.6, 0.2, 0.1], [0.05, 0.05, 0.1, 0.8]])
+        prob_mat_dict = {0: row_mat[[0] * (helper.NUM_BIN_PER_WINDOW - 3) + [1] * 3], 1: row_mat[[1] * 2 + [2] * (helper.NUM_BIN_PER_WINDOW - 2)], 2: row_mat[[2] * helper.NUM_BIN_PER_WINDOW], 4: row_mat[[0] * 100]}
+        for window_index, prob_mat in prob_mat_dict.items():
+            prob_matrix.save_prob_df(pd.DataFrame(prob_mat, columns = colnames), os.path.join(folder, 'chr22_{}_avg_pred.txt.gz'.format(window_index)), 'rle' if window_index % 2 else 'txt')
+        window_cache = region_server.WindowCache(self.num_chromHMM_state, 10 ** 6)
+        server = region_server.RegionServer(0, window_cache, all_cg_out_dir, '_avg_pred.txt.gz') # port 0: any free port
+        port = server.server_address[1]
+        server_thread = threading.Thread(target = server.serve_forever, daemon = True)
+        server_thread.start()
+        region = 'chr22:{}-{}'.format(helper.NUM_BP_PER_WINDOW - 900, helper.NUM_BP_PER_WINDOW + 450) # partial bins at both ends
+        answer = region_server.send_request({'query': 'interval', 'region': region, 'group': 'ESC'}, port = port)
+        exp_start = list(range(helper.NUM_BP_PER_WINDOW - 1000, helper.NUM_BP_PER_WINDOW + 600, helper.NUM_BP_PER_BIN))
+        self.assertEqual(answer['start'], exp_start)
+        self.assertEqual(answer['end'], list(map(lambda x: x + helper.NUM_BP_PER_BIN, exp_start)))
+        self.assertTrue(np.allclose(answer['prob'], row_mat[[0, 0, 1, 1, 1, 1, 1, 2]], atol = 1e-7))
+        # the summary segments and state maxima, in one batch request. Segments are not merged across the missing window chr22_3
+        region = 'chr22:{}-{}'.format(helper.NUM_BP_PER_WINDOW - 900, 4 * helper.NUM_BP_PER_WINDOW + 1000)
+        answer = region_server.send_request({'batch': [{'query': 'summary', 'region': region, 'folder': folder}, {'query': 'state_max', 'region': region, 'group': 'ESC', 'mode': 'CSREP'}, {'query': 'state_max', 'region': 'chr22:1'}]}, port = port)
+        summary_answer, state_max_answer, error_answer = answer['results']
+        self.assertEqual(summary_answer['state'], ['E1', 'E2', 'E4', 'E1'])
+        self.assertEqual(summary_answer['start'], [helper.NUM_BP_PER_WINDOW - 1000, helper.NUM_BP_PER_WINDOW - 600, helper.NUM_BP_PER_WINDOW + 400, 4 * helper.NUM_BP_PER_WINDOW])
+        self.assertEqual(summary_answer['end'], [helper.NUM_BP_PER_WINDOW - 600, helper.NUM_BP_PER_WINDOW + 400, 3 * helper.NUM_BP_PER_WINDOW, 4 * helper.NUM_BP_PER_WINDOW + 1000])
+        self.assertTrue(np.allclose(state_max_answer['max'], row_mat.max(axis = 0), atol = 1e-7))
+        self.assertEqual(state_max_answer['max_start'], [helper.NUM_BP_PER_WINDOW - 1000, helper.NUM_BP_PER_WINDOW - 600, helper.NUM_BP_PER_WINDOW - 600, helper.NUM_BP_PER_WINDOW + 400])
+        self.assertIn('error', error_answer)
+        # the least recently used windows are dropped to stay within the memory budget, and windows whose files changed are read again
+        self.assertEqual(len(window_cache.window_dict), 4)
+        window_cache.memory_budget_bytes = 0
+        window_cache.remove_window(os.path.join(folder, 'chr22_4_avg_pred.txt.gz'))
+        window_cache.get_window(os.path.join(folder, 'chr22_4_avg_pred.txt.gz'))
+        self.assertEqual(list(window_cache.window_dict.keys()), [os.path.join(folder, 'chr22_4_avg_pred.txt.gz')])
+        time.sleep(0.01)
+        prob_matrix.save_prob_df(pd.DataFrame(row_mat[[1] * 100], columns = colnames), os.path.join(folder, 'chr22_4_avg_pred.txt.gz'), 'txt')
+        answer = region_server.send_request({'query': 'summary', 'region': 'chr22:{}-{}'.format(4 * helper.NUM_BP_PER_WINDOW, 5 * helper.NUM_BP_PER_WINDOW), 'group': 'ESC'}, port = port)
+        self.assertEqual(answer['state'], ['E2'])
+        self.assertEqual(answer['end'], [4 * helper.NUM_BP_PER_WINDOW + 100 * helper.NUM_BP_PER_BIN])
+        server.shutdown()
+        server.server_close()
+        # a window file deleted between the listing of the folder and its reading is answered with an error
+        answer = region_server.answer_request({'query': 'summary', 'region': 'chr22:0-1000', 'group': 'ESC'}, DeletedWindowCache(self.num_chromHMM_state, 10 ** 6), all_cg_out_dir, '_avg_pred.txt.gz')
+        self.assertTrue(answer['error'].startswith('FileNotFoundError'))
+        shutil.rmtree(all_cg_out_dir)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
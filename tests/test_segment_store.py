@@ -0,0 +1,36 @@
+import unittest
+import os
+import sys
+import shutil
+import numpy as np
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts/')))
+import segment_store
+import helper
+
+
+class TestSegmentStoreMethods(unittest.TestCase):
+    def test_save_load_window(self):
+        testdata_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../testdata/'))
+        segment_folder = os.path.join(testdata_folder, 'test_segment_store')
+        helper.make_dir(segment_folder)
+        sample_list = ['E003', 'E008', 'E014']
+        code_mat_0 = np.array([[1, 1, 2, 18], [3, 3, 3, 0], [18, 17, 16, 15]])
+        code_mat_1 = np.array([[5], [6], [7]])
+        segment_store.save_window(segment_folder, 'chr22_0', code_mat_0)
+        segment_store.save_window(segment_folder, 'chr22_1', code_mat_1)
+        meta = segment_store.write_store_meta(segment_folder, sample_list)
+        self.assertCountEqual(['chr22_0', 'chr22_1'], segment_store.list_windows(segment_folder))
+        self.assertEqual(sample_list, segment_store.read_store_meta(segment_folder)['samples'])
+        self.assertEqual(meta['windows']['chr22_1'], {'chrom': 'chr22', 'start_bp': helper.NUM_BP_PER_WINDOW, 'end_bp': helper.NUM_BP_PER_WINDOW + helper.NUM_BP_PER_BIN, 'num_bins': 1})
+        obs_mat = segment_store.load_window(segment_folder, 'chr22_0')
+        self.assertEqual(obs_mat.dtype, np.uint8)
+        self.assertTrue((obs_mat == code_mat_0).all())
+        row_indices = segment_store.get_sample_row_indices(segment_folder, ['E014', 'E003'])
+        self.assertEqual(list(row_indices), [2, 0])
+        obs_mat = segment_store.load_window(segment_folder, 'chr22_0', row_indices)
+        self.assertTrue((obs_mat == code_mat_0[[2, 0], :]).all())
+        shutil.rmtree(segment_folder)
+        return
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,34 @@
+import unittest
+import os
+import sys
+import numpy as np
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts/')))
+import train_baseline_model as baseline
+
+
+class TestBaselineMethods(unittest.TestCase):
+    def test_get_state_count_matrix(self):
+        num_chromHMM_state = 2
+        code_mat = np.array([[1, 2], [1, 0]], dtype = np.uint8)
+        exp_result = np.array([[2, 0], [0, 1]])
+        obs_result = baseline.get_state_count_matrix(code_mat, num_chromHMM_state)
+        self.assertTrue((exp_result == obs_result).all())
+        return
+
+    def test_predict_baseline_segmentation(self):
+        num_chromHMM_state = 5
+        rng = np.random.default_rng(0)
+        code_mat = rng.integers(0, num_chromHMM_state + 1, size = (7, 1000)).astype(np.uint8) # 0: no state assigned
+        # the fraction of cell types that are in each state at each bin
+        exp_result = np.zeros((code_mat.shape[1], num_chromHMM_state))
+        for bin_index in range(code_mat.shape[1]):
+            for ct_index in range(code_mat.shape[0]):
+                if code_mat[ct_index, bin_index] != 0:
+                    exp_result[bin_index, code_mat[ct_index, bin_index] - 1] += 1.0 / code_mat.shape[0]
+        obs_df = baseline.predict_baseline_segmentation(code_mat, num_chromHMM_state)
+        self.assertEqual(list(obs_df.columns), ['state_1', 'state_2', 'state_3', 'state_4', 'state_5'])
+        self.assertTrue(np.allclose(exp_result, obs_df.values))
+        return
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,117 @@
+import unittest
+import os
+import sys
+import shutil
+import numpy as np
+import pandas as pd
+from sklearn.linear_model import LogisticRegression
+from sklearn.preprocessing import OneHotEncoder
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts/')))
+import train_multiLog_auto1Hot as multiLog
+import segment_store
+import model_store
+import helper
+
+
+def get_fake_training_data(num_chromHMM_state, train_cell_types, num_bins, seed):
+    # the response sample's state is the state of the first predictor sample most of the time, otherwise random
+    rng = np.random.default_rng(seed)
+    code_mat = rng.integers(1, num_chromHMM_state + 1, size = (len(train_cell_types), num_bins))
+    code_mat[:, : num_bins // 2] = 1 # half of the bins share the same pattern, like quiescent regions
+    Y = np.where(rng.random(num_bins) < 0.7, code_mat[0], rng.integers(1, num_chromHMM_state + 1, size = num_bins))
+    return code_mat, Y
+
+class TestMultiLogMethods(unittest.TestCase):
+    num_chromHMM_state = 4
+    train_cell_types = ['E003', 'E008', 'E014']
+
+    def test_get_predictorX_segmentation_data(self):
+        self.assertTrue((multiLog.get_oneHot_column_indices(np.array([[1, 2], [0, 1]]), 2) == np.array([[0, 3], [-1, 2]])).all())
+        rng = np.random.default_rng(0)
+        pattern_mat = rng.integers(0, self.num_chromHMM_state + 1, size = (500, len(self.train_cell_types))) # 0: no state assigned, encoded as all zeros
+        all_states = np.arange(1, self.num_chromHMM_state + 1)
+        exp_result = OneHotEncoder(categories = [all_states] * len(self.train_cell_types), handle_unknown = 'ignore').fit_transform(pattern_mat).toarray()
+        obs_result = multiLog.get_predictorX_segmentation_data(self.train_cell_types, self.num_chromHMM_state, pattern_mat)
+        self.assertEqual(exp_result.shape, obs_result.shape)
+        self.assertTrue((exp_result == obs_result).all())
+        obs_result = multiLog.get_predictorX_segmentation_data(self.train_cell_types, self.num_chromHMM_state, pattern_mat, sparse_output = True)
+        self.assertTrue((exp_result == obs_result.toarray()).all())
+        return
+
+    def test_predict_proba_with_pattern_cache(self):
+        code_mat, Y = get_fake_training_data(self.num_chromHMM_state, self.train_cell_types, 2000, 0)
+        X = multiLog.get_predictorX_segmentation_data(self.train_cell_types, self.num_chromHMM_state, code_mat.T)
+        regression_machine = LogisticRegression(random_state = 0, solver = 'lbfgs', max_iter = 10000).fit(X, Y)
+        exp_result = regression_machine.predict_proba(X)
+        pattern_prob_cache = {}
+        obs_result = multiLog.predict_proba_with_pattern_cache(code_mat, self.train_cell_types, self.num_chromHMM_state, regression_machine, pattern_prob_cache)
+        self.assertTrue(np.allclose(exp_result, obs_result, rtol = 0, atol = 1e-12))
+        num_distinct_patterns = len(np.unique(code_mat.T, axis = 0))
+        self.assertEqual(len(pattern_prob_cache), num_distinct_patterns)
+        # a second window with the same patterns in a different order is answered from the cache
+        obs_result = multiLog.predict_proba_with_pattern_cache(code_mat[:, ::-1], self.train_cell_types, self.num_chromHMM_state, regression_machine, pattern_prob_cache)
+        self.assertTrue(np.allclose(exp_result[::-1], obs_result, rtol = 0, atol = 1e-12))
+        self.assertEqual(len(pattern_prob_cache), num_distinct_patterns)
+        return
+
+    def test_get_softmax_proba(self):
+        rng = np.random.default_rng(2)
+        pattern_mat = rng.integers(0, self.num_chromHMM_state + 1, size = (500, len(self.train_cell_types))) # 0: no state assigned
+        X = multiLog.get_predictorX_segmentation_data(self.train_cell_types, self.num_chromHMM_state, pattern_mat)
+        for num_classes in [2, self.num_chromHMM_state]: # sklearn stores the coefficients of binary models differently
+            regression_machine = LogisticRegression(max_iter = 1000).fit(X, rng.integers(1, num_classes + 1, size = X.shape[0]))
+            obs_result = multiLog.get_softmax_proba(pattern_mat, self.num_chromHMM_state, regression_machine.coef_, regression_machine.intercept_)
+            self.assertTrue(np.allclose(regression_machine.predict_proba(X), obs_result, rtol = 0, atol = 1e-12))
+        return
+
+    def test_predict_segmentation_window_parallel(self):
+        testdata_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../testdata/'))
+        output_folder = os.path.join(testdata_folder, 'test_multiLog_window_parallel')
+        segment_folder = os.path.join(output_folder, 'all_ct_segments')
+        helper.make_dir(segment_folder)
+        code_mat, Y = get_fake_training_data(self.num_chromHMM_state, self.train_cell_types, 2000, 3)
+        X = multiLog.get_predictorX_segmentation_data(self.train_cell_types, self.num_chromHMM_state, code_mat.T)
+        regression_machine = LogisticRegression(max_iter = 1000).fit(X, Y)
+        rng = np.random.default_rng(3)
+        window_list = list(map(lambda x: 'chr22_' + str(x), range(5)))
+        for window in window_list:
+            segment_store.save_window(segment_folder, window, rng.integers(0, self.num_chromHMM_state + 1, size = (len(self.train_cell_types), 300)))
+        segment_store.write_store_meta(segment_folder, self.train_cell_types)
+        train_ct_row_indices = segment_store.get_sample_row_indices(segment_folder, self.train_cell_types)
+        model_fn = model_store.get_model_fn(output_folder, 'E016')
+        model_store.save_model(model_fn, regression_machine, self.train_cell_types, 'E016', self.num_chromHMM_state, 0, 1, model_store.get_train_fingerprint([], 0, 1))
+        # the windows predicted by 3 processes sharing the model are the same as the windows predicted by one process
+        exp_fn_list = list(map(lambda x: os.path.join(output_folder, x + '_exp_pred_out.txt.gz'), window_list))
+        obs_fn_list = list(map(lambda x: os.path.join(output_folder, x + '_pred_out.txt.gz'), window_list))
+        multiLog.one_job_run_predict_segmentation(segment_folder, window_list, exp_fn_list, self.train_cell_types, train_ct_row_indices, 'E016', self.num_chromHMM_state, regression_machine, model_fn, 'txt')
+        multiLog.predict_segmentation_window_parallel(segment_folder, window_list, obs_fn_list, self.train_cell_types, train_ct_row_indices, 'E016', self.num_chromHMM_state, regression_machine, model_fn, 'txt', 3)
+        for exp_fn, obs_fn in zip(exp_fn_list, obs_fn_list):
+            exp_df = pd.read_csv(exp_fn, sep = '\t', header = 0)
+            obs_df = pd.read_csv(obs_fn, sep = '\t', header = 0)
+            self.assertEqual(exp_df.shape, (300, self.num_chromHMM_state))
+            self.assertTrue(exp_df.equals(obs_df))
+        # the predictions are up to date, until the model is trained again with another seed
+        self.assertEqual(multiLog.find_uncalculated_gene_regions(output_folder, segment_folder, 0, self.train_cell_types, 'E016', self.num_chromHMM_state, model_fn, 'txt'), [])
+        pred_params_fingerprint = multiLog.get_pred_params_fingerprint(self.train_cell_types, 'E016', self.num_chromHMM_state, 'txt', model_fn)
+        model_store.save_model(model_fn, regression_machine, self.train_cell_types, 'E016', self.num_chromHMM_state, 1, 1, model_store.get_train_fingerprint([], 1, 1))
+        self.assertNotEqual(multiLog.get_pred_params_fingerprint(self.train_cell_types, 'E016', self.num_chromHMM_state, 'txt', model_fn), pred_params_fingerprint)
+        self.assertEqual(multiLog.find_uncalculated_gene_regions(output_folder, segment_folder, 0, self.train_cell_types, 'E016', self.num_chromHMM_state, model_fn, 'txt'), window_list)
+        shutil.rmtree(output_folder)
+        return
+
+    def test_train_from_pattern_counts(self):
+        code_mat, Y = get_fake_training_data(self.num_chromHMM_state, self.train_cell_types, 5000, 1)
+        pattern_mat, pattern_Y, pattern_counts = multiLog.get_pattern_count_table(code_mat.T, Y)
+        self.assertEqual(pattern_counts.sum(), len(Y))
+        self.assertLess(pattern_mat.shape[0], len(Y))
+        X = multiLog.get_predictorX_segmentation_data(self.train_cell_types, self.num_chromHMM_state, code_mat.T)
+        exp_machine = LogisticRegression(random_state = 0, solver = 'lbfgs', max_iter = 10000, tol = 1e-10).fit(X, Y)
+        pattern_X = multiLog.get_predictorX_segmentation_data(self.train_cell_types, self.num_chromHMM_state, pattern_mat)
+        obs_machine = multiLog.train_multinomial_logistic_regression(pattern_X, pattern_Y, self.num_chromHMM_state, 0, pattern_counts)
+        self.assertTrue(np.allclose(exp_machine.coef_, obs_machine.coef_, rtol = 0, atol = 1e-3))
+        self.assertTrue(np.allclose(exp_machine.intercept_, obs_machine.intercept_, rtol = 0, atol = 1e-3))
+        self.assertTrue(np.allclose(exp_machine.predict_proba(X), obs_machine.predict_proba(X), rtol = 0, atol = 1e-4))
+        return
+
+if __name__ == "__main__":
+    unittest.main()
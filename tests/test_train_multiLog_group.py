@@ -0,0 +1,74 @@
+import unittest
+import os
+import sys
+import shutil
+import numpy as np
+from sklearn.linear_model import LogisticRegression
+sys.path.insert(0, os.path.abspath(os.path.join(os.path.dirname(__file__), '../scripts/')))
+import train_multiLog_group as multiLogGroup
+import train_multiLog_auto1Hot as multiLog
+import average_pred_results
+import segment_store
+import model_store
+import helper
+
+
+class TestMultiLogGroupMethods(unittest.TestCase):
+    def test_get_one_response_ct_training_data(self):
+        rng = np.random.default_rng(0)
+        group_code_mat = rng.integers(1, 4, size = (3000, 4)) # rows: training positions, columns: cell types of the group
+        group_pattern_mat, group_pattern_counts = multiLogGroup.get_group_pattern_count_table(group_code_mat)
+        self.assertEqual(group_pattern_counts.sum(), group_code_mat.shape[0])
+        for response_ct_index in range(group_code_mat.shape[1]):
+            # the training table of each model, derived from the group's table, is the same as the one computed from the model's own columns
+            Xtrain_code_mat = np.delete(group_code_mat, response_ct_index, axis = 1)
+            exp_result = multiLog.get_pattern_count_table(Xtrain_code_mat, group_code_mat[:, response_ct_index])
+            obs_result = multiLogGroup.get_one_response_ct_training_data(group_pattern_mat, group_pattern_counts, response_ct_index, 1)
+            for exp_array, obs_array in zip(exp_result, obs_result):
+                self.assertTrue((exp_array == obs_array).all())
+            # one row per training position, up to the order of the rows
+            obs_X, obs_Y, obs_weight = multiLogGroup.get_one_response_ct_training_data(group_pattern_mat, group_pattern_counts, response_ct_index, 0)
+            self.assertIsNone(obs_weight)
+            exp_rows = np.column_stack([Xtrain_code_mat, group_code_mat[:, response_ct_index]])
+            obs_rows = np.column_stack([obs_X, obs_Y])
+            self.assertTrue((np.unique(exp_rows, axis = 0, return_counts = True)[1] == np.unique(obs_rows, axis = 0, return_counts = True)[1]).all())
+        return
+
+    def test_predict_window_list_fused_average(self):
+        testdata_folder = os.path.abspath(os.path.join(os.path.dirname(__file__), '../testdata/'))
+        output_folder = os.path.join(testdata_folder, 'test_multiLog_group')
+        segment_folder = os.path.join(output_folder, 'all_ct_segments')
+        avg_outDir = os.path.join(output_folder, 'avg')
+        for folder in [segment_folder, avg_outDir]:
+            helper.make_dir(folder)
+        num_chromHMM_state = 4
+        ct_list = ['E003', 'E008', 'E014']
+        rng = np.random.default_rng(0)
+        window_list = ['chr22_0', 'chr22_1']
+        for window in window_list:
+            segment_store.save_window(segment_folder, window, rng.integers(1, num_chromHMM_state + 1, size = (len(ct_list), 200)))
+        segment_store.write_store_meta(segment_folder, ct_list)
+        regression_machine_dict = {}
+        for response_ct in ct_list:
+            X = multiLog.get_predictorX_segmentation_data(ct_list[1:], num_chromHMM_state, rng.integers(1, num_chromHMM_state + 1, size = (300, 2)))
+            regression_machine_dict[response_ct] = LogisticRegression(max_iter = 1000).fit(X, rng.integers(1, num_chromHMM_state + 1, size = 300))
+            helper.make_dir(multiLogGroup.get_pred_dir(output_folder, response_ct))
+            model_store.save_model(multiLogGroup.get_model_fn(output_folder, response_ct), regression_machine_dict[response_ct], multiLogGroup.get_train_cell_types(ct_list, response_ct), response_ct, num_chromHMM_state, 0, 1, model_store.get_train_fingerprint([], 0, 1))
+        response_ct_list_per_window = [ct_list] * len(window_list)
+        # write the predictions of each sample, then average them with average_pred_results, vs. average the predictions as they are calculated
+        multiLogGroup.predict_window_list_all_response_ct(segment_folder, window_list, response_ct_list_per_window, output_folder, ct_list, num_chromHMM_state, regression_machine_dict, None, 1, 'txt')
+        self.assertEqual(multiLogGroup.get_response_ct_list_per_window(segment_folder, output_folder, ct_list, num_chromHMM_state, 0, 'txt'), {}) # all the predictions are recorded as up to date
+        pred_dir_list = list(map(lambda x: multiLogGroup.get_pred_dir(output_folder, x), ct_list))
+        for window in window_list:
+            average_pred_results.averaging_prediction_one_window(window, output_folder, pred_dir_list, num_chromHMM_state, 'txt')
+        multiLogGroup.predict_window_list_all_response_ct(segment_folder, window_list, response_ct_list_per_window, output_folder, ct_list, num_chromHMM_state, regression_machine_dict, avg_outDir, 0, 'txt')
+        for window in window_list:
+            exp_df = average_pred_results.read_rep_df(os.path.join(output_folder, window + '_avg_pred.txt.gz'), num_chromHMM_state)
+            obs_df = average_pred_results.read_rep_df(os.path.join(avg_outDir, window + '_avg_pred.txt.gz'), num_chromHMM_state)
+            self.assertEqual(exp_df.shape, (200, num_chromHMM_state))
+            self.assertTrue(np.allclose(exp_df.values, obs_df.values, rtol = 0, atol = 1e-6)) # average_pred_results sums the predictions in float32
+        shutil.rmtree(output_folder)
+        return
+
+if __name__ == "__main__":
+    unittest.main()